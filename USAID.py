@@ -1,15 +1,46 @@
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 from dotenv import load_dotenv
+import copy
+import functools
 import os
+import threading
+import time
+import weakref
 import pandas as pd
-import requests
-import snowflake.connector
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
-import numpy as np
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from analyst import (
+    REQUEST_ID_HEADER,
+    AnalystClient,
+    ContentStream,
+    check_status,
+    fix_sql_dates,
+    iter_sse_events,
+    read_response,
+    request_body,
+    response_key,
+    trim_history,
+)
+from backends import QueryBackend, create_backend
+from catalog import DEFAULT_CATALOG, CatalogStore
+from cache import BoundedCache, DiskCache, frame_nbytes, json_nbytes, normalize_sql, page_key
+from charting import OTHER_LABEL, downsample_line, is_temporal, top_n_other
+from cube import CUBE_QUERY, ShipmentCube
+from delays import CODE_LOOKUP_PATH, DELAY_QUERY, DelayCube, load_code_lookup
+from guard import GuardError, GuardLimits, guarded_page
+from perf import PerfLog, RerunRecorder
+from queries import FilterState, Query
+from refresh import Refresher
+from rollups import DEFAULT_MANIFEST, Rollup, read_manifest, route
+from semantic import concat_frames, model_version
+from sketches import RELATIVE_ACCURACY, DurationSketches, sketch_query
+
+# Heavy modules are imported where first needed: plotly by the chart section,
+# requests by the Analyst client, the Snowflake connector by its backend
+if TYPE_CHECKING:
+    import requests
 
 
 st.set_page_config(
@@ -42,76 +73,190 @@ js = '''
 st.title("🌍 Global Health Commodity Distribution Dashboard")
 st.components.v1.html(js)
 
-# Initialize Snowflake connection
-if 'CONN' not in st.session_state or st.session_state.CONN is None:
+# Initialize the query backend (Snowflake, or a local Parquet snapshot).
+# One backend, and so one connection pool, is shared by every session.
+@st.cache_resource
+def get_backend() -> QueryBackend:
+    return create_backend(st.secrets)
+
+if 'BACKEND' not in st.session_state or st.session_state.BACKEND is None:
     try:
-        p_key = serialization.load_pem_private_key(
-            st.secrets["SNOWFLAKE_PRIVATE_KEY"].encode('utf-8'),
-            password=None,
-            backend=default_backend()
-        )
-        
-        st.session_state.CONN = snowflake.connector.connect(
-            user=st.secrets["SNOWFLAKE_USER"],
-            account=st.secrets["SNOWFLAKE_ACCOUNT"],
-            private_key=p_key,
-            warehouse=st.secrets["SNOWFLAKE_WAREHOUSE"],
-            role=st.secrets["SNOWFLAKE_ROLE"],
-            database=st.secrets["SNOWFLAKE_DATABASE"],
-            schema=st.secrets["SNOWFLAKE_SCHEMA"]
-        )
+        st.session_state.BACKEND = get_backend()
     except Exception as e:
-        st.error(f"Failed to connect to Snowflake: {str(e)}")
+        st.error(f"Failed to connect to {st.secrets.get('QUERY_BACKEND', 'snowflake')} backend: {str(e)}")
         raise e
 
+@st.cache_resource
+def get_perf_log() -> PerfLog:
+    """Process-wide timing log; PERF_LOG names a JSONL file to append every span to."""
+    return PerfLog(st.secrets.get("PERF_LOG"))
+
+# Spans of this rerun, for the performance panel and the timing log
+st.session_state.perf_reruns = st.session_state.get("perf_reruns", 0) + 1
+st.session_state.perf = RerunRecorder(
+    get_perf_log(),
+    session=get_script_run_ctx().session_id,
+    rerun=st.session_state.perf_reruns,
+)
+
+def timed(name: str, **fields: Any):
+    """Time a block as part of this rerun; see ``perf.RerunRecorder.timed``."""
+    return st.session_state.perf.timed(name, **fields)
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
     st.session_state.suggestions = []
     st.session_state.active_suggestion = None
 
+@st.cache_data
+def get_semantic_model_version() -> str:
+    """SEMANTIC_MODEL_VERSION if set, else a hash of the local semantic layer YAML."""
+    return model_version(st.secrets)
+
+def disk_cache(tier: str, ttl: float, codec: str) -> Optional[DiskCache]:
+    """On-disk tier ``tier`` under DISK_CACHE_DIR, shared with other app processes; None if unset."""
+    directory = st.secrets.get("DISK_CACHE_DIR")
+    if not directory:
+        return None
+    return DiskCache(
+        os.path.join(directory, tier),
+        max_bytes=st.secrets.get("DISK_CACHE_MB", 1024) * 2**20,
+        ttl=ttl,
+        codec=codec,
+    )
+
+@st.cache_resource
+def get_analyst_cache() -> BoundedCache:
+    """Process-wide Cortex Analyst response cache, shared by all sessions."""
+    ttl = st.secrets.get("ANALYST_CACHE_TTL", 24 * 3600)
+    return BoundedCache(
+        max_bytes=st.secrets.get("ANALYST_CACHE_MB", 16) * 2**20,
+        ttl=ttl,
+        sizeof=json_nbytes,
+        disk=disk_cache("analyst", ttl, codec="json"),
+    )
+
+def analyst_request() -> Tuple[Dict[str, Any], str]:
+    """Request body for the current conversation, and its response-cache key."""
+    body = request_body(trim_history(st.session_state.messages, st.secrets.get("ANALYST_HISTORY_TURNS", 3)), st.secrets)
+    model_version = get_semantic_model_version()
+    get_analyst_cache().set_version(model_version)
+    return body, response_key(body, model_version)
+
+@st.cache_resource
+def get_analyst_client() -> AnalystClient:
+    """Process-wide Analyst client; its keep-alive connections are shared by all sessions."""
+    # ANALYST_URL points at a stand-in endpoint, e.g. the benchmark's mock server
+    url = st.secrets.get("ANALYST_URL") or f"https://{st.secrets['SNOWFLAKE_HOST']}/api/v2/cortex/analyst/message"
+    backend = get_backend()
+    return AnalystClient(
+        url,
+        token=lambda refresh: backend.token(refresh=refresh),
+        timeout=(10.0, st.secrets.get("ANALYST_TIMEOUT", 120)),
+        retries=st.secrets.get("ANALYST_RETRIES", 3),
+    )
+
+def post_to_analyst(request_body: Dict[str, Any], stream: bool = False) -> "requests.Response":
+    return get_analyst_client().post(request_body, stream=stream)
+
+def rollback_user_message() -> None:
+    # Rollback last user message if request failed
+    if len(st.session_state.messages) > 0 and st.session_state.messages[-1]["role"] == "user":
+        st.session_state.messages.pop()
+
 def send_message() -> Dict[str, Any]:
     """Send the entire conversation to the Snowflake Cortex Analyst API."""
-    request_body = {
-        "messages": st.session_state.messages,
-        "semantic_model_file": f"@{st.secrets['SNOWFLAKE_DATABASE']}.{st.secrets['SNOWFLAKE_SCHEMA']}.{st.secrets['SNOWFLAKE_STAGE']}/{st.secrets['SNOWFLAKE_FILE']}",
-    }
+    with timed("analyst", streaming=False) as span:
+        return _send_message(span)
 
+def _send_message(span: Dict[str, Any]) -> Dict[str, Any]:
+    request_body, cache_key = analyst_request()
+    span["request_bytes"] = json_nbytes(request_body)
+
+    def fetch() -> Dict[str, Any]:
+        try:
+            resp = post_to_analyst(request_body)
+            request_id = resp.headers.get(REQUEST_ID_HEADER)
+            span.update(request_id=request_id, status=resp.status_code, payload_bytes=len(resp.content))
+            if resp.status_code >= 400:
+                rollback_user_message()
+            return read_response(resp)
+        except Exception as e:
+            st.error(f"Error in send_message: {str(e)}")
+            raise e
+
+    response, span["cache"] = get_analyst_cache().get_or_compute(cache_key, fetch)
+    span["request_id"] = response["request_id"]
+    return copy.deepcopy(response)
+
+def stream_message(message_index: int, artifacts: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """Stream the Analyst's answer, rendering each content item as it arrives.
+
+    Text is shown as it is generated, and each SQL statement runs as soon as
+    its block is complete rather than after the whole response.
+    """
+    with timed("analyst", streaming=True) as span:
+        return _stream_message(message_index, artifacts, span)
+
+def _stream_message(message_index: int, artifacts: Dict[int, Dict[str, Any]], span: Dict[str, Any]) -> Dict[str, Any]:
+    request_body, cache_key = analyst_request()
+    span["request_bytes"] = json_nbytes(request_body)
+    cached, span["cache"] = get_analyst_cache().get_or_compute(
+        cache_key, lambda: _stream_response(request_body, message_index, artifacts, span)
+    )
+    response = copy.deepcopy(cached)
+    span["request_id"] = response["request_id"]
+    if span["cache"] != "miss":
+        # Streamed answers were displayed as they arrived; cached ones are shown whole
+        display_content(response["message"]["content"], response["request_id"], message_index, artifacts)
+    return response
+
+def _stream_response(
+    request_body: Dict[str, Any],
+    message_index: int,
+    artifacts: Dict[int, Dict[str, Any]],
+    span: Dict[str, Any],
+) -> Dict[str, Any]:
     try:
-        resp = requests.post(
-            url=f"https://{st.secrets['SNOWFLAKE_HOST']}/api/v2/cortex/analyst/message",
-            json=request_body,
-            headers={
-                "Authorization": f'Snowflake Token="{st.session_state.CONN.rest.token}"',
-                "Content-Type": "application/json",
-            },
-        )
-        request_id = resp.headers.get("X-Snowflake-Request-Id")
-        
-        if resp.status_code < 400:
-            response_data = resp.json()
-            
-            # If there's SQL in the response, ensure dates are properly formatted
-            if "message" in response_data and "content" in response_data["message"]:
-                for item in response_data["message"]["content"]:
-                    if item.get("type") == "sql":
-                        # Convert date formats in SQL
-                        item["statement"] = item["statement"].replace(
-                            "MM-DD-YYYY", 
-                            "YYYY-MM-DD"
-                        )
-                        
-            return {**response_data, "request_id": request_id}
-        else:
-            # Rollback last user message if request failed
-            if len(st.session_state.messages) > 0 and st.session_state.messages[-1]["role"] == "user":
-                st.session_state.messages.pop()
-            raise Exception(
-                f"Failed request (id: {request_id}) with status {resp.status_code}: {resp.text}"
-            )
+        resp = post_to_analyst({**request_body, "stream": True}, stream=True)
+        request_id = resp.headers.get(REQUEST_ID_HEADER)
+        span.update(request_id=request_id, status=resp.status_code, payload_bytes=0)
+        check_status(resp)
+        if request_id:
+            with st.expander("Request ID", expanded=False):
+                st.markdown(request_id)
+
+        status = st.empty()
+        slots = {}
+        started = time.perf_counter()
+        def lines() -> Iterator[bytes]:
+            for line in resp.iter_lines():
+                span["payload_bytes"] += len(line) + 1
+                yield line
+
+        stream = ContentStream(iter_sse_events(lines()), request_id=request_id)
+        with resp:
+            for kind, index, payload in stream:
+                if kind == "status":
+                    status.caption(payload)
+                    continue
+                span.setdefault("first_item_seconds", round(time.perf_counter() - started, 4))
+                if index not in slots:
+                    slots[index] = st.empty()
+                if kind == "delta" and payload["type"] == "text":
+                    slots[index].markdown(payload["text"])
+                elif kind == "complete":
+                    fix_sql_dates(payload)
+                    with slots[index].container():
+                        display_item(payload, message_index, index, artifacts)
+        status.empty()
     except Exception as e:
-        st.error(f"Error in send_message: {str(e)}")
+        rollback_user_message()
+        st.error(f"Error in stream_message: {str(e)}")
         raise e
 
+    return {"message": {"role": "analyst", "content": stream.content}, "request_id": request_id}
+
 def process_message(prompt: str) -> None:
     # Append user message
     st.session_state.messages.append(
@@ -121,102 +266,392 @@ def process_message(prompt: str) -> None:
         st.markdown(prompt)
     
     with st.chat_message("analyst"):
-        with st.spinner("Generating response..."):
-            response = send_message()
-            request_id = response["request_id"]
-            content = response["message"]["content"]
-            
-            st.session_state.messages.append(
-                {"role": "analyst", "content": content, "request_id": request_id}
+        message_index = len(st.session_state.messages)
+        # Query results and chart inputs, kept with the message so reruns reuse them
+        artifacts: Dict[int, Dict[str, Any]] = {}
+        if st.secrets.get("ANALYST_STREAMING", False):
+            response = stream_message(message_index, artifacts)
+        else:
+            with st.spinner("Generating response..."):
+                response = send_message()
+                display_content(
+                    content=response["message"]["content"],
+                    request_id=response["request_id"],
+                    message_index=message_index,
+                    artifacts=artifacts,
+                )
+        st.session_state.messages.append({
+            "role": "analyst",
+            "content": response["message"]["content"],
+            "request_id": response["request_id"],
+            "artifacts": artifacts,
+        })
+
+@st.cache_resource
+def get_result_cache() -> BoundedCache:
+    """Process-wide query result cache, bounded by RESULT_CACHE_MB and RESULT_CACHE_TTL."""
+    ttl = st.secrets.get("RESULT_CACHE_TTL", 3600)
+    return BoundedCache(
+        max_bytes=st.secrets.get("RESULT_CACHE_MB", 256) * 2**20,
+        ttl=ttl,
+        disk=disk_cache("results", ttl, codec="frame"),
+    )
+
+def cached_query(key: Any, sql: str, compute: Callable[[], pd.DataFrame], name: str = "query") -> pd.DataFrame:
+    """Serve ``key`` from the result cache, or compute, report errors and store it."""
+    cache = get_result_cache()
+    cache.set_version(get_data_version())
+
+    def compute_reporting_errors() -> pd.DataFrame:
+        try:
+            return compute()
+        except GuardError:
+            raise
+        except Exception as e:
+            st.error(f"SQL Error: {str(e)}")
+            st.error(f"Problematic SQL: {sql}")
+            raise e
+
+    with timed(name, sql=normalize_sql(sql)[:200]) as span:
+        df, span["cache"] = cache.get_or_compute(key, compute_reporting_errors)
+        span.update(queries=int(span["cache"] == "miss"), rows=len(df.index), bytes=frame_nbytes(df), query_id=df.attrs.get("query_id"))
+    # Shallow copy so callers can't add or drop columns on the cached frame
+    return df.copy(deep=False)
+
+def fetch_page_guarded(sql: str, offset: int, limit: int, max_bytes: int) -> pd.DataFrame:
+    """``guarded_page`` on the session's backend, showing how long the statement has run."""
+    status = st.empty()
+    with timed("guard", sql=normalize_sql(sql)[:200], offset=offset) as span:
+        try:
+            return guarded_page(
+                st.session_state.BACKEND,
+                sql,
+                offset,
+                limit,
+                max_bytes,
+                GuardLimits.from_secrets(st.secrets),
+                # Each UI update is also where Streamlit stops a script whose session reran or left
+                heartbeat=lambda elapsed: status.caption(f"Running for {elapsed:.0f}s..."),
+                on_estimate=span.update,
             )
-            display_content(content=content, request_id=request_id)
+        except GuardError as e:
+            span["guard"] = e.guard
+            raise
+        except Exception:
+            raise
+        except BaseException:
+            span["guard"] = "cancelled"
+            raise
+        finally:
+            status.empty()
 
-@st.cache_data
-def run_sql(sql: str) -> pd.DataFrame:
-    """Use Snowflake connector directly with fetch_pandas_all."""
-    try:
-        # Convert any date literals to ISO format
-        sql = sql.replace("'MM-DD-YYYY'", "'YYYY-MM-DD'")
-        
-        with st.session_state.CONN.cursor() as cur:
-            cur.execute(sql)
-            df = cur.fetch_pandas_all()
+def run_sql_page(sql: str, offset: int, limit: int, max_bytes: int) -> Tuple[pd.DataFrame, bool]:
+    """One page of a query's result and whether more rows follow.
+
+    Used for Analyst-generated SQL, whose result size is unknown: the LIMIT is
+    pushed to the server (on Snowflake, pages after the first scan one stored
+    full run, see ``SnowflakeBackend.fetch_page``) and rows are fetched in
+    batches, so memory per page is bounded whatever the statement. Fetching also stops once the page
+    reaches ``max_bytes``; such a page reports more rows to follow.
+    """
+    sql = sql.replace("'MM-DD-YYYY'", "'YYYY-MM-DD'")
+    key = page_key(sql, offset, limit, max_bytes)
+    df = cached_query(key, sql, lambda: fetch_page_guarded(sql, offset, limit, max_bytes), name="query_page")
+    return df.iloc[:limit], len(df.index) > limit or frame_nbytes(df) >= max_bytes
+
+@st.cache_resource
+def get_catalog_store() -> CatalogStore:
+    """Filter options saved at CATALOG_PATH, shared by all sessions."""
+    return CatalogStore(st.secrets.get("CATALOG_PATH", DEFAULT_CATALOG))
+
+@st.cache_resource
+def get_code_lookup() -> pd.DataFrame:
+    """Delay reason codes, names and categories, loaded once per process."""
+    return load_code_lookup(st.secrets.get("CODE_LOOKUP_PATH", CODE_LOOKUP_PATH))
+
+class Dashboard(NamedTuple):
+    rollups: List[Rollup]
+    cube: ShipmentCube
+    delays: Optional[DelayCube]  # None if the delay query failed; the rest still serves
+    durations: DurationSketches
+    delays_error: Optional[str] = None
+
+def build_dashboard(
+    backend: QueryBackend,
+    store: CatalogStore,
+    log: PerfLog,
+    manifest: str,
+    lookup: pd.DataFrame,
+    pool: Executor,
+    data_version: str,
+) -> Dashboard:
+    """Rollups, shipment and delay cubes, duration sketches and filter catalog for one data version.
+
+    Runs on the refresher's thread, outside any session, so everything it
+    needs is passed in and its spans go under the session name "refresher".
+    Once the rollups are known, the cube, delay, sketch and catalog queries
+    run concurrently on ``pool``. The delay section is optional: if its query
+    fails the rest is still returned, with the error in ``delays_error``.
+    """
+    recorder = RerunRecorder(log, session="refresher", data_version=data_version)
+    rollups = read_manifest(manifest, backend)
+    backend.register_rollups(rollups)
+
+    def timed_execute(name: str, sql: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        with recorder.timed(name, sql=normalize_sql(sql)[:200], cache="miss", queries=1) as span:
+            df = backend.execute(sql, params)
+            span.update(rows=len(df.index), bytes=frame_nbytes(df), query_id=df.attrs.get("query_id"))
         return df
+
+    cube = pool.submit(timed_execute, "cube", *route(CUBE_QUERY, rollups))
+    delays = pool.submit(timed_execute, "delays", *route(DELAY_QUERY, rollups))
+    sketches = pool.submit(timed_execute, "sketches", sketch_query())
+    catalog_queries: List[Query] = []
+
+    def run_catalog_query(query: Query) -> pd.DataFrame:
+        catalog_queries.append(query)  # list.append is atomic across the pool's threads
+        return backend.execute(*route(query, rollups))
+
+    with recorder.timed("catalog") as span:
+        saved = store.current
+        refreshed = store.refresh(data_version, run_catalog_query, executor=pool)
+        span.update(cache="hit" if refreshed is saved else "miss", queries=len(catalog_queries))
+    try:
+        delay_cube, delays_error = DelayCube(delays.result(), lookup), None
     except Exception as e:
-        st.error(f"SQL Error: {str(e)}")
-        st.error(f"Problematic SQL: {sql}")
-        raise e
+        delay_cube, delays_error = None, f"{type(e).__name__}: {e}"
+    return Dashboard(rollups, ShipmentCube(cube.result()), delay_cube, DurationSketches(sketches.result()), delays_error)
+
+@st.cache_resource
+def get_refresher() -> Refresher:
+    """Dashboard aggregates shared by all sessions.
+
+    The HCD data version is probed every DATA_VERSION_TTL seconds on a
+    background thread; when it changes the aggregates are rebuilt there while
+    visitors keep getting the previous ones.
+    """
+    backend = get_backend()
+    # Its own pool: the first build runs on a query pool worker, which would
+    # otherwise wait on tasks queued behind it
+    pool = ThreadPoolExecutor(max_workers=st.secrets.get("QUERY_WORKERS", 4), thread_name_prefix="dashboard")
+    build = functools.partial(
+        build_dashboard,
+        backend,
+        get_catalog_store(),
+        get_perf_log(),
+        st.secrets.get("ROLLUP_MANIFEST", DEFAULT_MANIFEST),
+        get_code_lookup(),
+        pool,
+    )
+    refresher = Refresher(backend.data_version, build, interval=st.secrets.get("DATA_VERSION_TTL", 300))
+    # The pool's workers outlive the refresher otherwise, e.g. when Streamlit's
+    # resource cache is cleared
+    weakref.finalize(refresher, pool.shutdown, wait=False)
+    return refresher
+
+def get_data_version() -> str:
+    """Version of the HCD data the dashboard's aggregates were built from."""
+    return get_refresher().get().data_version
+
+@st.cache_resource
+def get_query_pool() -> ThreadPoolExecutor:
+    """Bounded worker pool for independent queries, shared by all sessions."""
+    return ThreadPoolExecutor(
+        max_workers=st.secrets.get("QUERY_WORKERS", 4),
+        thread_name_prefix="query",
+    )
+
+def submit_query(fn: Callable[..., Any], *args: Any) -> Future:
+    """Run ``fn(*args)`` on the query pool with this session's script context attached."""
+    ctx = get_script_run_ctx()
+
+    def call() -> Any:
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args)
+
+    return get_query_pool().submit(call)
+
+def prepare_result(df: pd.DataFrame, has_more: bool = False) -> Dict[str, Any]:
+    """Run the per-result work (dtype selection, indexing, chart reduction) once."""
+    chart_df = df.set_index(df.columns[0]) if len(df.columns) > 1 else df
+    # Get numeric columns only
+    numeric_cols = chart_df.select_dtypes(include='number').columns.tolist()
+    # If it's a time series chart
+    time_cols = [col for col in chart_df.columns if any(time_word in col.lower() for time_word in ['time', 'date', 'year', 'month'])]
+    line_x = time_cols[0] if time_cols and numeric_cols else None
+    line_y = [col for col in numeric_cols if col != line_x]
+    # Charts get a reduced copy; the Data tab keeps every row
+    max_points = st.secrets.get("CHART_MAX_POINTS", 2000)
+    line_df = downsample_line(chart_df, line_y, x=line_x, max_points=max_points)
+    if not numeric_cols:
+        bar_df = None
+    elif is_temporal(chart_df.index):
+        # A timeline keeps its time order; it is thinned like a line instead
+        bar_df = downsample_line(chart_df[numeric_cols], numeric_cols, max_points=max_points)
+    else:
+        bar_df = top_n_other(chart_df, numeric_cols, n=st.secrets.get("CHART_MAX_CATEGORIES", 25))
+    return {
+        "df": df,
+        "chart_df": chart_df,
+        "numeric_cols": numeric_cols,
+        "time_cols": time_cols,
+        "line_df": line_df,
+        "line_x": line_x,
+        "line_y": line_y,
+        "bar_df": bar_df,
+        "has_more": has_more,
+    }
+
+def load_result(sql: str, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Fetch the first page of ``sql``'s result, or the page after ``previous``."""
+    offset = 0 if previous is None else len(previous["df"].index)
+    # The last page is trimmed so the total never exceeds RESULT_MAX_ROWS or RESULT_MAX_MB
+    limit = min(st.secrets.get("RESULT_PAGE_ROWS", 5_000), st.secrets.get("RESULT_MAX_ROWS", 50_000) - offset)
+    used = 0 if previous is None else previous["nbytes"]
+    page, has_more = run_sql_page(sql, offset, limit, max_bytes=st.secrets.get("RESULT_MAX_MB", 100) * 2**20 - used)
+    nbytes = used + frame_nbytes(page)
+    if previous is not None:
+        page = concat_frames([previous["df"], page])
+    return {**prepare_result(page, has_more), "nbytes": nbytes}
 
 def display_content(
     content: List[Dict[str, Any]],
     request_id: Optional[str] = None,
     message_index: Optional[int] = None,
+    artifacts: Optional[Dict[int, Dict[str, Any]]] = None,
+    show_results: bool = True,
 ) -> None:
     message_index = message_index or len(st.session_state.messages)
-    if request_id:
-        with st.expander("Request ID", expanded=False):
-            st.markdown(request_id)
-    for item in content:
-        if item["type"] == "text":
-            st.markdown(item["text"])
-        elif item["type"] == "suggestions":
-            with st.expander("Suggestions", expanded=True):
-                for suggestion_index, suggestion in enumerate(item["suggestions"]):
-                    if st.button(suggestion, key=f"{message_index}_{suggestion_index}"):
-                        st.session_state.active_suggestion = suggestion
-        elif item["type"] == "sql":
-            with st.expander("SQL Query", expanded=False):
-                st.code(item["statement"], language="sql")
-            with st.expander("Results", expanded=True):
-                with st.spinner("Running SQL..."):
-                    df = run_sql(item["statement"])
-                    if len(df.index) > 1:
-                        data_tab, line_tab, bar_tab = st.tabs(["Data", "Line Chart", "Bar Chart"])
-                        data_tab.dataframe(df)
-                        
-                        # Get numeric columns only
-                        numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
-                        
-                        if len(df.columns) > 1:
-                            df = df.set_index(df.columns[0])
-                        
-                        with line_tab:
-                            try:
-                                # If it's a time series chart
-                                time_cols = [col for col in df.columns if any(time_word in col.lower() for time_word in ['time', 'date', 'year', 'month'])]
-                                
-                                if time_cols and numeric_cols:  # If we found both time and numeric columns
-                                    st.line_chart(
-                                        data=df,
-                                        x=time_cols[0],
-                                        y=numeric_cols
-                                    )
-                                elif numeric_cols:  # If we only found numeric columns
-                                    st.line_chart(
-                                        data=df[numeric_cols]
-                                    )
-                                else:
-                                    st.error("No numeric columns found to plot")
-                                
-                            except Exception as e:
-                                st.error(f"Error displaying line chart: {str(e)}")
-                                st.write("Available columns:", df.columns.tolist())
-                                st.write("Numeric columns:", numeric_cols)
-                        
-                        with bar_tab:
-                            try:
-                                if numeric_cols:
-                                    st.bar_chart(
-                                        data=df[numeric_cols]
-                                    )
-                                else:
-                                    st.error("No numeric columns found to plot")
-                            except Exception as e:
-                                st.error(f"Error displaying bar chart: {str(e)}")
-                                st.write("Available columns:", df.columns.tolist())
-                                st.write("Numeric columns:", numeric_cols)
-                    else:
-                        st.dataframe(df)
+    artifacts = {} if artifacts is None else artifacts
+    with timed("render", message=message_index, items=len(content), results=show_results):
+        if request_id:
+            with st.expander("Request ID", expanded=False):
+                st.markdown(request_id)
+        for item_index, item in enumerate(content):
+            display_item(item, message_index, item_index, artifacts, show_results)
+
+def display_item(
+    item: Dict[str, Any],
+    message_index: int,
+    item_index: int,
+    artifacts: Dict[int, Dict[str, Any]],
+    show_results: bool = True,
+) -> None:
+    """Render one Analyst content item: text, suggestion buttons, or SQL with results.
+
+    SQL results are computed on first display and stored in ``artifacts``
+    under ``item_index``; later reruns render from there without re-querying.
+    """
+    if item["type"] == "text":
+        st.markdown(item["text"])
+    elif item["type"] == "suggestions":
+        with st.expander("Suggestions", expanded=True):
+            for suggestion_index, suggestion in enumerate(item["suggestions"]):
+                if st.button(suggestion, key=f"{message_index}_{suggestion_index}"):
+                    st.session_state.active_suggestion = suggestion
+    elif item["type"] == "sql":
+        with st.expander("SQL Query", expanded=False):
+            st.code(item["statement"], language="sql")
+        if not show_results:
+            return
+        with st.expander("Results", expanded=True):
+            if item_index not in artifacts:
+                try:
+                    with st.spinner("Running SQL..."):
+                        artifacts[item_index] = load_result(item["statement"])
+                except GuardError as e:
+                    # Kept, so reruns repeat the warning rather than the statement
+                    artifacts[item_index] = {"stopped": f"Query stopped by the {e.guard} guard: {e}."}
+            result = artifacts[item_index]
+            if "stopped" in result:
+                st.warning(result["stopped"])
+                return
+            display_result(result, key=f"{message_index}_{item_index}")
+            if result["has_more"]:
+                shown = len(result["df"].index)
+                if shown >= st.secrets.get("RESULT_MAX_ROWS", 50_000):
+                    limit = " (row limit reached)"
+                elif result["nbytes"] >= st.secrets.get("RESULT_MAX_MB", 100) * 2**20:
+                    limit = " (size limit reached)"
+                else:
+                    limit = ""
+                st.caption(f"Showing the first {shown:,} rows{limit}.")
+                if not limit and st.button("Load more rows", key=f"more_{message_index}_{item_index}"):
+                    try:
+                        with st.spinner("Fetching more rows..."):
+                            artifacts[item_index] = load_result(item["statement"], previous=result)
+                    except GuardError as e:
+                        st.warning(f"Query stopped by the {e.guard} guard: {e}.")
+                        return
+                    st.rerun()
+
+def display_result(result: Dict[str, Any], key: str) -> None:
+    df = result["df"]
+    if len(df.index) <= 1:
+        st.dataframe(df)
+        return
+    chart_df = result["chart_df"]
+    numeric_cols = result["numeric_cols"]
+
+    data_tab, line_tab, bar_tab = st.tabs(["Data", "Line Chart", "Bar Chart"])
+    with data_tab, timed("chart", chart="result_data", result=key, rows=len(df.index)):
+        page_rows = st.secrets.get("DATA_PAGE_ROWS", 1_000)
+        if len(df.index) > page_rows:
+            pages = -(-len(df.index) // page_rows)
+            page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, key=f"page_{key}")
+            st.dataframe(df.iloc[(page - 1) * page_rows:page * page_rows])
+        else:
+            st.dataframe(df)
+
+    with line_tab, timed("chart", chart="result_line", result=key, rows=len(result["line_df"].index)):
+        try:
+            line_df = result["line_df"]
+            if len(line_df.index) < len(chart_df.index):
+                st.caption(f"Showing {len(line_df.index):,} of {len(chart_df.index):,} points, downsampled to preserve shape.")
+            if result["line_x"]:  # If we found both time and numeric columns
+                st.line_chart(
+                    data=line_df,
+                    x=result["line_x"],
+                    y=result["line_y"]
+                )
+            elif numeric_cols:  # If we only found numeric columns
+                st.line_chart(
+                    data=line_df[numeric_cols]
+                )
+            else:
+                st.error("No numeric columns found to plot")
+            
+        except Exception as e:
+            st.error(f"Error displaying line chart: {str(e)}")
+            st.write("Available columns:", chart_df.columns.tolist())
+            st.write("Numeric columns:", numeric_cols)
+    
+    with bar_tab, timed("chart", chart="result_bar", result=key):
+        try:
+            if numeric_cols:
+                bar_df = result["bar_df"]
+                if OTHER_LABEL in bar_df.index:
+                    st.caption(f"Top {len(bar_df.index) - 1:,} categories; the rest are grouped as \"{OTHER_LABEL}\".")
+                st.bar_chart(
+                    data=bar_df
+                )
+            else:
+                st.error("No numeric columns found to plot")
+        except Exception as e:
+            st.error(f"Error displaying bar chart: {str(e)}")
+            st.write("Available columns:", chart_df.columns.tolist())
+            st.write("Numeric columns:", numeric_cols)
+
+# The dashboard's aggregates come back at once, except on the process's very
+# first rerun, which builds them while the filter widgets draw
+dashboard_future = submit_query(get_refresher().get)
+
+# Filter options come from the saved catalog, so the widgets draw without
+# waiting on a query; building the aggregates also rebuilds a stale catalog
+store = get_catalog_store()
+if store.current is None:
+    dashboard_future.result()
+catalog = store.current
 
 # Header
 st.markdown("""
@@ -240,31 +675,11 @@ with st.expander("ℹ️ About the Dataset", expanded=False):
     """)
 
 # Filters
-# Get years for checkboxes
-years_query = """
-    SELECT DISTINCT LATEST_ACTUAL_DELIVERY_DATE_YEAR AS YEAR 
-    FROM HCD 
-    WHERE LATEST_ACTUAL_DELIVERY_DATE_YEAR IS NOT NULL 
-    ORDER BY YEAR DESC
-"""
-years = run_sql(years_query)['YEAR'].tolist()
-years = [int(year) for year in years]
+years = catalog.years
 
 # Get unique health elements and countries
-health_elements = run_sql("""
-    SELECT DISTINCT D365_HEALTH_ELEMENT 
-    FROM HCD 
-    WHERE D365_HEALTH_ELEMENT NOT IN ('HIV', 'Population TO3', '311Mission', 'Tuberculosis') 
-    ORDER BY D365_HEALTH_ELEMENT
-""")['D365_HEALTH_ELEMENT'].tolist()
-health_elements = ['All'] + health_elements
-
-countries = run_sql("""
-    SELECT DISTINCT COUNTRY 
-    FROM HCD 
-    ORDER BY COUNTRY
-""")['COUNTRY'].tolist()
-countries = ['All'] + countries
+health_elements = ['All'] + catalog.health_elements
+countries = ['All'] + catalog.countries
 
 # Create three columns for filters
 filter_col1, filter_col2, filter_col3 = st.columns(3)
@@ -298,161 +713,115 @@ with filter_col3:
         index=0
     )
 
-# Modify the WHERE clauses in queries to handle year selection
-if all_years:
-    year_filter = "1=1"  # No filter on year if 'All' is selected
-else:
-    year_filter = f"LATEST_ACTUAL_DELIVERY_DATE_YEAR IN ({','.join(map(str, selected_years))})"
+# Resolve the widget state into a canonical filter state
+filters = FilterState.from_selection(
+    years=None if all_years else selected_years,
+    health_element=selected_health_element,
+    country=selected_country,
+)
+snapshot = dashboard_future.result()
+cube = snapshot.value.cube
+delays = snapshot.value.delays
+durations = snapshot.value.durations
+st.caption(f"Data as of {time.strftime('%Y-%m-%d %H:%M %Z', time.localtime(snapshot.as_of))}")
 
-health_element_filter = "" if selected_health_element == 'All' else f"D365_HEALTH_ELEMENT = '{selected_health_element}'"
-country_filter = "" if selected_country == 'All' else f"COUNTRY = '{selected_country}'"
+# Imported here rather than at the top so the filter widgets draw first
+import plotly.express as px
 
 # Key Metrics Row
 col1, col2, col3 = st.columns(3)
 
 with col1:
-    total_shipments_query = f"""
-    SELECT COUNT(*) AS TOTAL_SHIPMENTS 
-    FROM HCD 
-    WHERE 1=1
-    AND {year_filter}
-    {' AND ' + health_element_filter if health_element_filter else ''}
-    {' AND ' + country_filter if country_filter else ''}
-    """
-    total_shipments = run_sql(total_shipments_query)['TOTAL_SHIPMENTS'].iloc[0]
+    total_shipments = cube.total_shipments(filters)
     st.metric("Total Shipments", f"{total_shipments:,}")
 
 with col2:
-    countries_supported_query = f"""
-    SELECT COUNT(DISTINCT COUNTRY) AS COUNTRIES_SUPPORTED 
-    FROM HCD 
-    WHERE 1=1
-    {' AND ' + year_filter if year_filter else ''}
-    {' AND ' + health_element_filter if health_element_filter else ''}
-    {' AND ' + country_filter if country_filter else ''}
-    """
-    countries_supported = run_sql(countries_supported_query)['COUNTRIES_SUPPORTED'].iloc[0]
+    countries_supported = cube.countries_supported(filters)
     st.metric("Countries Supported", countries_supported)
 
 with col3:
-    year_range_query = f"""
-    SELECT 
-        MIN(LATEST_ACTUAL_DELIVERY_DATE_YEAR) AS MIN_YEAR,
-        MAX(LATEST_ACTUAL_DELIVERY_DATE_YEAR) AS MAX_YEAR
-    FROM HCD
-    WHERE 1=1
-    {' AND ' + year_filter if year_filter else ''}
-    {' AND ' + health_element_filter if health_element_filter else ''}
-    {' AND ' + country_filter if country_filter else ''}
-    """
-    year_range = run_sql(year_range_query)
-    min_year = int(year_range['MIN_YEAR'].iloc[0])
-    max_year = int(year_range['MAX_YEAR'].iloc[0])
-    st.metric("Years Covered", f"{min_year}-{max_year}")
+    min_year, max_year = cube.year_range(filters)
+    st.metric("Years Covered", f"{min_year}-{max_year}" if min_year is not None else "N/A")
 
 # Health Elements Distribution
 st.subheader("📊 Shipments by Health Element")
-health_elements_query = f"""
-SELECT 
-    D365_HEALTH_ELEMENT AS HEALTH_ELEMENT, 
-    COUNT(*) AS SHIPMENT_COUNT
-FROM HCD
-WHERE D365_HEALTH_ELEMENT NOT IN ('HIV', 'Population TO3', '311Mission', 'Tuberculosis')
-{' AND ' + year_filter if year_filter else ''}
-{' AND ' + health_element_filter if health_element_filter else ''}
-{' AND ' + country_filter if country_filter else ''}
-GROUP BY D365_HEALTH_ELEMENT
-ORDER BY SHIPMENT_COUNT ASC
-"""
-health_elements = run_sql(health_elements_query)
-fig = px.bar(health_elements, 
-             x='SHIPMENT_COUNT', 
-             y='HEALTH_ELEMENT', 
-             orientation='h',
-             title='Shipments by Health Element',
-             labels={'HEALTH_ELEMENT': 'Health Element', 'SHIPMENT_COUNT': 'Number of Shipments'})
-
-
-fig.update_layout(
-    height=400,  # adjust height if needed
-    margin=dict(l=0, r=0, t=30, b=0)  # adjust margins if needed
-)
+with timed("chart", chart="health_elements"):
+    health_elements = cube.by_health_element(filters)
+    fig = px.bar(health_elements, 
+                 x='SHIPMENT_COUNT', 
+                 y='HEALTH_ELEMENT', 
+                 orientation='h',
+                 title='Shipments by Health Element',
+                 labels={'HEALTH_ELEMENT': 'Health Element', 'SHIPMENT_COUNT': 'Number of Shipments'})
+
 
-st.plotly_chart(fig, use_container_width=True)
+    fig.update_layout(
+        height=400,  # adjust height if needed
+        margin=dict(l=0, r=0, t=30, b=0)  # adjust margins if needed
+    )
+
+    st.plotly_chart(fig, use_container_width=True)
 
 # Geographic Distribution
 st.subheader("🗺️ Geographic Distribution of Shipments")
-country_totals_query = f"""
-SELECT 
-    COUNTRY, 
-    COUNT(*) AS SHIPMENT_COUNT,
-    COUNT(DISTINCT D365_HEALTH_ELEMENT) as HEALTH_ELEMENTS_COUNT,
-    LISTAGG(DISTINCT D365_HEALTH_ELEMENT, ', ') as HEALTH_ELEMENTS
-FROM HCD
-WHERE 1=1
-{' AND ' + year_filter if year_filter else ''}
-{' AND ' + health_element_filter if health_element_filter else ''}
-{' AND ' + country_filter if country_filter else ''}
-AND D365_HEALTH_ELEMENT NOT IN ('HIV', 'Population TO3', '311Mission', 'Tuberculosis')
-GROUP BY COUNTRY
-"""
-country_totals = run_sql(country_totals_query)
-
-fig = px.choropleth(country_totals,
-                    locations='COUNTRY',
-                    locationmode='country names',
-                    color='SHIPMENT_COUNT',
-                    hover_name='COUNTRY',
-                    hover_data={
-                        'SHIPMENT_COUNT': True,
-                        'HEALTH_ELEMENTS_COUNT': True,
-                        'HEALTH_ELEMENTS': True,
-                        'COUNTRY': False
-                    },
-                    color_continuous_scale='Blues',
-                    title=None)
-
-
-fig.update_layout(
-    title=None,
-    height=500,
-    width=None,
-    geo=dict(
-        showframe=False,
-        showcoastlines=True,
-        projection_type='equirectangular',
-        projection_scale=1.3,
-        center=dict(lat=10, lon=20),
-        coastlinecolor="Black",
-        showland=True,
-        landcolor="lightgray",
-        showocean=True,
-        oceancolor="lightblue",
-        showcountries=True,
-        countrycolor="Black",
-    ),
-    hoverlabel=dict(
-        bgcolor="white",
-        font_size=12,
-        font_family="Arial",
-        font=dict(
-            color="black"  
-        )
-    ),
-    margin=dict(l=0, r=0, t=0, b=0)
-)
+with timed("chart", chart="country_map"):
+    country_totals = cube.country_totals(filters)
 
+    fig = px.choropleth(country_totals,
+                        locations='COUNTRY',
+                        locationmode='country names',
+                        color='SHIPMENT_COUNT',
+                        hover_name='COUNTRY',
+                        hover_data={
+                            'SHIPMENT_COUNT': True,
+                            'HEALTH_ELEMENTS_COUNT': True,
+                            'HEALTH_ELEMENTS': True,
+                            'COUNTRY': False
+                        },
+                        color_continuous_scale='Blues',
+                        title=None)
 
-fig.update_traces(
-    hovertemplate="<b style='color: black;'>%{hovertext}</b><br>" +
-                  "<span style='color: black;'>Shipments: %{z:,}</span><br>" +
-                  "<span style='color: black;'>Health Elements: %{customdata[1]}</span><br>" +
-                  "<span style='color: black;'>Programs: %{customdata[2]}</span><br>" +
-                  "<extra></extra>"
-)
+
+    fig.update_layout(
+        title=None,
+        height=500,
+        width=None,
+        geo=dict(
+            showframe=False,
+            showcoastlines=True,
+            projection_type='equirectangular',
+            projection_scale=1.3,
+            center=dict(lat=10, lon=20),
+            coastlinecolor="Black",
+            showland=True,
+            landcolor="lightgray",
+            showocean=True,
+            oceancolor="lightblue",
+            showcountries=True,
+            countrycolor="Black",
+        ),
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=12,
+            font_family="Arial",
+            font=dict(
+                color="black"  
+            )
+        ),
+        margin=dict(l=0, r=0, t=0, b=0)
+    )
+
+
+    fig.update_traces(
+        hovertemplate="<b style='color: black;'>%{hovertext}</b><br>" +
+                      "<span style='color: black;'>Shipments: %{z:,}</span><br>" +
+                      "<span style='color: black;'>Health Elements: %{customdata[1]}</span><br>" +
+                      "<span style='color: black;'>Programs: %{customdata[2]}</span><br>" +
+                      "<extra></extra>"
+    )
 
 
-st.plotly_chart(fig, use_container_width=True, height=500)
+    st.plotly_chart(fig, use_container_width=True, height=500)
 
 
 with st.expander("📊 Map Details"):
@@ -467,61 +836,132 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("📈 Top Recipient Countries (Recent Years)")
-    recent_country_totals_query = f"""
-    SELECT 
-        COUNTRY, 
-        COUNT(*) AS SHIPMENT_COUNT
-    FROM HCD
-    WHERE LATEST_ACTUAL_DELIVERY_DATE_YEAR >= 2022
-    {' AND ' + health_element_filter if health_element_filter else ''}
-    {' AND ' + country_filter if country_filter else ''}
-    AND D365_HEALTH_ELEMENT NOT IN ('HIV', 'Population TO3', '311Mission', 'Tuberculosis')
-    GROUP BY COUNTRY
-    ORDER BY SHIPMENT_COUNT DESC
-    LIMIT 10
-    """
-    recent_country_totals = run_sql(recent_country_totals_query)
-    fig = px.bar(recent_country_totals, 
-                 x='SHIPMENT_COUNT', 
-                 y='COUNTRY', 
-                 orientation='h',
-                 title='Top Recipients (2022-2023)',
-                 labels={'COUNTRY': 'Country', 'SHIPMENT_COUNT': 'Number of Shipments'})
-    st.plotly_chart(fig, use_container_width=True)
+    with timed("chart", chart="recent_countries"):
+        recent_country_totals = cube.recent_country_totals(filters, since_year=2022)
+        fig = px.bar(recent_country_totals, 
+                     x='SHIPMENT_COUNT', 
+                     y='COUNTRY', 
+                     orientation='h',
+                     title='Top Recipients (2022-2023)',
+                     labels={'COUNTRY': 'Country', 'SHIPMENT_COUNT': 'Number of Shipments'})
+        st.plotly_chart(fig, use_container_width=True)
 
 with col2:
     st.subheader("🏥 Shipments Over Time by Health Element")
-    yearly_health_query = f"""
-    SELECT 
-        LATEST_ACTUAL_DELIVERY_DATE_YEAR AS DELIVERY_YEAR, 
-        D365_HEALTH_ELEMENT AS HEALTH_ELEMENT, 
-        COUNT(*) AS SHIPMENT_COUNT
-    FROM HCD
-    WHERE D365_HEALTH_ELEMENT NOT IN ('HIV', 'Population TO3', '311Mission', 'Tuberculosis')
-    {' AND ' + health_element_filter if health_element_filter else ''}
-    {' AND ' + country_filter if country_filter else ''}
-    GROUP BY LATEST_ACTUAL_DELIVERY_DATE_YEAR, D365_HEALTH_ELEMENT
-    ORDER BY LATEST_ACTUAL_DELIVERY_DATE_YEAR
-    """
-    yearly_health = run_sql(yearly_health_query)
-    fig = px.line(yearly_health, 
-                  x='DELIVERY_YEAR',
-                  y='SHIPMENT_COUNT',
-                  color='HEALTH_ELEMENT',
-                  title='Shipments Over Time by Health Element',
-                  labels={
-                      'DELIVERY_YEAR': 'Year',
-                      'SHIPMENT_COUNT': 'Count of Shipments',
-                      'HEALTH_ELEMENT': 'Health Element'
-                  })
+    with timed("chart", chart="yearly_health"):
+        yearly_health = cube.yearly_health(filters)
+        fig = px.line(yearly_health, 
+                      x='DELIVERY_YEAR',
+                      y='SHIPMENT_COUNT',
+                      color='HEALTH_ELEMENT',
+                      title='Shipments Over Time by Health Element',
+                      labels={
+                          'DELIVERY_YEAR': 'Year',
+                          'SHIPMENT_COUNT': 'Count of Shipments',
+                          'HEALTH_ELEMENT': 'Health Element'
+                      })
     
-    fig.update_layout(
-        xaxis_title="Year",
-        yaxis_title="Count of Shipments",
-        legend_title="Health Element"
-    )
+        fig.update_layout(
+            xaxis_title="Year",
+            yaxis_title="Count of Shipments",
+            legend_title="Health Element"
+        )
     
-    st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True)
+
+# Lead Times and Lateness
+st.subheader("⏳ Lead Times and Lateness")
+with timed("chart", chart="duration_percentiles"):
+    percentiles = durations.percentiles(filters).set_index('MEASURE')
+    col1, col2 = st.columns(2)
+    for column, measure in ((col1, 'ORDER_CYCLE_TIME'), (col2, 'AVERAGE_DAYS_LATE')):
+        with column:
+            st.markdown(f"**{percentiles['LABEL'].get(measure, measure.replace('_', ' ').title())} (days)**")
+            metric_cols = st.columns(3)
+            for metric_col, percentile in zip(metric_cols, ('P50', 'P90', 'P99')):
+                value = percentiles[percentile].get(measure)
+                metric_col.metric(percentile.lower(), "N/A" if value is None or pd.isna(value) else f"{value:,.0f}")
+
+    stages = percentiles.drop(index=['ORDER_CYCLE_TIME', 'AVERAGE_DAYS_LATE'], errors='ignore').reset_index()
+    if not stages.empty:
+        stages = stages.melt(id_vars=['LABEL'], value_vars=['P50', 'P90', 'P99'], var_name='PERCENTILE', value_name='DAYS')
+        fig = px.bar(stages,
+                     x='LABEL',
+                     y='DAYS',
+                     color='PERCENTILE',
+                     barmode='group',
+                     title='Days per Order Stage',
+                     labels={'LABEL': 'Stage', 'DAYS': 'Days', 'PERCENTILE': 'Percentile'})
+        st.plotly_chart(fig, use_container_width=True)
+    st.caption(f"Percentiles are estimated from per-cell sketches, within ±{RELATIVE_ACCURACY:.0%} of the actual value "
+               "(durations under a day either way show as 0).")
+
+# Delay Analysis
+st.subheader("⏱️ Delivery Delays by Reason")
+if delays is None:
+    st.warning(f"Delay analysis is unavailable for this data version ({snapshot.value.delays_error}).")
+else:
+    with timed("chart", chart="delay_reasons"):
+        delay_reasons = delays.by_reason(filters, limit=15)
+        if delay_reasons.empty:
+            st.info("No delayed deliveries for this selection.")
+        else:
+            fig = px.bar(delay_reasons.iloc[::-1],
+                         x='SHIPMENT_COUNT',
+                         y='REASON_NAME',
+                         color='CATEGORY',
+                         orientation='h',
+                         hover_data={'REASON_CODE': True, 'MEAN_REASON_DURATION': ':,.1f'},
+                         title='Most Frequent Delay Reasons',
+                         labels={
+                             'REASON_NAME': 'Reason',
+                             'SHIPMENT_COUNT': 'Delayed Shipments',
+                             'CATEGORY': 'Delay',
+                             'REASON_CODE': 'Code',
+                             'MEAN_REASON_DURATION': 'Mean Reason Duration'
+                         })
+            fig.update_layout(height=500, margin=dict(l=0, r=0, t=30, b=0))
+            st.plotly_chart(fig, use_container_width=True)
+
+    if not delay_reasons.empty:
+        col1, col2 = st.columns(2)
+
+        with col1:
+            with timed("chart", chart="delay_durations"):
+                reason_options = delay_reasons['REASON_CODE'].astype(str).tolist()
+                selected_reasons = st.multiselect(
+                    "Delay reasons",
+                    options=reason_options,
+                    format_func=dict(zip(reason_options, delay_reasons['REASON_NAME'].astype(str))).get,
+                    placeholder="All reasons",
+                )
+                reason_durations = delays.duration_distribution(filters, codes=selected_reasons or None)
+                fig = px.bar(reason_durations,
+                             x='DURATION',
+                             y='SHIPMENT_COUNT',
+                             color='CATEGORY',
+                             title='Reason Code Durations of Delayed Shipments',
+                             labels={'DURATION': 'Reason Code Duration (unit unknown)', 'SHIPMENT_COUNT': 'Delayed Shipments', 'CATEGORY': 'Delay'})
+                fig.update_xaxes(categoryorder='array', categoryarray=reason_durations['DURATION'].drop_duplicates().tolist())
+                st.plotly_chart(fig, use_container_width=True)
+
+        with col2:
+            with timed("chart", chart="delay_years"):
+                yearly_delays = delays.yearly_by_category(filters)
+                fig = px.line(yearly_delays,
+                              x='DELIVERY_YEAR',
+                              y='SHIPMENT_COUNT',
+                              color='CATEGORY',
+                              title='Delayed Shipments Over Time',
+                              labels={'DELIVERY_YEAR': 'Year', 'SHIPMENT_COUNT': 'Delayed Shipments', 'CATEGORY': 'Delay'})
+                st.plotly_chart(fig, use_container_width=True)
+
+    with st.expander("⏱️ Delay Codes"):
+        st.markdown("""
+        - Codes starting with AD are acceptable delays (e.g. authorized by USAID); UD codes are unacceptable ones
+        - Durations are each shipment's reason code duration as recorded; HCD does not document its unit, so it is bucketed by order of magnitude
+        - The reason filter narrows the duration chart only
+        """)
 
 # Query Section
 st.divider()
@@ -543,6 +983,31 @@ user_input = st.chat_input("Ask a question about global health shipments")
 if "current_input_processed" not in st.session_state:
     st.session_state.current_input_processed = False
 
+# Display conversation history. Only the most recent analyst answers show
+# their results; older ones stay collapsed until asked for, so a rerun does
+# no work for them. Results shown come from each message's stored artifacts.
+recent_answers = st.secrets.get("HISTORY_RESULTS_SHOWN", 3)
+analyst_indexes = [i for i, m in enumerate(st.session_state.messages) if m["role"] != "user"]
+if recent_answers <= 0:
+    expanded_from = len(st.session_state.messages)  # every result stays collapsed
+elif len(analyst_indexes) >= recent_answers:
+    expanded_from = analyst_indexes[-recent_answers]
+else:
+    expanded_from = 0
+for message_index, message in enumerate(st.session_state.messages):
+    chat_role = "user" if message["role"] == "user" else "analyst"
+    with st.chat_message(chat_role):
+        show_results = message_index >= expanded_from
+        if not show_results and any(item["type"] == "sql" for item in message["content"]):
+            show_results = st.toggle("Show results", key=f"show_results_{message_index}")
+        display_content(
+            content=message["content"],
+            request_id=message.get("request_id"),
+            message_index=message_index,
+            artifacts=message.setdefault("artifacts", {}),
+            show_results=show_results,
+        )
+
 # Process new input only if we haven't processed it yet
 if user_input and not st.session_state.current_input_processed:
     process_message(prompt=user_input)
@@ -555,16 +1020,25 @@ if st.session_state.active_suggestion and not st.session_state.current_input_pro
     st.session_state.current_input_processed = True
     st.session_state.active_suggestion = None
 
-# Display conversation history
-for message_index, message in enumerate(st.session_state.messages):
-    chat_role = "user" if message["role"] == "user" else "analyst"
-    with st.chat_message(chat_role):
-        display_content(
-            content=message["content"],
-            request_id=message.get("request_id"),
-            message_index=message_index,
-        )
-
 # Reset the processed flag on rerun
 if st.session_state.current_input_processed:
     st.session_state.current_input_processed = False
+
+# Operator metrics, rendered last so they include this rerun
+st.session_state.perf.finish()
+if st.secrets.get("SHOW_METRICS", False):
+    with st.sidebar.expander("Performance", expanded=False):
+        st.caption("This rerun")
+        spans = pd.DataFrame(st.session_state.perf.spans)
+        st.dataframe(spans.drop(columns=["ts", "session", "rerun"]), hide_index=True)
+        st.caption("Latency by step (recent reruns, all sessions)")
+        st.dataframe(pd.DataFrame(get_perf_log().summary()).T)
+    with st.sidebar.expander("Backend metrics", expanded=False):
+        st.json(st.session_state.BACKEND.metrics())
+        st.json(get_result_cache().stats())
+        st.json(get_analyst_cache().stats())
+        refresher = get_refresher()
+        st.json({
+            "data_version": refresher.get().data_version,
+            "last_refresh_error": repr(refresher.last_error) if refresher.last_error else None,
+        })
@@ -0,0 +1,271 @@
+"""Helpers for the Snowflake Cortex Analyst REST API.
+
+``AnalystClient`` posts to the message endpoint over pooled keep-alive
+connections, with timeouts and retries. ``trim_history`` bounds the
+conversation sent with each question. ``request_body``, ``response_key`` and
+``read_response`` build requests and read answers the same way for the
+dashboard and ``batch.py``, so both share one response cache.
+
+The streaming endpoint (``"stream": true``) answers with server-sent events:
+``status`` updates, ``message.content.delta`` fragments for each content item,
+and a final ``done`` (or ``error``). ``ContentStream`` reassembles the deltas
+into the same content items the non-streaming API returns.
+"""
+import json
+import random
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+from cache import stable_hash
+
+if TYPE_CHECKING:
+    import requests
+
+# Header naming the request in Snowflake's logs; quote it when reporting a problem
+REQUEST_ID_HEADER = "X-Snowflake-Request-Id"
+
+# Statuses worth retrying: rate limited, or a transient server-side failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AnalystError(Exception):
+    """The Analyst API reported an error, either as an HTTP status or a stream event."""
+
+    def __init__(self, message: str, request_id: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.request_id = request_id
+
+
+class AnalystClient:
+    """Posts to the Analyst message endpoint through one pooled ``requests.Session``.
+
+    Connections are kept alive and reused across questions and sessions.
+    ``token(refresh)`` supplies the session token; a 401 is retried once with a
+    refreshed one. Connection failures and ``RETRY_STATUSES`` are retried up to
+    ``retries`` times with full-jitter exponential backoff, or after the
+    server's Retry-After. ``timeout`` bounds connecting and each wait for data
+    (between events, when streaming), not the whole response.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: Callable[[bool], Optional[str]],
+        timeout: Tuple[float, float] = (10.0, 120.0),
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        pool_size: int = 8,
+    ) -> None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, body: Dict[str, Any], stream: bool = False) -> "requests.Response":
+        import requests
+
+        refreshed = False
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.post(
+                    self.url,
+                    json=body,
+                    headers={
+                        "Authorization": f'Snowflake Token="{self.token(refreshed)}"',
+                        "Content-Type": "application/json",
+                    },
+                    stream=stream,
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.exceptions.ConnectTimeout):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+                continue
+            if resp.status_code == 401 and not refreshed:
+                # Session token expired; retry once with one from a revalidated connection
+                resp.close()
+                refreshed = True
+                continue
+            if resp.status_code in RETRY_STATUSES and attempt < self.retries:
+                delay = self._delay(attempt, resp.headers.get("Retry-After"))
+                resp.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return resp
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass  # an HTTP date; fall back to backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def semantic_model_file(secrets: Mapping[str, Any]) -> str:
+    """The staged semantic model that requests refer to."""
+    return f"@{secrets['SNOWFLAKE_DATABASE']}.{secrets['SNOWFLAKE_SCHEMA']}.{secrets['SNOWFLAKE_STAGE']}/{secrets['SNOWFLAKE_FILE']}"
+
+
+def request_body(messages: List[Dict[str, Any]], secrets: Mapping[str, Any]) -> Dict[str, Any]:
+    """Body of a (non-streaming) request asking about ``messages``."""
+    return {"messages": messages, "semantic_model_file": semantic_model_file(secrets)}
+
+
+def response_key(body: Dict[str, Any], model_version: str) -> str:
+    """Response-cache key: identical conversations against the same semantic model get the same answer."""
+    return stable_hash([body, model_version])
+
+
+def check_status(resp: "requests.Response") -> Optional[str]:
+    """The response's request id; raises ``AnalystError`` for an error status."""
+    request_id = resp.headers.get(REQUEST_ID_HEADER)
+    if resp.status_code >= 400:
+        raise AnalystError(
+            f"Failed request (id: {request_id}) with status {resp.status_code}: {resp.text}",
+            request_id=request_id,
+        )
+    return request_id
+
+
+def read_response(resp: "requests.Response") -> Dict[str, Any]:
+    """The answer in a non-streaming response, with ISO dates in its SQL and its ``request_id``."""
+    request_id = check_status(resp)
+    response = resp.json()
+    for item in response.get("message", {}).get("content", []):
+        fix_sql_dates(item)
+    return {**response, "request_id": request_id}
+
+
+def fix_sql_dates(item: Dict[str, Any]) -> None:
+    """Convert MM-DD-YYYY date formats in a generated SQL item to ISO."""
+    if item.get("type") == "sql":
+        item["statement"] = item["statement"].replace(
+            "MM-DD-YYYY", 
+            "YYYY-MM-DD"
+        )
+
+
+def trim_history(messages: List[Dict[str, Any]], max_turns: int) -> List[Dict[str, Any]]:
+    """The conversation to send with the newest question, bounded in size.
+
+    Keeps the last ``max_turns`` question/answer exchanges before the newest
+    question. Answers keep only their text, plus the SQL of the most recent
+    one, which follow-up questions refine; suggestions and other item fields
+    are dropped.
+    """
+    recent = messages[-(2 * max_turns + 1):]
+    # The API expects the conversation to start with a question
+    while recent and recent[0]["role"] != "user":
+        recent = recent[1:]
+    answers = [i for i, message in enumerate(recent) if message["role"] == "analyst"]
+    trimmed = []
+    for i, message in enumerate(recent):
+        if message["role"] != "analyst":
+            trimmed.append({"role": message["role"], "content": message["content"]})
+            continue
+        content = []
+        for item in message["content"]:
+            if item["type"] == "text":
+                content.append({"type": "text", "text": item["text"]})
+            elif item["type"] == "sql" and i == answers[-1]:
+                content.append({"type": "sql", "statement": item["statement"]})
+        trimmed.append({"role": "analyst", "content": content})
+    return trimmed
+
+
+def iter_sse_events(lines: Iterable[Union[bytes, str]]) -> Iterator[Tuple[str, Any]]:
+    """Parse server-sent-event lines into ``(event, data)`` pairs with JSON-decoded data."""
+    event, data = "message", []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+    if data:
+        yield event, json.loads("\n".join(data))
+
+
+class ContentStream:
+    """Reassembles streamed content deltas into complete Analyst content items.
+
+    Iterating yields ``(kind, index, payload)`` tuples as events arrive:
+
+    - ``("status", None, status_message)``
+    - ``("delta", index, item)`` after every fragment, with the item so far
+    - ``("complete", index, item)`` once an item can no longer change, i.e. when
+      the next item starts or the stream ends
+
+    ``content`` holds the finished items once iteration is over.
+    """
+
+    def __init__(self, events: Iterable[Tuple[str, Any]], request_id: Optional[str] = None) -> None:
+        self.events = events
+        self.request_id = request_id
+        self.content: List[Dict[str, Any]] = []
+
+    def __iter__(self) -> Iterator[Tuple[str, Optional[int], Any]]:
+        current: Optional[int] = None
+        for event, data in self.events:
+            if event == "status":
+                yield "status", None, data.get("status_message") or data.get("status")
+            elif event == "error":
+                raise AnalystError(
+                    f"Analyst stream error {data.get('code')}: {data.get('message')}",
+                    request_id=data.get("request_id", self.request_id),
+                )
+            elif event == "message.content.delta":
+                index = data["index"]
+                if current is not None and index != current:
+                    yield "complete", current, self.content[current]
+                current = index
+                yield "delta", index, self._apply(data)
+            elif event == "done":
+                break
+        if current is not None:
+            yield "complete", current, self.content[current]
+
+    def _apply(self, delta: Dict[str, Any]) -> Dict[str, Any]:
+        index = delta["index"]
+        while len(self.content) <= index:
+            self.content.append({})
+        item = self.content[index]
+        item.setdefault("type", delta["type"])
+        if "text_delta" in delta:
+            item["text"] = item.get("text", "") + delta["text_delta"]
+        if "statement_delta" in delta:
+            item["statement"] = item.get("statement", "") + delta["statement_delta"]
+        if "confidence" in delta:
+            item["confidence"] = delta["confidence"]
+        if "suggestions_delta" in delta:
+            suggestion = delta["suggestions_delta"]
+            suggestions = item.setdefault("suggestions", [])
+            while len(suggestions) <= suggestion["index"]:
+                suggestions.append("")
+            suggestions[suggestion["index"]] += suggestion.get("suggestion_delta", "")
+        return item
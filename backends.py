@@ -0,0 +1,620 @@
+"""Query backends that run dashboard and Cortex Analyst SQL.
+
+``SnowflakeBackend`` talks to the live warehouse. ``DuckDBBackend`` serves the
+same queries from a local HCD Parquet snapshot, for offline development, load
+testing and read-only public deployments. Pick one with the ``QUERY_BACKEND``
+secret (``snowflake`` or ``duckdb``).
+
+Build a snapshot from the CSV export with::
+
+    python backends.py data/hcd.csv data/hcd.parquet
+"""
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from cache import frame_nbytes, normalize_sql
+from semantic import concat_frames, frame_from_arrow
+
+DEFAULT_SNAPSHOT = os.path.join("data", "hcd.parquet")
+
+
+class QueryCancelled(Exception):
+    """The statement was cancelled before it started."""
+
+
+class CancelHandle:
+    """Lets another thread stop a statement while a backend runs it.
+
+    The backend binds a function that stops the statement for as long as it
+    runs; ``cancel`` calls it, or makes the statement fail to start if it
+    isn't running yet.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._cancel: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def bound(self, cancel: Callable[[], None]) -> Iterator[None]:
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelled("statement cancelled before it started")
+            self._cancel = cancel
+        try:
+            yield
+        finally:
+            # Waits for a cancel in progress, so it can't hit the connection's next statement
+            with self._lock:
+                self._cancel = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            if self._cancel is not None:
+                self._cancel()
+
+
+def bound(handle: Optional[CancelHandle], cancel: Callable[[], None]) -> Any:
+    return nullcontext() if handle is None else handle.bound(cancel)
+
+
+def take_capped(batches: Iterable[pd.DataFrame], max_rows: int, max_bytes: Optional[int] = None) -> pd.DataFrame:
+    """Concatenate ``batches`` up to ``max_rows`` rows, or past ``max_bytes`` bytes; the rest is not read."""
+    frames: List[pd.DataFrame] = []
+    rows = nbytes = 0
+    for batch in batches:
+        frames.append(batch.iloc[:max_rows - rows])
+        rows += len(frames[-1])
+        if max_bytes is not None:
+            nbytes += frame_nbytes(frames[-1])
+        if rows >= max_rows or (max_bytes is not None and nbytes >= max_bytes):
+            break
+    return concat_frames(frames)
+
+
+class QueryBackend:
+    """Runs SQL against the HCD data and returns pandas DataFrames.
+
+    ``params`` binds ``%(name)s`` placeholders, as produced by ``queries.compile_query``.
+    Backends that have a server-side query id put it in ``df.attrs["query_id"]``.
+    """
+
+    name = "base"
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def execute_batches(self, sql: str, handle: Optional[CancelHandle] = None) -> Iterator[pd.DataFrame]:
+        """Yield the result in chunks as they are fetched.
+
+        Closing the generator early stops the fetch, so callers can cap memory.
+        ``handle`` can cancel the statement from another thread.
+        """
+        yield self.execute(sql)
+
+    def execute_capped(
+        self,
+        sql: str,
+        max_rows: int,
+        max_bytes: Optional[int] = None,
+        handle: Optional[CancelHandle] = None,
+    ) -> pd.DataFrame:
+        """At most ``max_rows`` rows of the result, fetched batch by batch.
+
+        With ``max_bytes``, fetching also stops after the batch that brings
+        the result to that many bytes in memory.
+        """
+        batches = self.execute_batches(sql, handle=handle)
+        try:
+            return take_capped(batches, max_rows, max_bytes)
+        finally:
+            batches.close()
+
+    def fetch_page(
+        self,
+        sql: str,
+        offset: int,
+        limit: int,
+        max_bytes: Optional[int] = None,
+        handle: Optional[CancelHandle] = None,
+    ) -> pd.DataFrame:
+        """Rows ``offset`` to ``offset + limit`` of a query, plus one lookahead row.
+
+        The LIMIT is pushed to the server, so only the page leaves the
+        warehouse; a result longer than ``limit`` means more rows follow.
+        This re-runs the statement for every page, which is only consistent on
+        engines that keep a subquery's ORDER BY (DuckDB does); ``SnowflakeBackend``
+        pages past the first over one stored result instead.
+        """
+        statement = sql.strip().rstrip(";")
+        paged = f"SELECT * FROM (\n{statement}\n) AS PAGE LIMIT {int(limit) + 1} OFFSET {int(offset)}"
+        return self.execute_capped(paged, limit + 1, max_bytes=max_bytes, handle=handle)
+
+    def explain(self, sql: str) -> Dict[str, Optional[int]]:
+        """The planner's cost estimate for ``sql``: ``bytes`` scanned and/or ``rows`` processed.
+
+        Keys the backend can't estimate are missing.
+        """
+        return {}
+
+    def data_version(self) -> str:
+        """Opaque string that changes whenever the HCD data is reloaded."""
+        raise NotImplementedError
+
+    def materialize(self, table: str, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Store the result of ``sql`` as ``table``; returns a file location, if any."""
+        raise NotImplementedError
+
+    def register_rollups(self, rollups: List[Any]) -> None:
+        """Make previously materialized rollups queryable by their table names."""
+
+    def token(self, refresh: bool = False) -> Optional[str]:
+        """Session token for the Cortex Analyst REST API, if the backend has one.
+
+        ``refresh=True`` asks for a token from a freshly validated session,
+        after the API rejected the previous one.
+        """
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Operational counters for the sidebar, e.g. connection pool usage."""
+        return {}
+
+
+# Snowflake error numbers meaning the session is gone and the connection must be replaced
+SESSION_GONE_ERRNOS = {390111, 390112, 390114}
+
+_QUERY_ID = re.compile(r"[0-9A-Za-z-]+")
+
+
+class SnowflakeConnectionPool:
+    """Thread-safe pool of Snowflake connections shared by every Streamlit session.
+
+    Connections idle for longer than ``check_interval`` seconds are pinged
+    before being handed out; dead or expired ones are closed and replaced.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        min_size: int = 1,
+        max_size: int = 8,
+        check_interval: float = 60.0,
+        acquire_timeout: float = 30.0,
+    ) -> None:
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._counters = {"created": 0, "closed": 0, "waits": 0, "checkouts": 0}
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self) -> Any:
+        """Connect into a slot the caller has already reserved in ``_size``."""
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters["created"] += 1
+        return conn
+
+    def _discard(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._counters["closed"] += 1
+            self._cond.notify()
+
+    def _is_alive(self, conn: Any, last_used: float) -> bool:
+        if conn.is_closed():
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            # Also renews an expired session token as a side effect
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, validate: bool = False) -> Any:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    self._counters["waits"] += 1
+                    if not self._cond.wait(timeout=deadline - time.monotonic()):
+                        raise TimeoutError(f"No Snowflake connection free after {self.acquire_timeout}s")
+                self._counters["checkouts"] += 1
+                if not self._idle:
+                    self._size += 1
+                    break
+                conn, last_used = self._idle.pop()
+            if self._is_alive(conn, 0.0 if validate else last_used):
+                return conn
+            self._discard(conn)
+        return self._open()
+
+    def release(self, conn: Any) -> None:
+        if conn.is_closed():
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, validate: bool = False) -> Iterator[Any]:
+        conn = self.acquire(validate=validate)
+        session_gone = False
+        try:
+            yield conn
+        except Exception as e:
+            session_gone = getattr(e, "errno", None) in SESSION_GONE_ERRNOS
+            raise
+        finally:
+            # Also runs on GeneratorExit and other BaseExceptions, e.g. when a
+            # generator holding the connection is closed early
+            if session_gone:
+                self._discard(conn)
+            else:
+                self.release(conn)
+
+    def dedicated(self) -> Any:
+        """A new connection outside the pool and its ``max_size``; the caller closes it."""
+        return self._connect()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pool_size": self._size,
+                "pool_idle": len(self._idle),
+                "pool_in_use": self._size - len(self._idle),
+                "pool_max": self.max_size,
+                **self._counters,
+            }
+
+
+def load_private_key(pem: str) -> Any:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    return serialization.load_pem_private_key(
+        pem.encode('utf-8'),
+        password=None,
+        backend=default_backend()
+    )
+
+
+class SnowflakeBackend(QueryBackend):
+    name = "snowflake"
+
+    def __init__(self, pool: SnowflakeConnectionPool, max_results: int = 1024) -> None:
+        self.pool = pool
+        # Normalized statement -> query id of its latest run, for paging (LRU)
+        self.max_results = max_results
+        self._result_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Issues cancels, opened on the first one
+        self._control: Optional[Any] = None
+        self._control_lock = threading.Lock()
+
+    @classmethod
+    def from_secrets(cls, secrets: Mapping[str, Any]) -> "SnowflakeBackend":
+        import snowflake.connector
+
+        # Parsed once here and reused for every pooled connection
+        p_key = load_private_key(secrets["SNOWFLAKE_PRIVATE_KEY"])
+
+        def connect() -> Any:
+            return snowflake.connector.connect(
+                user=secrets["SNOWFLAKE_USER"],
+                account=secrets["SNOWFLAKE_ACCOUNT"],
+                private_key=p_key,
+                warehouse=secrets["SNOWFLAKE_WAREHOUSE"],
+                role=secrets["SNOWFLAKE_ROLE"],
+                database=secrets["SNOWFLAKE_DATABASE"],
+                schema=secrets["SNOWFLAKE_SCHEMA"],
+                client_session_keep_alive=True,
+            )
+
+        return cls(SnowflakeConnectionPool(
+            connect,
+            min_size=secrets.get("SNOWFLAKE_POOL_MIN", 1),
+            max_size=secrets.get("SNOWFLAKE_POOL_MAX", 8),
+        ))
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        try:
+            return self._execute(sql, params)
+        except Exception as e:
+            if getattr(e, "errno", None) not in SESSION_GONE_ERRNOS:
+                raise
+            # The pool dropped the dead session; retry once on a fresh one
+            return self._execute(sql, params)
+
+    def _execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            table = cur.fetch_arrow_all()
+            if table is None:
+                df = pd.DataFrame(columns=[column.name for column in cur.description])
+            else:
+                df = frame_from_arrow(table)
+            df.attrs["query_id"] = cur.sfqid
+            return df
+
+    def execute_batches(self, sql: str, handle: Optional[CancelHandle] = None) -> Iterator[pd.DataFrame]:
+        with self.pool.connection() as conn, conn.cursor() as cur, \
+                bound(handle, lambda: self._cancel_session(conn.session_id)):
+            cur.execute(sql)
+            yield from self._frames(cur)
+
+    def execute_capped(
+        self,
+        sql: str,
+        max_rows: int,
+        max_bytes: Optional[int] = None,
+        handle: Optional[CancelHandle] = None,
+    ) -> pd.DataFrame:
+        # Reads the capped result inside the with block rather than from a
+        # generator, so the cursor is closed and the connection back in the
+        # pool before this returns
+        with self.pool.connection() as conn, conn.cursor() as cur, \
+                bound(handle, lambda: self._cancel_session(conn.session_id)):
+            cur.execute(sql)
+            df = take_capped(self._frames(cur), max_rows, max_bytes)
+            df.attrs["query_id"] = cur.sfqid
+        return df
+
+    def fetch_page(
+        self,
+        sql: str,
+        offset: int,
+        limit: int,
+        max_bytes: Optional[int] = None,
+        handle: Optional[CancelHandle] = None,
+    ) -> pd.DataFrame:
+        """Rows ``offset`` to ``offset + limit`` of ``sql``, plus one lookahead row.
+
+        The first page is a preview: the statement runs with the LIMIT pushed
+        to the server, so the warehouse neither computes nor stores more than
+        the page. The first later page runs the full statement once, and every
+        later page reads that run's stored result with ``RESULT_SCAN`` rather
+        than re-running it, so those pages never overlap or skip rows. A run
+        whose stored result has expired is repeated.
+        """
+        if offset == 0:
+            return super().fetch_page(sql, 0, limit, max_bytes=max_bytes, handle=handle)
+        statement = sql.strip().rstrip(";")
+        key = normalize_sql(statement)
+        query_id = self._result_ids.get(key)
+        if query_id is not None:
+            try:
+                return self._scan_page(query_id, offset, limit, max_bytes, handle)
+            except Exception:
+                if handle is not None and handle.cancelled:
+                    raise
+                # The stored result expired; run the statement again
+        query_id = self._run(statement, handle)
+        self._remember_result(key, query_id)
+        return self._scan_page(query_id, offset, limit, max_bytes, handle)
+
+    def _scan_page(
+        self,
+        query_id: str,
+        offset: int,
+        limit: int,
+        max_bytes: Optional[int],
+        handle: Optional[CancelHandle],
+    ) -> pd.DataFrame:
+        if not _QUERY_ID.fullmatch(query_id):
+            raise ValueError(f"Unexpected Snowflake query id {query_id!r}")
+        paged = f"SELECT * FROM TABLE(RESULT_SCAN('{query_id}')) LIMIT {int(limit) + 1} OFFSET {int(offset)}"
+        return self.execute_capped(paged, limit + 1, max_bytes=max_bytes, handle=handle)
+
+    def _run(self, sql: str, handle: Optional[CancelHandle] = None) -> str:
+        """Run ``sql`` without fetching its result; returns the query id to scan it by."""
+        with self.pool.connection() as conn, conn.cursor() as cur, \
+                bound(handle, lambda: self._cancel_session(conn.session_id)):
+            cur.execute(sql)
+            return cur.sfqid
+
+    def _remember_result(self, key: str, query_id: str) -> None:
+        with self._lock:
+            self._result_ids[key] = query_id
+            self._result_ids.move_to_end(key)
+            while len(self._result_ids) > self.max_results:
+                self._result_ids.popitem(last=False)
+
+    @staticmethod
+    def _frames(cur: Any) -> Iterator[pd.DataFrame]:
+        empty = True
+        for batch in cur.fetch_arrow_batches():
+            empty = False
+            df = frame_from_arrow(batch)
+            df.attrs["query_id"] = cur.sfqid
+            yield df
+        if empty:
+            df = pd.DataFrame(columns=[column.name for column in cur.description])
+            df.attrs["query_id"] = cur.sfqid
+            yield df
+
+    def _cancel_session(self, session_id: int) -> None:
+        # Through a connection of its own: the statement's one is busy running
+        # it, and when the pool is exhausted the statements holding it may be
+        # the very ones to cancel
+        with self._control_lock:
+            if self._control is None or self._control.is_closed():
+                self._control = self.pool.dedicated()
+            try:
+                with self._control.cursor() as cur:
+                    cur.execute("SELECT SYSTEM$CANCEL_ALL_QUERIES(%(session)s)", {"session": session_id})
+            except Exception as e:
+                if getattr(e, "errno", None) in SESSION_GONE_ERRNOS:
+                    self._control.close()
+                    self._control = None
+                raise
+
+    def explain(self, sql: str) -> Dict[str, Optional[int]]:
+        plan = json.loads(self.execute(f"EXPLAIN USING JSON\n{sql.strip().rstrip(';')}").iloc[0, 0])
+        stats = plan.get("GlobalStats", {})
+        return {"bytes": stats.get("bytesAssigned"), "partitions": stats.get("partitionsAssigned")}
+
+    def data_version(self) -> str:
+        version = self.execute("""
+            SELECT LAST_ALTERED
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME = 'HCD'
+        """)
+        return str(version.iloc[0, 0]) if not version.empty else ""
+
+    def materialize(self, table: str, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"CREATE OR REPLACE TABLE {table} AS\n{sql}", params)
+        return None
+
+    def token(self, refresh: bool = False) -> Optional[str]:
+        with self.pool.connection(validate=refresh) as conn:
+            return conn.rest.token
+
+    def metrics(self) -> Dict[str, Any]:
+        return self.pool.metrics()
+
+
+_PYFORMAT = re.compile(r"%\((\w+)\)s")
+
+
+class DuckDBBackend(QueryBackend):
+    """Serves HCD from a Parquet file, directory or glob through an in-process DuckDB."""
+
+    name = "duckdb"
+
+    def __init__(self, snapshot: str = DEFAULT_SNAPSHOT) -> None:
+        import duckdb
+
+        if os.path.isdir(snapshot):
+            snapshot = os.path.join(snapshot, "*.parquet")
+        self.files = sorted(glob.glob(snapshot))
+        if not self.files:
+            raise FileNotFoundError(f"No HCD Parquet snapshot found at {snapshot}")
+        self.conn = duckdb.connect()
+        self.conn.execute(f"CREATE VIEW HCD AS SELECT * FROM read_parquet({self.files!r})")
+
+    @classmethod
+    def from_secrets(cls, secrets: Mapping[str, Any]) -> "DuckDBBackend":
+        return cls(secrets.get("HCD_SNAPSHOT", DEFAULT_SNAPSHOT))
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        # A cursor is an independent DuckDB connection, so callers may use threads
+        with self.conn.cursor() as cur:
+            if params:
+                # DuckDB names its placeholders $name rather than %(name)s
+                return frame_from_arrow(cur.execute(_PYFORMAT.sub(r"$\1", sql), params).fetch_arrow_table())
+            return frame_from_arrow(cur.execute(sql).fetch_arrow_table())
+
+    def execute_batches(
+        self,
+        sql: str,
+        handle: Optional[CancelHandle] = None,
+        batch_rows: int = 100_000,
+    ) -> Iterator[pd.DataFrame]:
+        import pyarrow as pa
+
+        with self.conn.cursor() as cur, bound(handle, cur.interrupt):
+            reader = cur.execute(sql).fetch_record_batch(batch_rows)
+            empty = True
+            for batch in reader:
+                empty = False
+                yield frame_from_arrow(pa.Table.from_batches([batch]))
+            if empty:
+                yield frame_from_arrow(reader.schema.empty_table())
+
+    def explain(self, sql: str) -> Dict[str, Optional[int]]:
+        with self.conn.cursor() as cur:
+            plan = json.loads(cur.execute(f"EXPLAIN (FORMAT JSON)\n{sql.strip().rstrip(';')}").fetchall()[0][1])
+
+        def cardinalities(nodes: List[Dict[str, Any]]) -> Iterator[int]:
+            for node in nodes:
+                estimate = node.get("extra_info", {}).get("Estimated Cardinality")
+                if estimate is not None:
+                    yield int(estimate)
+                yield from cardinalities(node.get("children", []))
+
+        # The largest intermediate result stands in for the work the statement does
+        return {"rows": max(cardinalities(plan), default=0)}
+
+    def data_version(self) -> str:
+        return str(max(os.path.getmtime(path) for path in self.files))
+
+    def materialize(self, table: str, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        # Written next to the snapshot, outside the directory glob it was read with
+        directory = os.path.join(os.path.dirname(self.files[0]), "rollups")
+        os.makedirs(directory, exist_ok=True)
+        location = os.path.join(directory, f"{table}.parquet")
+        statement = _PYFORMAT.sub(r"$\1", sql)
+        with self.conn.cursor() as cur:
+            cur.execute(f"COPY (\n{statement}\n) TO {location!r} (FORMAT PARQUET)", params or None)
+        self.conn.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM read_parquet({location!r})")
+        return location
+
+    def register_rollups(self, rollups: List[Any]) -> None:
+        for rollup in rollups:
+            self.conn.execute(f"CREATE OR REPLACE VIEW {rollup.table} AS SELECT * FROM read_parquet({rollup.location!r})")
+
+
+BACKENDS = {
+    SnowflakeBackend.name: SnowflakeBackend,
+    DuckDBBackend.name: DuckDBBackend,
+}
+
+
+def create_backend(secrets: Mapping[str, Any]) -> QueryBackend:
+    """Build the backend named by the ``QUERY_BACKEND`` secret (default: snowflake)."""
+    name = secrets.get("QUERY_BACKEND", SnowflakeBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown QUERY_BACKEND {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name].from_secrets(secrets)
+
+
+def write_snapshot(csv_path: str, parquet_path: str = DEFAULT_SNAPSHOT) -> None:
+    """Convert the HCD CSV export into a Parquet snapshot for ``DuckDBBackend``."""
+    import duckdb
+
+    duckdb.sql(
+        f"COPY (SELECT * FROM read_csv_auto({csv_path!r}, header = true)) "
+        f"TO {parquet_path!r} (FORMAT PARQUET)"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: python backends.py HCD_CSV [PARQUET_OUT]")
+    write_snapshot(*sys.argv[1:])
@@ -0,0 +1,237 @@
+"""Run a file of questions through Cortex Analyst and the query backend, headlessly.
+
+Each line of the input is a JSON object with a ``question`` (or the key given
+by ``--question-key``) and optionally an ``id``. Questions are asked as
+independent, single-turn conversations. Up to ``--concurrency`` run at once,
+and at most ``--rate`` start per second. Every generated SQL statement runs
+behind the same guards as in the dashboard, and its first page is fetched. One
+JSON line per question goes to the output, with the answer text, SQL, row
+counts and per-stage latency.
+
+    python batch.py questions.jsonl answers.jsonl --concurrency 8 --rate 2
+
+Settings come from ``.streamlit/secrets.toml`` (override with ``--secret``).
+With ``DISK_CACHE_DIR`` set, answers and result pages go to the same shared
+disk cache the dashboard reads, under the same keys, so a batch run pre-warms
+it. ``--mock-analyst`` answers from the benchmark's local stand-in endpoint
+instead of Snowflake; pair it with ``--secret QUERY_BACKEND=duckdb`` to run
+fully offline.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from analyst import AnalystClient, read_response, request_body, response_key
+from backends import QueryBackend, create_backend
+from cache import DiskCache, page_key
+from guard import GuardError, GuardLimits, guarded_page
+from semantic import model_version
+from settings import load_secrets, parse_secrets
+
+
+class RateLimiter:
+    """Spaces calls to ``wait`` at least ``1 / rate`` seconds apart, across threads."""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self.interval = 1 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+def read_questions(path: str, question_key: str = "question") -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            yield {"id": entry.get("id", line_number), "question": entry[question_key]}
+
+
+def cached(disk: Optional[DiskCache], key: Any, compute: Callable[[], Any]) -> Tuple[Any, str]:
+    """``compute()`` through the disk tier, if any; the source is "disk" or "miss"."""
+    if disk is None:
+        return compute(), "miss"
+    value, computed = disk.get_or_compute(key, compute)
+    return value, "miss" if computed else "disk"
+
+
+class BatchRunner:
+    """Asks questions the way the dashboard's chat does, without a Streamlit session."""
+
+    def __init__(self, secrets: Mapping[str, Any], backend: QueryBackend, client: AnalystClient) -> None:
+        self.secrets = secrets
+        self.backend = backend
+        self.client = client
+        self.limits = GuardLimits.from_secrets(secrets)
+        self.model_version = model_version(secrets)
+        self.page_rows = min(secrets.get("RESULT_PAGE_ROWS", 5_000), secrets.get("RESULT_MAX_ROWS", 50_000))
+        self.max_bytes = secrets.get("RESULT_MAX_MB", 100) * 2**20
+        self.analyst_cache = self.result_cache = None
+        if secrets.get("DISK_CACHE_DIR"):
+            # The dashboard's disk tiers, keyed and versioned the same way
+            directory = secrets["DISK_CACHE_DIR"]
+            max_bytes = secrets.get("DISK_CACHE_MB", 1024) * 2**20
+            self.analyst_cache = DiskCache(
+                os.path.join(directory, "analyst"), max_bytes, ttl=secrets.get("ANALYST_CACHE_TTL", 24 * 3600), codec="json"
+            )
+            self.analyst_cache.set_version(self.model_version)
+            self.result_cache = DiskCache(
+                os.path.join(directory, "results"), max_bytes, ttl=secrets.get("RESULT_CACHE_TTL", 3600), codec="frame"
+            )
+            self.result_cache.set_version(backend.data_version())
+
+    def ask(self, question: str) -> Dict[str, Any]:
+        """The Analyst's answer to ``question`` and where it came from."""
+        body = request_body([{"role": "user", "content": [{"type": "text", "text": question}]}], self.secrets)
+        response, source = cached(
+            self.analyst_cache, response_key(body, self.model_version), lambda: read_response(self.client.post(body))
+        )
+        return {**response, "cache": source}
+
+    def run_sql(self, sql: str) -> Dict[str, Any]:
+        """Rows in the first page of ``sql``'s result, behind the dashboard's guards."""
+
+        def fetch() -> Any:
+            return guarded_page(self.backend, sql, 0, self.page_rows, self.max_bytes, self.limits)
+
+        df, source = cached(self.result_cache, page_key(sql, 0, self.page_rows, self.max_bytes), fetch)
+        return {
+            "rows": min(len(df.index), self.page_rows),
+            "has_more": len(df.index) > self.page_rows,
+            "columns": [str(column) for column in df.columns],
+            "cache": source,
+        }
+
+    def run(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"id": entry["id"], "question": entry["question"]}
+        started = time.perf_counter()
+        try:
+            response = self.ask(entry["question"])
+        except Exception as e:
+            record.update(error=f"{type(e).__name__}: {e}", analyst_seconds=round(time.perf_counter() - started, 4))
+            return record
+        record.update(
+            request_id=response["request_id"],
+            analyst_cache=response["cache"],
+            analyst_seconds=round(time.perf_counter() - started, 4),
+            answer="\n\n".join(item["text"] for item in response["message"]["content"] if item["type"] == "text"),
+            suggestions=[s for item in response["message"]["content"] if item["type"] == "suggestions" for s in item["suggestions"]],
+            statements=[],
+        )
+        for item in response["message"]["content"]:
+            if item["type"] != "sql":
+                continue
+            statement: Dict[str, Any] = {"sql": item["statement"]}
+            sql_started = time.perf_counter()
+            try:
+                statement.update(self.run_sql(item["statement"]))
+            except GuardError as e:
+                statement.update(guard=e.guard, error=str(e))
+            except Exception as e:
+                statement["error"] = f"{type(e).__name__}: {e}"
+            statement["seconds"] = round(time.perf_counter() - sql_started, 4)
+            record["statements"].append(statement)
+        record["total_seconds"] = round(time.perf_counter() - started, 4)
+        return record
+
+
+def run_batch(
+    runner: BatchRunner,
+    questions: List[Dict[str, Any]],
+    out: Any,
+    concurrency: int,
+    rate: Optional[float],
+) -> Dict[str, int]:
+    """Write one JSON line per question to ``out`` as each finishes; returns outcome counts."""
+    limiter = RateLimiter(rate)
+
+    def task(entry: Dict[str, Any]) -> Dict[str, Any]:
+        limiter.wait()
+        return runner.run(entry)
+
+    counts = {"questions": 0, "errors": 0, "statements": 0, "statement_errors": 0}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        for future in as_completed([pool.submit(task, entry) for entry in questions]):
+            record = future.result()
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+            counts["questions"] += 1
+            counts["errors"] += "error" in record
+            counts["statements"] += len(record.get("statements", []))
+            counts["statement_errors"] += sum("error" in s for s in record.get("statements", []))
+    return counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file to write answers to ('-' for stdout)")
+    parser.add_argument("--question-key", default="question", help="field holding each line's question")
+    parser.add_argument("--concurrency", type=int, default=4, help="questions in flight at once")
+    parser.add_argument("--rate", type=float, help="most questions started per second (default: no limit)")
+    parser.add_argument("--secret", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a setting from secrets.toml, e.g. QUERY_BACKEND=duckdb (repeatable)")
+    parser.add_argument("--mock-analyst", action="store_true", help="answer from a local stand-in Analyst endpoint")
+    args = parser.parse_args()
+
+    try:
+        secrets = dict(load_secrets())
+    except FileNotFoundError:
+        secrets = {}
+    secrets.update(parse_secrets(args.secret))
+
+    mock = None
+    if args.mock_analyst:
+        from bench import MockAnalyst
+
+        mock = MockAnalyst()
+        secrets["ANALYST_URL"] = mock.url
+        for key in ("SNOWFLAKE_DATABASE", "SNOWFLAKE_SCHEMA", "SNOWFLAKE_STAGE"):
+            secrets.setdefault(key, "MOCK")
+        secrets.setdefault("SNOWFLAKE_FILE", "HCD_Semantic_Layer.yaml")
+
+    backend = create_backend(secrets)
+    url = secrets.get("ANALYST_URL") or f"https://{secrets['SNOWFLAKE_HOST']}/api/v2/cortex/analyst/message"
+    client = AnalystClient(
+        url,
+        token=lambda refresh: backend.token(refresh=refresh),
+        timeout=(10.0, secrets.get("ANALYST_TIMEOUT", 120)),
+        retries=secrets.get("ANALYST_RETRIES", 3),
+        pool_size=args.concurrency,
+    )
+    runner = BatchRunner(secrets, backend, client)
+    questions = list(read_questions(args.questions, args.question_key))
+
+    started = time.perf_counter()
+    try:
+        if args.output == "-":
+            counts = run_batch(runner, questions, sys.stdout, args.concurrency, args.rate)
+        else:
+            with open(args.output, "w", encoding="utf-8") as out:
+                counts = run_batch(runner, questions, out, args.concurrency, args.rate)
+    finally:
+        if mock is not None:
+            mock.close()
+    print(
+        f"{counts['questions']} questions ({counts['errors']} failed), "
+        f"{counts['statements']} statements ({counts['statement_errors']} failed) "
+        f"in {time.perf_counter() - started:.1f}s",
+        file=sys.stderr,
+    )
+    return 1 if counts["errors"] or counts["statement_errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Benchmark full dashboard reruns headlessly, and catch regressions.
+
+Drives ``USAID.py`` through Streamlit's ``AppTest`` against the DuckDB
+backend over synthetic HCD snapshots of several sizes (see ``synthetic.py``),
+with a local mock of the Cortex Analyst endpoint. Each scripted session
+replays a cold load, a warm rerun, toggling years, switching country and a
+chain of questions, and reports per-phase latency, backend query counts,
+peak traced Python memory and the process's peak resident set size. Arrow
+and DuckDB allocate natively, outside ``tracemalloc``'s view, so only RSS
+shows their buffers.
+
+    python bench.py --scales 10000,100000 --repeat 3 --save bench/baseline.json
+    python bench.py --scales 10000,100000 --repeat 3 --baseline bench/baseline.json
+
+With ``--baseline``, phases that got slower than ``--tolerance`` (and by more
+than ``--min-delta`` seconds) or ran more backend queries fail the run.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from settings import parse_secrets
+from synthetic import write_parquet
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "USAID.py")
+
+# Questions asked in order, and the SQL the mock Analyst answers each with
+QUESTIONS = [
+    ("Which countries received the most shipments?",
+     "SELECT COUNTRY, COUNT(*) AS SHIPMENTS FROM HCD GROUP BY COUNTRY ORDER BY SHIPMENTS DESC"),
+    ("How did shipments change by year?",
+     "SELECT LATEST_ACTUAL_DELIVERY_DATE_YEAR AS YEAR, COUNT(*) AS SHIPMENTS FROM HCD "
+     "GROUP BY LATEST_ACTUAL_DELIVERY_DATE_YEAR ORDER BY YEAR"),
+    ("Show every shipment's order cycle time",
+     "SELECT ROPOLINE, ORDER_CYCLE_TIME FROM HCD ORDER BY ROPOLINE"),
+]
+
+
+class MockAnalyst:
+    """Local HTTP stand-in for the Cortex Analyst message endpoint.
+
+    The n-th request of a conversation is answered with ``QUESTIONS[n]``'s
+    SQL, as plain JSON or as server-sent events when ``"stream": true``.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                mock.requests += 1
+                turn = (len(body["messages"]) // 2) % len(QUESTIONS)
+                content = [
+                    {"type": "text", "text": "This is our interpretation of your question."},
+                    {"type": "sql", "statement": QUESTIONS[turn][1]},
+                ]
+                self.send_response(200)
+                self.send_header("X-Snowflake-Request-Id", f"bench-{mock.requests}")
+                if body.get("stream"):
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for index, item in enumerate(content):
+                        delta = {"index": index, "type": item["type"]}
+                        delta["text_delta" if item["type"] == "text" else "statement_delta"] = item.get("text", item.get("statement"))
+                        self.wfile.write(f"event: message.content.delta\ndata: {json.dumps(delta)}\n\n".encode())
+                    self.wfile.write(b"event: done\ndata: {}\n\n")
+                else:
+                    payload = json.dumps({"message": {"role": "analyst", "content": content}}).encode()
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v2/cortex/analyst/message"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """The process's peak resident set size so far, or None where unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def session_phases(at: Any) -> List[Tuple[str, Callable[[], None]]]:
+    """The scripted session: (phase name, action) pairs run in order."""
+
+    def toggle_years() -> None:
+        at.checkbox[0].uncheck().run()
+        year = at.checkbox[1].key
+        at.checkbox(key=year).check().run()
+
+    def switch_country() -> None:
+        at.selectbox[1].select(at.selectbox[1].options[1]).run()
+
+    phases = [
+        ("cold_load", at.run),
+        ("warm_rerun", at.run),
+        ("toggle_years", toggle_years),
+        ("switch_country", switch_country),
+    ]
+    for i, (question, _) in enumerate(QUESTIONS):
+        phases.append((f"ask_{i + 1}", lambda question=question: at.chat_input[0].set_value(question).run()))
+    phases.append(("rerun_with_history", at.run))
+    return phases
+
+
+def run_session(snapshot: str, analyst_url: str, secrets: Dict[str, Any], workdir: str) -> Dict[str, Dict[str, float]]:
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    # Every session starts cold: no cached backend, cube, results or Analyst answers
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    perf_log = os.path.join(workdir, "perf.jsonl")
+    open(perf_log, "w").close()
+
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+    for key, value in {
+        "QUERY_BACKEND": "duckdb",
+        "HCD_SNAPSHOT": snapshot,
+        "ANALYST_URL": analyst_url,
+        "SNOWFLAKE_DATABASE": "BENCH",
+        "SNOWFLAKE_SCHEMA": "BENCH",
+        "SNOWFLAKE_STAGE": "BENCH",
+        "SNOWFLAKE_FILE": "HCD_Semantic_Layer.yaml",
+        "ROLLUP_MANIFEST": os.path.join(workdir, "rollups.json"),
+        "CATALOG_PATH": os.path.join(workdir, "catalog.json"),
+        "PERF_LOG": perf_log,
+        **secrets,
+    }.items():
+        at.secrets[key] = value
+
+    results = {}
+    for name, action in session_phases(at):
+        with open(perf_log, encoding="utf-8") as f:
+            seen = sum(1 for _ in f)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        action()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        with open(perf_log, encoding="utf-8") as f:
+            spans = [json.loads(line) for line in list(f)[seen:]]
+        # Spans that may query the backend say how many queries they ran (see perf.py)
+        queries = [span for span in spans if "queries" in span]
+        results[name] = {
+            "seconds": seconds,
+            "queries": sum(span["queries"] for span in queries),
+            "cache_hits": sum(span.get("cache") == "hit" for span in queries),
+            "peak_mb": peak / 2**20,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return results
+
+
+def run_benchmark(scales: List[int], repeat: int, secrets: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    analyst = MockAnalyst()
+    tracemalloc.start()
+    report: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "secrets": secrets,
+        "scales": {},
+    }
+    try:
+        for rows in scales:
+            snapshot = os.path.join(workdir, f"hcd_{rows}.parquet")
+            if not os.path.exists(snapshot):
+                write_parquet(snapshot, rows)
+            runs = [run_session(snapshot, analyst.url, secrets, workdir) for _ in range(repeat)]
+            # Median latency across repeats; counts and memory from the worst run
+            report["scales"][str(rows)] = {
+                phase: {
+                    "seconds": round(statistics.median(run[phase]["seconds"] for run in runs), 4),
+                    "queries": max(run[phase]["queries"] for run in runs),
+                    "cache_hits": min(run[phase]["cache_hits"] for run in runs),
+                    "peak_mb": round(max(run[phase]["peak_mb"] for run in runs), 2),
+                    "peak_rss_mb": _worst(run[phase]["peak_rss_mb"] for run in runs),
+                }
+                for phase in runs[0]
+            }
+    finally:
+        tracemalloc.stop()
+        analyst.close()
+    return report
+
+
+def _worst(values: Iterable[Optional[float]]) -> Optional[float]:
+    known = [value for value in values if value is not None]
+    return round(max(known), 2) if known else None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta: float) -> List[str]:
+    """Regressions of ``report`` against ``baseline``, as human-readable lines."""
+    regressions = []
+    for scale, phases in report["scales"].items():
+        for phase, now in phases.items():
+            before = baseline.get("scales", {}).get(scale, {}).get(phase)
+            if before is None:
+                continue
+            slower = now["seconds"] - before["seconds"]
+            if now["seconds"] > before["seconds"] * (1 + tolerance) and slower > min_delta:
+                regressions.append(f"{scale} rows / {phase}: {before['seconds']:.3f}s -> {now['seconds']:.3f}s")
+            if now["queries"] > before["queries"]:
+                regressions.append(f"{scale} rows / {phase}: {before['queries']} -> {now['queries']} backend queries")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    for scale, phases in report["scales"].items():
+        print(f"\n{int(scale):,} rows")
+        print(pd.DataFrame(phases).T.to_string())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="10000,100000", help="comma-separated snapshot sizes in rows")
+    parser.add_argument("--repeat", type=int, default=3, help="sessions per scale; latency is the median")
+    parser.add_argument("--secret", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra app secret, e.g. ANALYST_STREAMING=true (repeatable)")
+    parser.add_argument("--workdir", help="where snapshots and logs go (default: a temporary directory)")
+    parser.add_argument("--save", help="write the report as JSON, e.g. as a new baseline")
+    parser.add_argument("--baseline", help="baseline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown per phase")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns below this many seconds")
+    args = parser.parse_args()
+
+    secrets = parse_secrets(args.secret)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        report = run_benchmark([int(rows) for rows in args.scales.split(",")], args.repeat, secrets, workdir)
+    print_report(report)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_delta)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
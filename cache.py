@@ -0,0 +1,333 @@
+"""Bounded in-process caches for query results and Cortex Analyst responses.
+
+Each can sit on a ``DiskCache``: a second tier in a directory that several
+app processes (replicas on one host, or on a shared volume) read and write.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process stampede guard
+    fcntl = None  # type: ignore[assignment]
+
+log = logging.getLogger(__name__)
+
+# Quoted literals/identifiers, or a run of whitespace outside them
+_SQL_TOKEN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace outside quotes and drop trailing semicolons.
+
+    Statements that differ only in layout map to the same cache key; string
+    literals and quoted identifiers are left untouched.
+    """
+    sql = _SQL_TOKEN.sub(lambda m: m.group(1) or " ", sql)
+    return sql.strip().rstrip(";").rstrip()
+
+
+def stable_hash(value: Any) -> str:
+    """SHA-256 of a JSON-serializable value, independent of dict key order."""
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def page_key(sql: str, offset: int, limit: int, max_bytes: int) -> Tuple[Any, ...]:
+    """Result-cache key of one page of an Analyst query's result."""
+    return ("page", normalize_sql(sql), offset, limit, max_bytes)
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def json_nbytes(value: Any) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class BoundedCache:
+    """Thread-safe LRU cache with a byte budget, per-entry TTL and data versioning.
+
+    Entries are dropped least-recently-used first once ``max_bytes`` is
+    exceeded, and lazily once older than ``ttl`` seconds. ``set_version``
+    clears everything when the underlying data changes. With a ``disk`` tier,
+    ``get_or_compute`` looks there before computing a missing entry.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = frame_nbytes,
+        disk: Optional["DiskCache"] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.disk = disk
+        self.version: Optional[str] = None
+        self.nbytes = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def set_version(self, version: str) -> None:
+        """Invalidate every entry if ``version`` differs from the current one."""
+        if self.disk is not None:
+            self.disk.set_version(version)
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None and self._entries:
+                self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self.nbytes = 0
+            self.version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, nbytes, expires = entry
+            if expires is not None and time.monotonic() > expires:
+                self._drop(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        nbytes = self.sizeof(value)
+        if nbytes > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, nbytes, expires)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Tuple[Any, str]:
+        """The value for ``key`` and where it came from: "hit", "disk" or "miss" (computed).
+
+        A computed value is stored in memory and on disk.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, "hit"
+        if self.disk is None:
+            value, source = compute(), "miss"
+        else:
+            value, computed = self.disk.get_or_compute(key, compute)
+            source = "miss" if computed else "disk"
+        self.put(key, value)
+        return value, source
+
+    def _drop(self, key: Hashable) -> None:
+        _, nbytes, _ = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {**self._stats, "entries": len(self._entries), "bytes": self.nbytes}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+def _write_frame(path: str, df: pd.DataFrame) -> None:
+    import pyarrow as pa
+
+    try:
+        table = pa.Table.from_pandas(df)
+    except pa.ArrowException as e:  # e.g. an object column mixing strings and numbers
+        raise ValueError(f"cannot convert the frame to Arrow: {e}") from e
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_frame(path: str) -> pd.DataFrame:
+    import pyarrow as pa
+
+    with pa.OSFile(path, "rb") as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def _write_json(path: str, value: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        try:
+            json.dump(value, f, default=str)
+        except TypeError as e:  # e.g. non-string dict keys
+            raise ValueError(f"cannot encode the value as JSON: {e}") from e
+
+
+def _read_json(path: str) -> Any:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# File extension, writer and reader per value type. Writers raise ValueError
+# for values they cannot serialize.
+CODECS = {
+    "frame": (".arrow", _write_frame, _read_frame),  # DataFrames as Arrow IPC files
+    "json": (".json", _write_json, _read_json),
+}
+
+
+class DiskCache:
+    """Cache entries as files in ``directory``, safe to share between processes.
+
+    Each entry is one file named by a hash of the data version and key,
+    written to a temporary name and moved into place with ``os.replace``, so
+    readers see a whole entry or none. Entries expire ``ttl`` seconds after
+    they were written; once the directory grows past ``max_bytes`` the least
+    recently read are deleted. ``get_or_compute`` holds an exclusive lock on
+    the entry while computing it, so concurrent misses for one key (in any
+    process) compute it once and the rest read the result.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: Optional[float] = None, codec: str = "frame") -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version: Optional[str] = None
+        self.extension, self._write, self._read = CODECS[codec]
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def set_version(self, version: str) -> None:
+        """Entries of other data versions are no longer read; eviction removes them."""
+        self.version = version
+
+    def _path(self, key: Hashable, suffix: str) -> str:
+        return os.path.join(self.directory, stable_hash([self.version, key]) + suffix)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        path = self._path(key, self.extension)
+        try:
+            written = os.stat(path).st_mtime
+            if self.ttl is not None and time.time() - written > self.ttl:
+                raise FileNotFoundError(path)
+            value = self._read(path)
+            # Access time orders eviction; the modification time stays the write time
+            os.utime(path, (time.time(), written))
+        except (OSError, ValueError):  # missing, expired, evicted meanwhile or unreadable
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        path = self._path(key, self.extension)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self._write(tmp, value)
+            if os.path.getsize(tmp) > self.max_bytes:
+                os.remove(tmp)
+                return
+            os.replace(tmp, path)
+        except (OSError, ValueError) as e:
+            # A full or read-only volume, or a value the codec cannot write
+            # (e.g. duplicate column names), only costs the disk tier
+            self._stats["errors"] += 1
+            log.warning("disk cache: not storing %s: %s", os.path.basename(path), e)
+            self._remove(tmp)
+            return
+        self._stats["writes"] += 1
+        self._evict()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """The value for ``key`` and whether this call computed it."""
+        value = self.get(key)
+        if value is not None:
+            return value, False
+        with self._locked(self._path(key, ".lock")):
+            # Another process may have computed it while we waited for the lock
+            value = self.get(key)
+            if value is not None:
+                return value, False
+            value = compute()
+            self.put(key, value)
+            return value, True
+
+    @contextmanager
+    def _locked(self, path: str, blocking: bool = True) -> Iterator[bool]:
+        """Hold an exclusive lock on ``path``; yields False if non-blocking and already held."""
+        if fcntl is None:
+            yield True
+            return
+        with open(path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            # Eviction judges a lock file's age by its mtime, which appending
+            # mode never changes
+            os.utime(path)
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _evict(self) -> None:
+        # One process evicts at a time; the others skip rather than wait
+        with self._locked(os.path.join(self.directory, ".evict.lock"), blocking=False) as acquired:
+            if not acquired:
+                return
+            entries, total, now = [], 0, time.time()
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith(self.extension):
+                        entries.append((stat.st_atime, stat.st_size, entry.path))
+                        total += stat.st_size
+                    elif (entry.name.endswith((".tmp", ".lock")) and not entry.name.startswith(".")
+                          and now - stat.st_mtime > 3600):
+                        # Leftovers of crashed writers, and locks of long-gone
+                        # entries unless someone still holds them
+                        if entry.name.endswith(".tmp"):
+                            self._remove(entry.path)
+                        else:
+                            with self._locked(entry.path, blocking=False) as unheld:
+                                if unheld:
+                                    self._remove(entry.path)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+                    self._stats["evictions"] += 1
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
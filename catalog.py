@@ -0,0 +1,117 @@
+"""The dashboard's filter options (years, health elements, countries), persisted to disk.
+
+A saved catalog lets a new session draw its filter widgets without waiting
+on any query. ``CatalogStore`` serves the saved copy and rebuilds it once the
+data version it was built from goes stale.
+
+Build (or rebuild after a data load) with::
+
+    python catalog.py [CATALOG_OUT]
+
+using the backend configured in ``.streamlit/secrets.toml``.
+"""
+import json
+import os
+import sys
+import threading
+from concurrent.futures import Executor
+from typing import Callable, List, NamedTuple, Optional
+
+import pandas as pd
+
+from queries import Query, compile_query
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalog.json")
+
+CATALOG_QUERIES = {
+    "years": Query(
+        dimensions=("DELIVERY_YEAR",),
+        non_null=("DELIVERY_YEAR",),
+        order_by=("DELIVERY_YEAR DESC",),
+    ),
+    "health_elements": Query(
+        dimensions=("HEALTH_ELEMENT",),
+        exclude_health_elements=True,
+        order_by=("HEALTH_ELEMENT",),
+    ),
+    "countries": Query(
+        dimensions=("COUNTRY",),
+        order_by=("COUNTRY",),
+    ),
+}
+
+
+class Catalog(NamedTuple):
+    years: List[int]
+    health_elements: List[str]
+    countries: List[str]
+    data_version: str
+
+
+def build_catalog(run: Callable[[Query], pd.DataFrame], data_version: str, executor: Optional[Executor] = None) -> Catalog:
+    """Run the catalog queries through ``run`` (which compiles and executes a ``Query``).
+
+    With an ``executor`` the queries run concurrently on it.
+    """
+    if executor is None:
+        results = {name: run(query) for name, query in CATALOG_QUERIES.items()}
+    else:
+        futures = {name: executor.submit(run, query) for name, query in CATALOG_QUERIES.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    return Catalog(
+        years=[int(year) for year in results["years"]["DELIVERY_YEAR"].tolist()],
+        health_elements=[str(value) for value in results["health_elements"]["HEALTH_ELEMENT"].tolist()],
+        countries=[str(value) for value in results["countries"]["COUNTRY"].tolist()],
+        data_version=data_version,
+    )
+
+
+def save_catalog(path: str, catalog: Catalog) -> None:
+    """Write atomically, so concurrent readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(catalog._asdict(), f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_catalog(path: str) -> Optional[Catalog]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return Catalog(**json.load(f))
+    except (FileNotFoundError, TypeError, ValueError):
+        return None
+
+
+class CatalogStore:
+    """Process-wide current catalog: the saved copy until ``refresh`` finds newer data."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.current = load_catalog(path)
+
+    def refresh(
+        self, data_version: str, run: Callable[[Query], pd.DataFrame], executor: Optional[Executor] = None
+    ) -> Catalog:
+        """Rebuild and save the catalog unless it already matches ``data_version``."""
+        current = self.current
+        if current is not None and current.data_version == data_version:
+            return current
+        catalog = build_catalog(run, data_version, executor)
+        save_catalog(self.path, catalog)
+        self.current = catalog
+        return catalog
+
+
+if __name__ == "__main__":
+    from backends import create_backend
+    from settings import load_secrets
+
+    if len(sys.argv) > 2:
+        sys.exit("usage: python catalog.py [CATALOG_OUT]")
+    secrets = load_secrets()
+    backend = create_backend(secrets)
+    out = sys.argv[1] if len(sys.argv) == 2 else secrets.get("CATALOG_PATH", DEFAULT_CATALOG)
+    catalog = CatalogStore(out).refresh(backend.data_version(), lambda query: backend.execute(*compile_query(query)))
+    print(f"{len(catalog.years)} years, {len(catalog.health_elements)} health elements, "
+          f"{len(catalog.countries)} countries -> {out}")
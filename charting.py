@@ -0,0 +1,121 @@
+"""Shrink Analyst query results before they are sent to the browser as charts.
+
+Line charts are downsampled with Largest-Triangle-Three-Buckets (LTTB), which
+keeps peaks and troughs that plain striding would drop. Bar charts with too
+many categories keep the top N and fold the rest into an "Other" bar, unless
+they are a timeline, which is downsampled like a line instead.
+"""
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+OTHER_LABEL = "Other"
+
+# Column-name fragments of numbers that mean nothing summed (years, durations, averages, ratios)
+NON_ADDITIVE_WORDS = ("time", "date", "year", "month", "avg", "average", "mean", "median", "pct", "percent", "rate", "ratio")
+
+# Index-name fragments of timelines, whose bars must stay in time order
+TEMPORAL_WORDS = ("date", "year", "quarter", "month", "week", "day")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the ``n_out`` points that best preserve the shape of ``y`` over ``x``.
+
+    ``x`` must be sorted ascending. The first and last points are always kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # n_out - 2 buckets over the interior points; the endpoints are fixed
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _numeric_axis(values: pd.Series) -> Optional[np.ndarray]:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=float)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+    return None
+
+
+def downsample_line(
+    df: pd.DataFrame,
+    y: List[str],
+    x: Optional[str] = None,
+    max_points: int = 2000,
+) -> pd.DataFrame:
+    """At most about ``max_points`` rows of ``df`` chosen by LTTB on each ``y`` column.
+
+    The x axis is column ``x`` when given, else the index; non-numeric axes are
+    treated as evenly spaced in their current order.
+    """
+    if len(df.index) <= max_points or not y:
+        return df
+    axis = df[x] if x is not None else df.index.to_series()
+    positions = _numeric_axis(axis)
+    if positions is not None:
+        order = np.argsort(positions, kind="stable")
+        df, positions = df.iloc[order], positions[order]
+        keep = ~np.isnan(positions)
+        df, positions = df[keep], positions[keep]
+    else:
+        positions = np.arange(len(df.index), dtype=float)
+    # Split the point budget across series; the union keeps each one's shape
+    per_series = max(3, max_points // len(y))
+    selected = np.unique(np.concatenate([
+        lttb(positions, df[column].to_numpy(dtype=float, na_value=np.nan).copy(), per_series)
+        for column in y
+    ]))
+    return df.iloc[selected]
+
+
+def additive_columns(columns: List[str]) -> List[str]:
+    """The columns whose values can be summed across categories, judged by name."""
+    return [column for column in columns if not any(word in str(column).lower() for word in NON_ADDITIVE_WORDS)]
+
+
+def is_temporal(index: pd.Index) -> bool:
+    """Whether ``index`` is a timeline: datetimes, or named like a date or period."""
+    if pd.api.types.is_datetime64_any_dtype(index) or isinstance(index, pd.PeriodIndex):
+        return True
+    return any(word in str(name).lower() for name in index.names for word in TEMPORAL_WORDS)
+
+
+def top_n_other(df: pd.DataFrame, value_columns: List[str], n: int = 25) -> pd.DataFrame:
+    """``value_columns`` of ``df``, with labels past the top ``n`` folded into "Other".
+
+    Frames with at most ``n`` distinct index labels come back as they are.
+    Otherwise only the additive value columns (see ``additive_columns``) are
+    kept and summed per label; the top ``n`` labels by the first of them stay
+    and the rest are summed into one "Other" row. Without any additive
+    column there is nothing to fold, and the frame comes back as it is.
+    Neither is a timeline (see ``is_temporal``) folded: ranking days by
+    volume would lose the time axis, so those go through ``downsample_line``.
+    """
+    measures = additive_columns(value_columns)
+    if df.index.nunique() <= n or not measures or is_temporal(df.index):
+        return df[value_columns]
+    totals = df[measures].groupby(level=0, sort=False, observed=True).sum()
+    ranked = totals.sort_values(measures[0], ascending=False, kind="stable")
+    top, rest = ranked.iloc[:n], ranked.iloc[n:]
+    top.index = top.index.astype(str)
+    other = rest.sum().to_frame(OTHER_LABEL).T
+    return pd.concat([top, other])
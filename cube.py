@@ -0,0 +1,117 @@
+"""In-memory shipment cube backing the dashboard's KPI row and charts.
+
+``filter_mask`` and ``charted_mask`` select the cells of any cube with
+COUNTRY, HEALTH_ELEMENT and DELIVERY_YEAR columns; the delay cube and the
+duration sketches use them too.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from queries import EXCLUDED_HEALTH_ELEMENTS, FilterState, Query
+
+CUBE_QUERY = Query(
+    dimensions=("COUNTRY", "HEALTH_ELEMENT", "DELIVERY_YEAR"),
+    measures=("SHIPMENT_COUNT",),
+)
+
+
+def charted_mask(data: pd.DataFrame) -> np.ndarray:
+    """Rows whose health element the charts show."""
+    element = data['HEALTH_ELEMENT']
+    # Mirrors SQL's NOT IN, which also drops NULL health elements
+    return (element.notna() & ~element.isin(EXCLUDED_HEALTH_ELEMENTS)).to_numpy()
+
+
+def filter_mask(data: pd.DataFrame, filters: FilterState) -> np.ndarray:
+    """Rows selected by ``filters``; NULL years are only selected without a year filter."""
+    mask = np.ones(len(data), dtype=bool)
+    if filters.years is not None:
+        mask &= data['DELIVERY_YEAR'].isin(filters.years).fillna(False).to_numpy(dtype=bool)
+    if filters.health_element is not None:
+        mask &= (data['HEALTH_ELEMENT'] == filters.health_element).to_numpy(dtype=bool)
+    if filters.country is not None:
+        mask &= (data['COUNTRY'] == filters.country).to_numpy(dtype=bool)
+    return mask
+
+
+class ShipmentCube:
+    """COUNTRY x HEALTH_ELEMENT x DELIVERY_YEAR shipment counts.
+
+    Built once from the result of ``CUBE_QUERY``; every dashboard metric is a
+    masked group-by over these few thousand cells instead of a warehouse query.
+    Methods take the filter panel's ``FilterState``.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.data = pd.DataFrame({
+            'COUNTRY': df['COUNTRY'].astype('category'),
+            'HEALTH_ELEMENT': df['HEALTH_ELEMENT'].astype('category'),
+            'DELIVERY_YEAR': pd.to_numeric(df['DELIVERY_YEAR']).astype('Int16'),
+            'SHIPMENT_COUNT': df['SHIPMENT_COUNT'].astype('int64'),
+        })
+        self._charted = charted_mask(self.data)
+
+    def _mask(self, filters: FilterState) -> np.ndarray:
+        return filter_mask(self.data, filters)
+
+    def total_shipments(self, filters: FilterState) -> int:
+        return int(self.data['SHIPMENT_COUNT'][self._mask(filters)].sum())
+
+    def countries_supported(self, filters: FilterState) -> int:
+        return int(self.data['COUNTRY'][self._mask(filters)].nunique())
+
+    def year_range(self, filters: FilterState) -> Tuple[Optional[int], Optional[int]]:
+        years = self.data['DELIVERY_YEAR'][self._mask(filters)].dropna()
+        if years.empty:
+            return None, None
+        return int(years.min()), int(years.max())
+
+    def by_health_element(self, filters: FilterState) -> pd.DataFrame:
+        """Shipments per health element, smallest first."""
+        rows = self.data[self._mask(filters) & self._charted]
+        return (
+            rows.groupby('HEALTH_ELEMENT', observed=True)['SHIPMENT_COUNT'].sum()
+            .reset_index()
+            .sort_values('SHIPMENT_COUNT', kind='stable')
+            .reset_index(drop=True)
+        )
+
+    def country_totals(self, filters: FilterState) -> pd.DataFrame:
+        """Shipments and distinct health elements per country, for the map."""
+        rows = self.data[self._mask(filters) & self._charted]
+        grouped = rows.groupby('COUNTRY', observed=True)
+        totals = grouped['SHIPMENT_COUNT'].sum().rename('SHIPMENT_COUNT').to_frame()
+        pairs = (
+            rows[['COUNTRY', 'HEALTH_ELEMENT']].drop_duplicates()
+            .astype({'HEALTH_ELEMENT': str})
+            .sort_values('HEALTH_ELEMENT')
+            .groupby('COUNTRY', observed=True)['HEALTH_ELEMENT']
+        )
+        totals['HEALTH_ELEMENTS_COUNT'] = pairs.size()
+        totals['HEALTH_ELEMENTS'] = pairs.agg(', '.join)
+        return totals.reset_index()
+
+    def recent_country_totals(self, filters: FilterState, since_year: int, limit: int = 10) -> pd.DataFrame:
+        """Top ``limit`` countries by shipments delivered in or after ``since_year``.
+
+        The year selection is ignored; only ``since_year`` bounds the period.
+        """
+        mask = self._mask(filters.without_years()) & self._charted
+        mask &= (self.data['DELIVERY_YEAR'] >= since_year).fillna(False).to_numpy(dtype=bool)
+        return (
+            self.data[mask].groupby('COUNTRY', observed=True)['SHIPMENT_COUNT'].sum()
+            .nlargest(limit)
+            .reset_index()
+        )
+
+    def yearly_health(self, filters: FilterState) -> pd.DataFrame:
+        """Shipments per delivery year and health element over all years, ordered by year."""
+        rows = self.data[self._mask(filters.without_years()) & self._charted]
+        return (
+            rows.groupby(['DELIVERY_YEAR', 'HEALTH_ELEMENT'], observed=True, dropna=False)['SHIPMENT_COUNT'].sum()
+            .reset_index()
+            .sort_values('DELIVERY_YEAR', kind='stable')
+            .reset_index(drop=True)
+        )
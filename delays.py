@@ -0,0 +1,139 @@
+"""Delivery-delay reason codes and the in-memory delay cube behind the dashboard's delay section.
+
+``data/code_lookup.csv`` (the semantic layer's CODE_LOOKUP table) is loaded
+once into a frame indexed by code, and reason codes are decorated with their
+names by mapping onto that index rather than joining in SQL. Codes starting
+with AD are acceptable delays and UD unacceptable ones.
+
+Durations are HCD's REASON_CODE_DURATION, whose unit is unknown (see
+``queries.REASON_DURATION``); they are bucketed by order of magnitude and
+never labelled as days.
+"""
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from cube import charted_mask, filter_mask
+from queries import DELAY_BUCKETS, FilterState, Query
+
+CODE_LOOKUP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "code_lookup.csv")
+
+CATEGORIES = {"AD": "Acceptable", "UD": "Unacceptable"}
+
+DELAY_QUERY = Query(
+    dimensions=("REASON_CODE", "COUNTRY", "HEALTH_ELEMENT", "DELIVERY_YEAR", "DELAY_BUCKET"),
+    measures=("SHIPMENT_COUNT", "REASON_DURATION_TOTAL", "REASON_DURATION_COUNT"),
+    non_null=("REASON_CODE",),
+)
+
+
+def load_code_lookup(path: str = CODE_LOOKUP_PATH) -> pd.DataFrame:
+    """NAME, DEFINITION and CATEGORY per reason code, indexed by CODE.
+
+    The export repeats its header row a few times and pads some values with
+    whitespace; both are cleaned up, and the first entry for a code wins.
+    """
+    lookup = pd.read_csv(path, dtype=str, keep_default_na=False)
+    lookup.columns = [str(column).strip().upper() for column in lookup.columns]
+    lookup = lookup.apply(lambda values: values.str.strip())
+    lookup = lookup[(lookup["CODE"] != "") & (lookup["CODE"].str.upper() != "CODE")]
+    lookup = lookup.drop_duplicates("CODE").set_index("CODE").sort_index()
+    lookup["CATEGORY"] = lookup.index.str[:2].map(CATEGORIES).fillna("Other")
+    return lookup[["NAME", "DEFINITION", "CATEGORY"]]
+
+
+def decorate(codes: pd.Series, lookup: pd.DataFrame) -> pd.DataFrame:
+    """``codes`` with their NAME and CATEGORY alongside; unknown codes are named after themselves.
+
+    On a categorical ``codes`` the mapping runs once per distinct code.
+    """
+    names = codes.map(lookup["NAME"])
+    return pd.DataFrame({
+        "REASON_CODE": codes,
+        "REASON_NAME": names.astype(object).where(names.notna(), codes.astype(object)),
+        "CATEGORY": codes.map(lookup["CATEGORY"]).astype(object).fillna("Other"),
+    })
+
+
+def bucket_label(lower: int) -> str:
+    """Label of the duration bucket starting at ``lower`` (see ``queries.DELAY_BUCKETS``)."""
+    index = DELAY_BUCKETS.index(lower)
+    if index + 1 == len(DELAY_BUCKETS):
+        return f"{lower:,}+"
+    if index == 0:
+        return f"under {DELAY_BUCKETS[1]:,}"
+    return f"{lower:,}-{DELAY_BUCKETS[index + 1] - 1:,}"
+
+
+class DelayCube:
+    """REASON_CODE x COUNTRY x HEALTH_ELEMENT x DELIVERY_YEAR x DELAY_BUCKET delayed shipments.
+
+    Built once from the result of ``DELAY_QUERY``, which routes to the delay
+    rollup; the section's charts are masked group-bys over it, like
+    ``ShipmentCube``'s. Codes are decorated from ``lookup`` at build time.
+    """
+
+    def __init__(self, df: pd.DataFrame, lookup: pd.DataFrame) -> None:
+        codes = df['REASON_CODE'].astype('category')
+        decorated = decorate(codes, lookup)
+        self.data = pd.DataFrame({
+            'REASON_CODE': codes,
+            'REASON_NAME': decorated['REASON_NAME'].astype('category'),
+            'CATEGORY': decorated['CATEGORY'].astype('category'),
+            'COUNTRY': df['COUNTRY'].astype('category'),
+            'HEALTH_ELEMENT': df['HEALTH_ELEMENT'].astype('category'),
+            'DELIVERY_YEAR': pd.to_numeric(df['DELIVERY_YEAR']).astype('Int16'),
+            'DELAY_BUCKET': pd.to_numeric(df['DELAY_BUCKET']).astype('Int16'),
+            'SHIPMENT_COUNT': df['SHIPMENT_COUNT'].astype('int64'),
+            'REASON_DURATION_TOTAL': pd.to_numeric(df['REASON_DURATION_TOTAL']).fillna(0.0).astype('float64'),
+            'REASON_DURATION_COUNT': df['REASON_DURATION_COUNT'].astype('int64'),
+        })
+        # Same health elements as the shipment charts
+        self._charted = charted_mask(self.data)
+
+    def _mask(self, filters: FilterState) -> np.ndarray:
+        return filter_mask(self.data, filters) & self._charted
+
+    def by_reason(self, filters: FilterState, limit: Optional[int] = None) -> pd.DataFrame:
+        """Delayed shipments and mean reason duration per reason code, most frequent first."""
+        rows = self.data[self._mask(filters)]
+        grouped = (
+            rows.groupby(['REASON_CODE', 'REASON_NAME', 'CATEGORY'], observed=True)
+            [['SHIPMENT_COUNT', 'REASON_DURATION_TOTAL', 'REASON_DURATION_COUNT']].sum()
+            .reset_index()
+        )
+        grouped['MEAN_REASON_DURATION'] = grouped['REASON_DURATION_TOTAL'] / grouped['REASON_DURATION_COUNT'].replace(0, np.nan)
+        grouped = grouped.sort_values(['SHIPMENT_COUNT', 'REASON_CODE'], ascending=[False, True], kind='stable')
+        if limit is not None:
+            grouped = grouped.head(limit)
+        return grouped.drop(columns=['REASON_DURATION_TOTAL', 'REASON_DURATION_COUNT']).reset_index(drop=True)
+
+    def duration_distribution(self, filters: FilterState, codes: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Delayed shipments per reason-duration bucket and category, buckets in order.
+
+        ``codes`` narrows the distribution to those reason codes.
+        """
+        mask = self._mask(filters)
+        if codes is not None:
+            mask &= self.data['REASON_CODE'].isin(list(codes)).to_numpy(dtype=bool)
+        rows = self.data[mask]
+        grouped = (
+            rows.groupby(['DELAY_BUCKET', 'CATEGORY'], observed=True)['SHIPMENT_COUNT'].sum()
+            .reset_index()
+            .sort_values(['DELAY_BUCKET', 'CATEGORY'], kind='stable')
+            .reset_index(drop=True)
+        )
+        grouped['DURATION'] = grouped['DELAY_BUCKET'].map(bucket_label)
+        return grouped
+
+    def yearly_by_category(self, filters: FilterState) -> pd.DataFrame:
+        """Delayed shipments per delivery year and category over all years, ordered by year."""
+        rows = self.data[self._mask(filters.without_years())]
+        return (
+            rows.groupby(['DELIVERY_YEAR', 'CATEGORY'], observed=True)['SHIPMENT_COUNT'].sum()
+            .reset_index()
+            .sort_values(['DELIVERY_YEAR', 'CATEGORY'], kind='stable')
+            .reset_index(drop=True)
+        )
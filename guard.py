@@ -0,0 +1,130 @@
+"""Guards around running SQL that Cortex Analyst generated.
+
+Before a statement runs, the backend's EXPLAIN estimate is checked against a
+scan budget (``check_cost``). While it runs, ``run_guarded`` waits for it on a
+separate thread so the caller can enforce a timeout, and cancels it if the
+wait is interrupted: in Streamlit, the heartbeat's UI update raises as soon as
+the session reruns or disconnects. The row and byte caps on the fetched result
+are applied by ``QueryBackend.fetch_page``. ``guarded_page`` chains all of
+them; the dashboard and ``batch.py`` fetch Analyst results through it.
+
+A guard that stops a statement raises ``GuardError`` naming itself; an
+interrupted wait re-raises whatever interrupted it.
+"""
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from typing import Any, Callable, Dict, Mapping, NamedTuple, Optional
+
+import pandas as pd
+
+from backends import CancelHandle, QueryBackend
+
+
+class GuardLimits(NamedTuple):
+    max_scan_bytes: Optional[int] = None  # EXPLAIN's bytes scanned (Snowflake)
+    max_scan_rows: Optional[int] = None  # EXPLAIN's largest row estimate (DuckDB)
+    timeout: Optional[float] = None  # seconds
+
+    @classmethod
+    def from_secrets(cls, secrets: Mapping[str, Any]) -> "GuardLimits":
+        """QUERY_MAX_SCAN_MB, QUERY_MAX_SCAN_ROWS and QUERY_TIMEOUT; 0 turns a guard off."""
+        max_scan_mb = secrets.get("QUERY_MAX_SCAN_MB", 10_240)
+        return cls(
+            max_scan_bytes=max_scan_mb * 2**20 if max_scan_mb else None,
+            max_scan_rows=secrets.get("QUERY_MAX_SCAN_ROWS") or None,
+            timeout=secrets.get("QUERY_TIMEOUT", 120) or None,
+        )
+
+
+class GuardError(Exception):
+    """A guard stopped the statement; ``guard`` is "cost" or "timeout"."""
+
+    def __init__(self, guard: str, message: str) -> None:
+        super().__init__(message)
+        self.guard = guard
+
+
+def check_cost(estimate: Dict[str, Optional[int]], limits: GuardLimits) -> None:
+    """Raise if the planner's ``estimate`` (see ``QueryBackend.explain``) is over budget."""
+    scan_bytes = estimate.get("bytes")
+    if limits.max_scan_bytes is not None and scan_bytes is not None and scan_bytes > limits.max_scan_bytes:
+        raise GuardError(
+            "cost",
+            f"the query would scan about {scan_bytes / 2**20:,.0f} MB "
+            f"(limit {limits.max_scan_bytes / 2**20:,.0f} MB)",
+        )
+    scan_rows = estimate.get("rows")
+    if limits.max_scan_rows is not None and scan_rows is not None and scan_rows > limits.max_scan_rows:
+        raise GuardError(
+            "cost",
+            f"the query would process about {scan_rows:,} rows (limit {limits.max_scan_rows:,})",
+        )
+
+
+def run_guarded(
+    fetch: Callable[[CancelHandle], Any],
+    timeout: Optional[float] = None,
+    heartbeat: Optional[Callable[[float], None]] = None,
+    poll_interval: float = 0.25,
+) -> Any:
+    """``fetch(handle)`` on its own thread, cancelled on timeout or if the wait is interrupted.
+
+    ``heartbeat(elapsed_seconds)`` runs on the calling thread every
+    ``poll_interval``; anything it raises cancels the statement and propagates.
+    """
+    handle = CancelHandle()
+    future: Future = Future()
+
+    def work() -> None:
+        try:
+            future.set_result(fetch(handle))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=work, name="guarded-query", daemon=True).start()
+    started = time.monotonic()
+    try:
+        while True:
+            try:
+                return future.result(timeout=poll_interval)
+            except TimeoutError:
+                pass
+            elapsed = time.monotonic() - started
+            if timeout is not None and elapsed > timeout:
+                raise GuardError("timeout", f"the query ran for more than {timeout:g} seconds")
+            if heartbeat is not None:
+                heartbeat(elapsed)
+    except BaseException:
+        if not future.done():
+            try:
+                handle.cancel()
+            except Exception:
+                pass  # the interruption matters more than a failed cancel
+        raise
+
+
+def guarded_page(
+    backend: QueryBackend,
+    sql: str,
+    offset: int,
+    limit: int,
+    max_bytes: int,
+    limits: GuardLimits,
+    heartbeat: Optional[Callable[[float], None]] = None,
+    on_estimate: Optional[Callable[[Dict[str, Optional[int]]], None]] = None,
+) -> pd.DataFrame:
+    """``backend.fetch_page`` behind the cost check (first page only) and ``run_guarded``.
+
+    ``on_estimate`` is given the EXPLAIN estimate before it is checked.
+    """
+    if offset == 0:
+        estimate = backend.explain(sql)
+        if on_estimate is not None:
+            on_estimate(estimate)
+        check_cost(estimate, limits)
+    return run_guarded(
+        lambda handle: backend.fetch_page(sql, offset, limit, max_bytes=max_bytes, handle=handle),
+        timeout=limits.timeout,
+        heartbeat=heartbeat,
+    )
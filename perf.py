@@ -0,0 +1,84 @@
+"""Timing instrumentation for queries, Cortex Analyst calls and rendering.
+
+Each rerun gets a ``RerunRecorder``; code wraps its steps in
+``recorder.timed(name, **fields)`` and fills in what it learns (rows, bytes,
+cache hit, query id) on the yielded span. Spans that can query the backend
+carry ``queries``, the number of result queries they ran (0 when served from
+a cache), so a session's query count is their sum. Finished spans go to a process-wide
+``PerfLog``, which keeps recent history for latency percentiles and, when
+given a path, appends every span as one JSON line.
+"""
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+class PerfLog:
+    """Thread-safe sink for finished spans, shared by all sessions."""
+
+    def __init__(self, path: Optional[str] = None, history: int = 5_000) -> None:
+        self.path = path
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def record(self, span: Dict[str, Any]) -> None:
+        with self._lock:
+            self._history.append(span)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span, default=str) + "\n")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Count, p50 and p95 seconds per span name over the recent history."""
+        with self._lock:
+            durations: Dict[str, List[float]] = defaultdict(list)
+            for span in self._history:
+                durations[span["name"]].append(span["seconds"])
+        return {
+            name: {
+                "count": len(values),
+                "p50": round(float(np.percentile(values, 50)), 4),
+                "p95": round(float(np.percentile(values, 95)), 4),
+            }
+            for name, values in sorted(durations.items())
+        }
+
+
+class RerunRecorder:
+    """Collects the spans of one script rerun; ``context`` is added to each span."""
+
+    def __init__(self, log: PerfLog, **context: Any) -> None:
+        self.log = log
+        self.context = context
+        self.spans: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def timed(self, name: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Time the block; the yielded dict can be given extra fields before it closes."""
+        span: Dict[str, Any] = {"name": name, **fields}
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = type(e).__name__
+            raise
+        finally:
+            self._finish(span, start)
+
+    def finish(self) -> None:
+        """Record the whole rerun as a span of its own."""
+        self._finish({"name": "rerun", "spans": len(self.spans)}, self.started)
+
+    def _finish(self, span: Dict[str, Any], start: float) -> None:
+        span["offset"] = round(start - self.started, 4)
+        span["seconds"] = round(time.perf_counter() - start, 4)
+        span = {"ts": time.time(), **self.context, **span}
+        # list.append is atomic, so query worker threads may record too
+        self.spans.append(span)
+        self.log.record(span)
@@ -0,0 +1,167 @@
+"""Canonical SQL for the dashboard's queries and filter state.
+
+Dashboard queries are described as data (``Query``) and compiled to SQL with
+bind variables. Predicates are sorted and filter values deduplicated, so
+logically equal filter states always compile to byte-identical statements and
+hit the same entries in our result cache and Snowflake's.
+
+A query can be compiled against raw HCD or against any rollup table (see
+``rollups.py``) that keeps all the dimensions it groups or filters on.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# A delayed shipment's reason code duration, which is text in HCD. Its unit is
+# undocumented: the semantic layer's samples (27852.0, 27905.0) are far too
+# large for days late, so it is reported as-is, never as days.
+REASON_DURATION = "TRY_CAST(REASON_CODE_DURATION AS DOUBLE)"
+
+# Lower bounds of the reason-duration buckets, one per order of magnitude so
+# they spread whatever the unit; the last is open-ended and smaller (or
+# negative) durations fall in the first
+DELAY_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000)
+
+
+def _delay_bucket() -> str:
+    cases = [f"WHEN {REASON_DURATION} < {upper} THEN {lower}" for lower, upper in zip(DELAY_BUCKETS, DELAY_BUCKETS[1:])]
+    cases.append(f"WHEN {REASON_DURATION} IS NOT NULL THEN {DELAY_BUCKETS[-1]}")
+    return "CASE " + " ".join(cases) + " END"
+
+
+# Logical dimension names used by the dashboard -> HCD columns (or expressions over them)
+DIMENSIONS = {
+    "COUNTRY": "COUNTRY",
+    "HEALTH_ELEMENT": "D365_HEALTH_ELEMENT",
+    "DELIVERY_YEAR": "LATEST_ACTUAL_DELIVERY_DATE_YEAR",
+    "REASON_CODE": "REASON_CODE",
+    "DELAY_BUCKET": _delay_bucket(),
+}
+
+# Logical measure names -> (aggregate over HCD rows, re-aggregate over a rollup).
+# Only additive measures, so any rollup that keeps the needed dimensions can
+# answer them exactly.
+MEASURES = {
+    "SHIPMENT_COUNT": ("COUNT(*)", "SUM(SHIPMENT_COUNT)"),
+    "NUMBER_OF_SHIPMENTS": ("SUM(NUMBER_OF_SHIPMENTS)", "SUM(NUMBER_OF_SHIPMENTS)"),
+    "SHIPPED_QUANTITY": ("SUM(SHIPPED_QUANTITY)", "SUM(SHIPPED_QUANTITY)"),
+    "ORDER_CYCLE_TIME_TOTAL": ("SUM(ORDER_CYCLE_TIME)", "SUM(ORDER_CYCLE_TIME_TOTAL)"),
+    "ORDER_CYCLE_TIME_COUNT": ("COUNT(ORDER_CYCLE_TIME)", "SUM(ORDER_CYCLE_TIME_COUNT)"),
+    "REASON_DURATION_TOTAL": (f"SUM({REASON_DURATION})", "SUM(REASON_DURATION_TOTAL)"),
+    "REASON_DURATION_COUNT": (f"COUNT({REASON_DURATION})", "SUM(REASON_DURATION_COUNT)"),
+}
+
+# Health elements left out of the dashboard charts and filter options
+EXCLUDED_HEALTH_ELEMENTS = ('311Mission', 'HIV', 'Population TO3', 'Tuberculosis')
+
+
+@dataclass(frozen=True)
+class FilterState:
+    """The filter panel's selection in canonical form; ``None`` means no filter."""
+
+    years: Optional[Tuple[int, ...]] = None
+    health_element: Optional[str] = None
+    country: Optional[str] = None
+
+    @classmethod
+    def from_selection(
+        cls,
+        years: Optional[Iterable[int]] = None,
+        health_element: Optional[str] = None,
+        country: Optional[str] = None,
+    ) -> "FilterState":
+        """Build from widget values, treating 'All' and empty selections as no filter."""
+        return cls(
+            years=tuple(sorted({int(year) for year in years})) if years else None,
+            health_element=None if health_element in (None, 'All') else health_element,
+            country=None if country in (None, 'All') else country,
+        )
+
+    def without_years(self) -> "FilterState":
+        return FilterState(health_element=self.health_element, country=self.country)
+
+
+@dataclass(frozen=True)
+class Query:
+    """A GROUP BY over HCD in terms of logical dimensions and measures.
+
+    ``order_by`` entries are output names, optionally followed by `` DESC``.
+    """
+
+    dimensions: Tuple[str, ...] = ()
+    measures: Tuple[str, ...] = ()
+    filters: FilterState = field(default_factory=FilterState)
+    exclude_health_elements: bool = False
+    non_null: Tuple[str, ...] = ()
+    order_by: Tuple[str, ...] = ()
+    limit: Optional[int] = None
+
+    def required_dimensions(self) -> FrozenSet[str]:
+        """Dimensions a table must keep to answer this query exactly."""
+        needed = set(self.dimensions) | set(self.non_null)
+        if self.filters.years is not None:
+            needed.add("DELIVERY_YEAR")
+        if self.filters.health_element is not None or self.exclude_health_elements:
+            needed.add("HEALTH_ELEMENT")
+        if self.filters.country is not None:
+            needed.add("COUNTRY")
+        return frozenset(needed)
+
+
+def _predicates(query: Query, column: Callable[[str], str]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """(dimension, SQL, binds) for every predicate the query implies."""
+    predicates = []
+
+    def in_list(dimension: str, operator: str, prefix: str, values: Iterable[Any]) -> None:
+        binds = {f"{prefix}_{i}": value for i, value in enumerate(values)}
+        placeholders = ", ".join(f"%({name})s" for name in binds)
+        predicates.append((dimension, f"{column(dimension)} {operator} ({placeholders})", binds))
+
+    filters = query.filters
+    if filters.years is not None:
+        in_list("DELIVERY_YEAR", "IN", "delivery_year", filters.years)
+    if filters.health_element is not None:
+        predicates.append(("HEALTH_ELEMENT", f"{column('HEALTH_ELEMENT')} = %(health_element)s", {"health_element": filters.health_element}))
+    if filters.country is not None:
+        predicates.append(("COUNTRY", f"{column('COUNTRY')} = %(country)s", {"country": filters.country}))
+    if query.exclude_health_elements:
+        in_list("HEALTH_ELEMENT", "NOT IN", "excluded", sorted(set(EXCLUDED_HEALTH_ELEMENTS)))
+    for dimension in sorted(set(query.non_null)):
+        predicates.append((dimension, f"{column(dimension)} IS NOT NULL", {}))
+    return sorted(predicates, key=lambda predicate: (predicate[0], predicate[1]))
+
+
+def compile_query(query: Query, table: str = "HCD", rollup: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """Canonical SQL text and bind parameters (pyformat ``%(name)s``) for ``query``.
+
+    With ``rollup=True``, ``table`` is a rollup whose columns carry the
+    logical dimension and measure names, and measures are re-aggregated.
+    """
+    outputs = set(query.dimensions) | set(query.measures)
+    for entry in query.order_by:
+        name, _, direction = entry.partition(" ")
+        if name not in outputs or direction not in ("", "ASC", "DESC"):
+            raise ValueError(f"Cannot order by {entry!r}")
+
+    def column(dimension: str) -> str:
+        return dimension if rollup else DIMENSIONS[dimension]
+
+    select = [
+        column(dimension) if column(dimension) == dimension else f"{column(dimension)} AS {dimension}"
+        for dimension in query.dimensions
+    ]
+    select.extend(f"{MEASURES[measure][1 if rollup else 0]} AS {measure}" for measure in query.measures)
+
+    params: Dict[str, Any] = {}
+    lines = ["SELECT " + ", ".join(select), f"FROM {table}"]
+    predicates = _predicates(query, column)
+    if predicates:
+        lines.append("WHERE " + " AND ".join(sql for _, sql, _ in predicates))
+        for _, _, binds in predicates:
+            params.update(binds)
+    if query.dimensions:
+        lines.append("GROUP BY " + ", ".join(column(dimension) for dimension in query.dimensions))
+    if query.order_by:
+        lines.append("ORDER BY " + ", ".join(query.order_by))
+    if query.limit is not None:
+        lines.append(f"LIMIT {int(query.limit)}")
+    return "\n".join(lines), params
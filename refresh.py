@@ -0,0 +1,80 @@
+"""Stale-while-revalidate refresh of values derived from the HCD data.
+
+A ``Refresher`` holds the current value (for the dashboard: the shipment cube
+and rollups) together with the data version it was built from. A background
+thread polls a cheap version probe; when the version changes it builds the new
+value off the request path and swaps it in. Until then every caller gets the
+previous value without waiting. Only the very first ``get`` builds
+synchronously.
+"""
+import threading
+import time
+import weakref
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class Snapshot(NamedTuple):
+    data_version: str
+    value: Any
+    as_of: float  # time.time() when the value was built
+
+
+class Refresher:
+    """Serves ``build(data_version)`` and rebuilds it when ``probe()`` changes.
+
+    ``interval`` is the number of seconds between probes. A failed probe or
+    build keeps the previous snapshot; the exception is kept in ``last_error``
+    and the next poll tries again.
+    """
+
+    def __init__(self, probe: Callable[[], str], build: Callable[[str], Any], interval: float = 300) -> None:
+        self.probe = probe
+        self.build = build
+        self.interval = interval
+        self.current: Optional[Snapshot] = None
+        self.last_error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+
+    def get(self) -> Snapshot:
+        current = self.current
+        if current is None:
+            with self._lock:
+                if self.current is None:
+                    version = self.probe()
+                    self.current = Snapshot(version, self.build(version), time.time())
+                    self._start()
+                current = self.current
+        return current
+
+    def check(self) -> bool:
+        """Probe once and rebuild if the data changed; True if a new snapshot was swapped in."""
+        with self._lock:
+            try:
+                version = self.probe()
+                if self.current is not None and version == self.current.data_version:
+                    return False
+                self.current = Snapshot(version, self.build(version), time.time())
+            except Exception as e:
+                self.last_error = e
+                return False
+            self.last_error = None
+            return True
+
+    def _start(self) -> None:
+        # The thread only holds a weak reference, so it ends once the refresher
+        # is dropped (e.g. when Streamlit's resource cache is cleared)
+        ref = weakref.ref(self)
+        interval = self.interval
+
+        def poll() -> None:
+            while True:
+                time.sleep(interval)
+                refresher = ref()
+                if refresher is None:
+                    return
+                refresher.check()
+                del refresher
+
+        self._poller = threading.Thread(target=poll, name="refresher", daemon=True)
+        self._poller.start()
@@ -0,0 +1,137 @@
+"""Pre-aggregated rollups of HCD and routing of dashboard queries onto them.
+
+The build step reads the dimensions and measures declared in the semantic
+layer, materializes one rollup table per dimension combination the dashboard
+groups or filters on, and records them in a manifest. ``route`` then sends a
+``Query`` to the smallest rollup that still answers it exactly, falling back to
+raw HCD when none does.
+
+Build (or rebuild after a data load) with::
+
+    python rollups.py [MANIFEST_OUT]
+
+using the backend configured in ``.streamlit/secrets.toml``.
+"""
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from queries import DIMENSIONS, MEASURES, Query, compile_query
+from semantic import load_columns
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rollups.json")
+
+# Dimension combinations the dashboard groups or filters on, largest first
+ROLLUP_DIMENSIONS = (
+    ("REASON_CODE", "COUNTRY", "HEALTH_ELEMENT", "DELIVERY_YEAR", "DELAY_BUCKET"),
+    ("COUNTRY", "HEALTH_ELEMENT", "DELIVERY_YEAR"),
+    ("COUNTRY", "HEALTH_ELEMENT"),
+    ("HEALTH_ELEMENT", "DELIVERY_YEAR"),
+    ("COUNTRY",),
+    ("HEALTH_ELEMENT",),
+    ("DELIVERY_YEAR",),
+)
+
+# First column an expression reads, e.g. ORDER_CYCLE_TIME in SUM(ORDER_CYCLE_TIME)
+_SOURCE_COLUMN = re.compile(r"\((\w+)[ )]")
+
+
+class Rollup(NamedTuple):
+    table: str
+    dimensions: Tuple[str, ...]
+    rows: int
+    location: Optional[str] = None  # Parquet file, for backends that keep rollups outside the warehouse
+
+
+def rollup_table(dimensions: Tuple[str, ...]) -> str:
+    return "HCD_ROLLUP_" + "_".join(dimensions)
+
+
+def rollup_measures() -> Tuple[str, ...]:
+    """Every additive measure whose source column the semantic layer declares."""
+    columns = load_columns()
+    measures = []
+    for measure, (raw, _) in MEASURES.items():
+        source = _SOURCE_COLUMN.search(raw)
+        if source is None or source.group(1) in columns:
+            measures.append(measure)
+    return tuple(measures)
+
+
+def rollup_query(dimensions: Tuple[str, ...], measures: Tuple[str, ...]) -> Query:
+    columns = load_columns()
+    for dimension in dimensions:
+        source = _SOURCE_COLUMN.search(DIMENSIONS[dimension])
+        column = source.group(1) if source else DIMENSIONS[dimension]
+        if column not in columns:
+            raise KeyError(f"{column} is not declared in the semantic model")
+    return Query(dimensions=dimensions, measures=measures)
+
+
+def route(query: Query, rollups: List[Rollup]) -> Tuple[str, Dict[str, Any]]:
+    """SQL and binds for ``query`` against the smallest rollup that can answer it.
+
+    A rollup qualifies when it keeps every dimension the query groups or
+    filters on; otherwise the query runs against raw HCD.
+    """
+    needed = query.required_dimensions()
+    candidates = [rollup for rollup in rollups if needed <= set(rollup.dimensions)]
+    if not candidates:
+        return compile_query(query)
+    best = min(candidates, key=lambda rollup: rollup.rows)
+    return compile_query(query, table=best.table, rollup=True)
+
+
+def build_rollups(backend: Any) -> List[Rollup]:
+    """Materialize every rollup through ``backend`` and return their descriptions."""
+    measures = rollup_measures()
+    rollups = []
+    for dimensions in ROLLUP_DIMENSIONS:
+        sql, params = compile_query(rollup_query(dimensions, measures))
+        location = backend.materialize(rollup_table(dimensions), sql, params)
+        rows = backend.execute(f"SELECT COUNT(*) FROM {rollup_table(dimensions)}").iloc[0, 0]
+        rollups.append(Rollup(rollup_table(dimensions), dimensions, int(rows), location))
+    return rollups
+
+
+def write_manifest(path: str, backend: Any, rollups: List[Rollup]) -> None:
+    manifest = {
+        "backend": backend.name,
+        "data_version": backend.data_version(),
+        "rollups": [rollup._asdict() for rollup in rollups],
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(path: str, backend: Any) -> List[Rollup]:
+    """Rollups from ``path`` if they were built from the backend's current data, else none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return []
+    if manifest.get("backend") != backend.name or manifest.get("data_version") != backend.data_version():
+        return []
+    return [
+        Rollup(entry["table"], tuple(entry["dimensions"]), entry["rows"], entry.get("location"))
+        for entry in manifest["rollups"]
+    ]
+
+
+if __name__ == "__main__":
+    from backends import create_backend
+    from settings import load_secrets
+
+    if len(sys.argv) > 2:
+        sys.exit("usage: python rollups.py [MANIFEST_OUT]")
+    secrets = load_secrets()
+    backend = create_backend(secrets)
+    manifest_path = sys.argv[1] if len(sys.argv) == 2 else secrets.get("ROLLUP_MANIFEST", DEFAULT_MANIFEST)
+    built = build_rollups(backend)
+    write_manifest(manifest_path, backend, built)
+    for rollup in built:
+        print(f"{rollup.table}: {rollup.rows} rows")
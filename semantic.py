@@ -0,0 +1,172 @@
+"""Read HCD_Semantic_Layer.yaml, the Cortex Analyst semantic model.
+
+Besides the column declarations, the model drives the pandas dtypes that
+query results are converted to (``frame_from_arrow``).
+"""
+import hashlib
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+import pandas as pd
+import yaml
+
+SEMANTIC_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "HCD_Semantic_Layer.yaml")
+
+
+class Column(NamedTuple):
+    name: str
+    kind: str  # "dimension", "time_dimension" or "measure"
+    data_type: str
+    expr: str
+    sample_values: List[str]
+    description: Optional[str]
+
+
+@lru_cache(maxsize=None)
+def load_model(path: str = SEMANTIC_MODEL_PATH) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def model_version(secrets: Mapping[str, Any], path: str = SEMANTIC_MODEL_PATH) -> str:
+    """SEMANTIC_MODEL_VERSION if set, else a hash of the local semantic layer YAML."""
+    version = secrets.get("SEMANTIC_MODEL_VERSION")
+    if version:
+        return str(version)
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_columns(table: str = "HCD", path: str = SEMANTIC_MODEL_PATH) -> Dict[str, Column]:
+    """Every dimension and measure declared for ``table``, keyed by column name."""
+    for spec in load_model(path)["tables"]:
+        if spec["name"] != table:
+            continue
+        columns = {}
+        for kind, key in (("dimension", "dimensions"), ("time_dimension", "time_dimensions"), ("measure", "measures")):
+            for column in spec.get(key) or []:
+                columns[column["name"]] = Column(
+                    name=column["name"],
+                    kind=kind,
+                    data_type=column.get("data_type", "TEXT").upper(),
+                    expr=column.get("expr", column["name"]),
+                    sample_values=[str(value) for value in column.get("sample_values") or []],
+                    description=column.get("description"),
+                )
+        return columns
+    raise KeyError(f"Table {table!r} is not in the semantic model {path}")
+
+
+# A declared TEXT column is only made categorical when it repeats enough to pay off
+CATEGORY_MAX_DISTINCT_RATIO = 0.5
+
+_US_DATE = re.compile(r"^\d{2}-\d{2}-\d{4}$")
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def logical_type(column: Column) -> str:
+    """"category", "numeric", "date" or "boolean" for a declared column.
+
+    The model declares most columns TEXT, so numbers and MM-DD-YYYY dates are
+    recognized from their sample values.
+    """
+    if column.data_type in ("NUMBER", "FLOAT", "INTEGER", "DECIMAL"):
+        return "numeric"
+    if column.data_type == "BOOLEAN":
+        return "boolean"
+    if column.data_type in ("DATE", "TIMESTAMP"):
+        return "date"
+    samples = [value for value in column.sample_values if value not in ("", "None")]
+    if samples and all(_US_DATE.match(value) or _ISO_DATE.match(value) for value in samples):
+        return "date"
+    if samples and all(_is_number(value) for value in samples):
+        return "numeric"
+    return "category"
+
+
+@lru_cache(maxsize=None)
+def logical_types(table: str = "HCD", path: str = SEMANTIC_MODEL_PATH) -> Dict[str, str]:
+    """Logical type per column name, including the dashboard's logical dimension names."""
+    from queries import DIMENSIONS
+
+    types = {name: logical_type(column) for name, column in load_columns(table, path).items()}
+    for logical, column in DIMENSIONS.items():
+        types.setdefault(logical, types.get(column, "category"))
+    return types
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    for fmt in ("%m-%d-%Y", "%Y-%m-%d"):
+        try:
+            return pd.to_datetime(values, format=fmt)
+        except (TypeError, ValueError):
+            continue
+    return values
+
+
+def frame_from_arrow(table: Any) -> pd.DataFrame:
+    """Convert an Arrow table to a compact DataFrame using the semantic layer's types.
+
+    Repetitive text becomes categorical (dictionary-encoded in Arrow, so each
+    distinct string is stored once), exact decimals become int64/float64 and
+    integers are downcast to the smallest type that holds them. Floats stay
+    float64 so quantities keep their precision.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    types = logical_types()
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        kind = types.get(name)
+        if pa.types.is_decimal(column.type):
+            column = column.cast(pa.int64() if column.type.scale == 0 else pa.float64())
+        elif (
+            kind == "category"
+            and (pa.types.is_string(column.type) or pa.types.is_large_string(column.type))
+            and pc.count_distinct(column).as_py() <= max(1, len(column) * CATEGORY_MAX_DISTINCT_RATIO)
+        ):
+            column = column.dictionary_encode()
+        columns.append(column)
+    df = pa.Table.from_arrays(columns, names=table.column_names).to_pandas(
+        date_as_object=False, split_blocks=True, self_destruct=True
+    )
+    for name in df.columns:
+        kind = types.get(name)
+        values = df[name]
+        if pd.api.types.is_integer_dtype(values):
+            df[name] = pd.to_numeric(values, downcast="integer")
+        elif kind == "date" and pd.api.types.is_string_dtype(values):
+            df[name] = _parse_dates(values)
+        elif kind == "numeric" and pd.api.types.is_string_dtype(values):
+            try:
+                df[name] = pd.to_numeric(values)
+            except (TypeError, ValueError):
+                pass
+    return df
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """``pd.concat`` that keeps categorical columns categorical across pages.
+
+    Pages are converted separately, so their categories differ; unify them
+    first rather than letting pandas fall back to object strings.
+    """
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return pd.DataFrame()
+    for name in frames[0].columns:
+        if all(isinstance(frame[name].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = pd.api.types.union_categoricals([frame[name] for frame in frames]).categories
+            frames = [frame.assign(**{name: frame[name].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
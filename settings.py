@@ -0,0 +1,32 @@
+"""App settings outside Streamlit, for the command-line tools.
+
+The dashboard reads ``st.secrets``; ``rollups.py``, ``catalog.py``,
+``batch.py`` and ``bench.py`` read the same ``.streamlit/secrets.toml`` with
+``load_secrets`` and take ``--secret KEY=VALUE`` overrides parsed by
+``parse_secret``.
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, Mapping, Tuple
+
+
+def load_secrets(path: str = os.path.join(".streamlit", "secrets.toml")) -> Mapping[str, Any]:
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import toml as tomllib  # type: ignore[no-redef]
+
+        with open(path, encoding="utf-8") as f:
+            return tomllib.load(f)
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def parse_secret(entry: str) -> Tuple[str, Any]:
+    """``KEY=VALUE`` as a key and value; numbers and true/false are decoded as JSON."""
+    key, _, value = entry.partition("=")
+    return key, json.loads(value) if value[:1].isdigit() or value in ("true", "false") else value
+
+
+def parse_secrets(entries: Iterable[str]) -> Dict[str, Any]:
+    return dict(parse_secret(entry) for entry in entries)
@@ -0,0 +1,156 @@
+"""Mergeable quantile sketches of HCD's duration measures, per dashboard cell.
+
+Each duration (order cycle time, days late, and the per-milestone stage
+durations) is summarized per COUNTRY x HEALTH_ELEMENT x DELIVERY_YEAR cell as
+counts over logarithmic buckets, the sketch DDSketch uses. The warehouse builds
+them in one aggregate query (``sketch_query``). Merging sketches is adding
+their bucket counts, so the percentiles of any filter selection are a masked
+group-by over the cells in memory rather than a scan of raw HCD.
+
+Error bound: a bucket spans values within a factor ``GAMMA`` of each other,
+and is represented by a value within ``RELATIVE_ACCURACY`` (1%) of every value
+in it. So each reported percentile is within 1% of the actual value at that
+rank, however many cells were merged. Durations between -1 and 1 day share one
+bucket and are reported as 0; NaN durations are left out.
+"""
+import math
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cube import charted_mask, filter_mask
+from queries import DIMENSIONS, FilterState
+from semantic import load_columns
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+# Duration measures (HCD columns, in days) -> label
+DURATIONS = {
+    "ORDER_CYCLE_TIME": "Order cycle time",
+    "AVERAGE_DAYS_LATE": "Days late",
+    "RO_VALIDATION": "RO validation",
+    "SOURCING_AND_PLANNING": "Sourcing and planning",
+    "MANUFACTURE": "Manufacture",
+    "QUALITY_ASSURANCE": "Quality assurance",
+    "PICK_UP": "Pick up",
+    "DELIVER": "Deliver",
+}
+
+SKETCH_DIMENSIONS = ("COUNTRY", "HEALTH_ELEMENT", "DELIVERY_YEAR")
+
+
+def bucket_sql(value: str) -> str:
+    """Bucket key of ``value``: 0 below a day either way, else +/-(1 + ceil(log_GAMMA |value|)).
+
+    Keys stay floating point, so a NaN duration gets a NaN key rather than
+    failing the cast; ``DurationSketches`` drops those.
+    """
+    log_gamma = repr(math.log(GAMMA))
+    return (
+        f"CASE WHEN {value} >= 1 THEN CEIL(LN({value}) / {log_gamma}) + 1"
+        f" WHEN {value} <= -1 THEN -CEIL(LN(-{value}) / {log_gamma}) - 1"
+        f" WHEN {value} IS NOT NULL THEN 0 END"
+    )
+
+
+def bucket_values(keys: np.ndarray) -> np.ndarray:
+    """Representative value of each bucket key, within RELATIVE_ACCURACY of its members."""
+    keys = np.asarray(keys, dtype=np.int64)
+    magnitude = 2 * np.power(GAMMA, np.abs(keys) - 1.0) / (GAMMA + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * magnitude)
+
+
+def sketch_measures() -> Tuple[str, ...]:
+    """Every duration the semantic layer declares."""
+    columns = load_columns()
+    return tuple(measure for measure in DURATIONS if measure in columns)
+
+
+def sketch_query(measures: Optional[Sequence[str]] = None, table: str = "HCD") -> str:
+    """COUNTRY, HEALTH_ELEMENT, DELIVERY_YEAR, MEASURE, BUCKET, COUNT for every non-null duration."""
+    columns = load_columns()
+    dimensions = ", ".join(
+        DIMENSIONS[dimension] if DIMENSIONS[dimension] == dimension else f"{DIMENSIONS[dimension]} AS {dimension}"
+        for dimension in SKETCH_DIMENSIONS
+    )
+    group_by = ", ".join(DIMENSIONS[dimension] for dimension in SKETCH_DIMENSIONS)
+    selects = []
+    for measure in measures if measures is not None else sketch_measures():
+        # Most durations are text in the warehouse
+        value = f"TRY_CAST({measure} AS DOUBLE)" if columns[measure].data_type == "TEXT" else measure
+        bucket = bucket_sql(value)
+        selects.append(
+            f"SELECT {dimensions}, '{measure}' AS MEASURE, {bucket} AS BUCKET, COUNT(*) AS COUNT\n"
+            f"FROM {table}\n"
+            f"WHERE {value} IS NOT NULL\n"
+            f"GROUP BY {group_by}, {bucket}"
+        )
+    return "\nUNION ALL\n".join(selects)
+
+
+class Sketch(NamedTuple):
+    """One merged sketch: bucket keys in ascending order and their counts."""
+
+    keys: np.ndarray
+    counts: np.ndarray
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantiles(self, qs: Sequence[float]) -> np.ndarray:
+        """Estimated value at each quantile in ``qs``; NaN for an empty sketch."""
+        total = self.count
+        if total == 0:
+            return np.full(len(qs), np.nan)
+        ranks = np.asarray(qs, dtype=float) * (total - 1)
+        index = np.searchsorted(np.cumsum(self.counts), ranks, side='right')
+        return bucket_values(self.keys[np.minimum(index, len(self.keys) - 1)])
+
+
+class DurationSketches:
+    """Per-cell duration sketches, built once from the result of ``sketch_query``.
+
+    Methods take the filter panel's ``FilterState``; the cells it selects are
+    merged by summing their bucket counts.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        df = df[pd.to_numeric(df['BUCKET']).notna()]
+        self.data = pd.DataFrame({
+            'COUNTRY': df['COUNTRY'].astype('category'),
+            'HEALTH_ELEMENT': df['HEALTH_ELEMENT'].astype('category'),
+            'DELIVERY_YEAR': pd.to_numeric(df['DELIVERY_YEAR']).astype('Int16'),
+            'MEASURE': df['MEASURE'].astype('category'),
+            'BUCKET': pd.to_numeric(df['BUCKET']).astype('int32'),
+            'COUNT': df['COUNT'].astype('int64'),
+        })
+        # Same health elements as the shipment charts
+        self._charted = charted_mask(self.data)
+
+    def _mask(self, filters: FilterState) -> np.ndarray:
+        return filter_mask(self.data, filters) & self._charted
+
+    def sketches(self, filters: FilterState) -> Dict[str, Sketch]:
+        """The merged sketch of every duration over the selected cells."""
+        rows = self.data[self._mask(filters)]
+        merged = rows.groupby(['MEASURE', 'BUCKET'], observed=True)['COUNT'].sum()
+        return {
+            str(measure): Sketch(buckets.index.get_level_values('BUCKET').to_numpy(np.int64), buckets.to_numpy())
+            for measure, buckets in merged.groupby(level='MEASURE', observed=True)
+        }
+
+    def percentiles(self, filters: FilterState, qs: Sequence[float] = (0.5, 0.9, 0.99)) -> pd.DataFrame:
+        """MEASURE, LABEL, COUNT and one P<nn> column per quantile, in ``DURATIONS`` order."""
+        sketches = self.sketches(filters)
+        rows = []
+        for measure, label in DURATIONS.items():
+            sketch = sketches.get(measure)
+            if sketch is None:
+                continue
+            row = {'MEASURE': measure, 'LABEL': label, 'COUNT': sketch.count}
+            row.update({f"P{q * 100:g}": value for q, value in zip(qs, sketch.quantiles(qs))})
+            rows.append(row)
+        return pd.DataFrame(rows, columns=['MEASURE', 'LABEL', 'COUNT', *(f"P{q * 100:g}" for q in qs)])
@@ -0,0 +1,321 @@
+"""Synthetic HCD data at any scale, shaped by the semantic layer.
+
+Column names, types, value formats and vocabularies come from
+``HCD_Semantic_Layer.yaml``; the rules below only add the structure the
+model can't express:
+
+- lines belong to orders, and order-level attributes (country, funding,
+  fulfillment, order and planned dates) are shared by an order's lines
+- ROPOLINE is RO_NUMBER + PO_DO_IO_NUMBER + PRIME_LINE_NUMBER
+- milestone dates follow the order lifecycle, and stage durations, order
+  cycle time and on-time/in-full flags are computed from them
+- *_YEAR, *_YEAR_MONTH, *_FISCAL_YEAR and *_FISCAL_QUARTER_YEAR columns are
+  derived from their date (US fiscal year, starting in October)
+
+Rows are generated chunk by chunk with NumPy/Arrow array operations and
+appended to one Parquet file, so memory stays bounded at any row count::
+
+    python synthetic.py 10000000 data/hcd_10m.parquet
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from delays import CODE_LOOKUP_PATH, load_code_lookup
+from semantic import Column, load_columns, logical_type
+
+# The model lists only a few sample countries; shipments go to many more
+EXTRA_VALUES = {
+    "COUNTRY": [
+        "Angola", "Benin", "Burundi", "Cameroon", "Democratic Republic of the Congo", "Ethiopia",
+        "Ghana", "Guinea", "Haiti", "Kenya", "Liberia", "Madagascar", "Malawi", "Mali",
+        "Mozambique", "Nigeria", "Rwanda", "Senegal", "Sierra Leone", "South Sudan", "Tanzania",
+        "Zimbabwe",
+    ],
+}
+
+# Order lifecycle: (milestone, mean days after the previous one, share missing)
+MILESTONES = [
+    ("ORDER_ENTRY_DATE", 0, 0.0),
+    ("RO_CLARIFIED_DATE", 10, 0.5),
+    ("RO_SENT_PLAN_FULFILLMENT_DATE", 12, 0.5),
+    ("RO_SENT_SOURCING_RFX_EVENT_DATE", 15, 0.5),
+    ("INITIAL_PSM_SOURCE_APPROVAL_DATE", 20, 0.0),
+    ("RECIPIENT_APPROVAL_DATE", 3, 0.0),
+    ("USAID_APPROVAL_DATE", 4, 0.0),
+    ("PO_RELEASED_FOR_FULFILLMENT_DATE", 25, 0.0),
+    ("COMMITTED_GOODS_AVAILABLE_DATE", 45, 0.0),
+    ("ACTUAL_GOODS_AVAILABLE_DATE", 15, 0.3),
+    ("QA_COMPLETE_DATE", 12, 0.5),
+    ("ACTUAL_CARGO_READY_DATE", 5, 0.3),
+    ("MAX_PICK_UP_DATE", 6, 0.3),
+    ("MAX_SHIP_DATE", 2, 0.0),
+    ("MAX_DEPARTURE_DATE", 3, 0.3),
+    ("MAX_ARRIVAL_DATE", 25, 0.3),
+    ("LATEST_ACTUAL_DELIVERY_DATE", 8, 0.0),
+]
+
+# Stage durations in days: (stage, from milestone, to milestone)
+STAGES = [
+    ("RO_VALIDATION", "ORDER_ENTRY_DATE", "RO_CLARIFIED_DATE"),
+    ("SOURCING_AND_PLANNING", "RO_CLARIFIED_DATE", "INITIAL_PSM_SOURCE_APPROVAL_DATE"),
+    ("USAID_APPROVAL", "RECIPIENT_APPROVAL_DATE", "USAID_APPROVAL_DATE"),
+    ("PROCESS_PO_DO", "USAID_APPROVAL_DATE", "PO_RELEASED_FOR_FULFILLMENT_DATE"),
+    ("MANUFACTURE", "PO_RELEASED_FOR_FULFILLMENT_DATE", "ACTUAL_GOODS_AVAILABLE_DATE"),
+    ("QUALITY_ASSURANCE", "ACTUAL_GOODS_AVAILABLE_DATE", "QA_COMPLETE_DATE"),
+    ("PICK_UP", "ACTUAL_CARGO_READY_DATE", "MAX_PICK_UP_DATE"),
+    ("DELIVER", "MAX_PICK_UP_DATE", "LATEST_ACTUAL_DELIVERY_DATE"),
+    ("ORDER_CYCLE_TIME", "ORDER_ENTRY_DATE", "LATEST_ACTUAL_DELIVERY_DATE"),
+]
+
+# Columns drawn together, so e.g. a product's name, category and unit agree
+ORDER_GROUPS = [
+    ["D365_HEALTH_ELEMENT", "D365_FUNDING_SOURCE", "D365_FUNDING_SOURCE_DETAIL", "TASK_ORDER", "CONDOM_ADJUSTED_TASK_ORDER"],
+    ["ORDER_TYPE", "FULFILLMENT_METHOD", "TLP_INDICATOR"],
+    ["VENDOR_INCOTERM", "DESTINATION_INCOTERM"],
+    ["COUNTRY"],
+    ["TRANSPORTATION_MODE"],
+    ["FISCAL_YEAR_FUNDING"],
+    ["FRAMEWORK_CONTRACT"],
+]
+LINE_GROUPS = [
+    ["PRODUCT_ID", "PRODUCT_NAME", "PRODUCT_CATEGORY", "ITEM_TRACER_CATEGORY", "UOM", "BASE_UNIT",
+     "BASE_UNIT_MULTIPLIER", "ILLUSTRATIVE_PRICE"],
+]
+
+_DERIVED = re.compile(r"^(?P<date>.+_DATE)_(?P<part>YEAR|YEAR_MONTH|FISCAL_YEAR|FISCAL_QUARTER_YEAR)$")
+_LONG_DATE = re.compile(r"^[A-Z][a-z]+  [A-Z][a-z]+ \d{1,2}  \d{4}$")
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _labels(labels: List[Any], index: np.ndarray, missing: Optional[np.ndarray] = None) -> pa.Array:
+    """``labels[index]`` as a dictionary-encoded Arrow array, null where ``missing``.
+
+    Each label is stored once however many rows use it, and Parquet writes
+    the dictionary as is.
+    """
+    return pa.DictionaryArray.from_arrays(pa.array(index.astype(np.int32), mask=missing), pa.array(labels))
+
+
+def _vocabulary(column: Column) -> Tuple[List[str], float]:
+    """Non-null sample values (plus extras), and the share of rows left null."""
+    values = [value for value in column.sample_values if value not in ("", "None")]
+    values += [value for value in EXTRA_VALUES.get(column.name, []) if value not in values]
+    null_share = 0.2 if len(values) < len(column.sample_values) else 0.0
+    return values, null_share
+
+
+def reason_codes(path: str = CODE_LOOKUP_PATH) -> List[str]:
+    """Delay reason codes from the lookup export."""
+    return load_code_lookup(path).index.tolist()
+
+
+class Generator:
+    """Produces HCD-shaped Arrow tables, ``chunk_rows`` at a time."""
+
+    def __init__(self, seed: int = 0, start_year: int = 2016, end_year: int = 2024) -> None:
+        self.columns = load_columns()
+        self.types = {name: logical_type(column) for name, column in self.columns.items()}
+        self.rng = np.random.default_rng(seed)
+        self.start = np.datetime64(f"{start_year}-01-01", "D")
+        self.days = int((np.datetime64(f"{end_year + 1}-01-01", "D") - self.start).astype(int))
+        self.next_order = 0
+        self.reason_codes = reason_codes()
+
+    def _choice(self, count: int, size: int) -> np.ndarray:
+        """Indices into a vocabulary of ``count`` values, skewed towards the first ones."""
+        weights = 1.0 / np.arange(1, count + 1)
+        return self.rng.choice(count, size=size, p=weights / weights.sum())
+
+    def _nulls(self, size: int, share: float) -> Optional[np.ndarray]:
+        return self.rng.random(size) < share if share else None
+
+    def _categorical(self, names: List[str], index: np.ndarray, out: Dict[str, Any]) -> None:
+        for name in names:
+            if name not in self.columns:
+                continue
+            values, null_share = _vocabulary(self.columns[name])
+            if not values:
+                continue
+            if self.types[name] == "numeric":
+                values = [float(value) for value in values]
+            out[name] = _labels(values, index % len(values), self._nulls(len(index), null_share))
+
+    def chunk(self, rows: int) -> pa.Table:
+        rng = self.rng
+        out: Dict[str, Any] = {}
+
+        # Orders of 1-20 lines; each chunk starts a new order
+        new_order = rng.random(rows) < 0.3
+        new_order[0] = True
+        order = np.cumsum(new_order) - 1
+        orders = int(order[-1]) + 1
+        first_line = np.maximum.accumulate(np.where(new_order, np.arange(rows), 0))
+        line = np.arange(rows) - first_line + 1
+        order_id = self.next_order + order
+        self.next_order += orders
+
+        po = pc.binary_join_element_wise("PO", pc.cast(pa.array(10_000_000 + order_id), pa.string()), "")
+        ro_number = 10_000_000 + order_id * 3 + rng.integers(0, 3, orders)[order]
+        ro = pc.binary_join_element_wise("RO", pc.cast(pa.array(ro_number), pa.string()), "")
+        out["RO_NUMBER"] = ro
+        out["PO_DO_IO_NUMBER"] = po
+        out["ORDER_NUMBER"] = po
+        out["PRIME_LINE_NUMBER"] = line
+        out["ROPOLINE"] = pc.binary_join_element_wise(ro, po, pc.cast(pa.array(line), pa.string()), "")
+
+        for names in ORDER_GROUPS:
+            width = max(len(_vocabulary(self.columns[n])[0]) for n in names if n in self.columns)
+            self._categorical(names, self._choice(max(width, 1), orders)[order], out)
+        for names in LINE_GROUPS:
+            width = max(len(_vocabulary(self.columns[n])[0]) for n in names if n in self.columns)
+            self._categorical(names, self._choice(max(width, 1), rows), out)
+
+        # Milestones: cumulative gaps from an order's entry date, plus per-line jitter
+        dates: Dict[str, np.ndarray] = {}
+        entry = (self.start - _EPOCH).astype(np.int64) + rng.integers(0, self.days, orders)[order]
+        current = entry.astype(float)
+        for name, mean_gap, _ in MILESTONES:
+            if mean_gap:
+                current = current + rng.gamma(2.0, mean_gap / 2.0, rows)
+            dates[name] = current
+        requested = entry + rng.integers(120, 300, orders)[order]
+        agreed = requested + rng.normal(0, 20, orders)[order]
+        revised = agreed + np.where(rng.random(orders) < 0.4, rng.normal(30, 30, orders), 0)[order]
+        dates["REQUESTED_DELIVERY_DATE"] = requested.astype(float)
+        dates["AGREED_DELIVERY_DATE"] = agreed
+        dates["REVISED_AGREED_DELIVERY_DATE"] = revised
+        dates["ESTIMATED_DELIVERY_DATE"] = revised + rng.normal(0, 10, rows)
+        days = {name: np.floor(value).astype(np.int64) for name, value in dates.items()}
+        missing = {name: self._nulls(rows, share) for name, _, share in MILESTONES}
+
+        for stage, start, end in STAGES:
+            duration = (days[end] - days[start]).astype(float)
+            for name in (start, end):
+                if missing.get(name) is not None:
+                    duration[missing[name]] = np.nan
+            out[stage] = duration
+        out["ESTIMATED_LEAD_TIME_IN_DAYS"] = (days["ESTIMATED_DELIVERY_DATE"] - days["ORDER_ENTRY_DATE"]).astype(float)
+
+        # Quantities and delivery performance
+        ordered = np.ceil(rng.lognormal(5, 1.5, rows)).astype(np.int64)
+        partial = rng.random(rows) < 0.08
+        shipped = np.where(partial, np.floor(ordered * rng.uniform(0.3, 1.0, rows)), ordered).astype(np.int64)
+        in_full = shipped >= ordered
+        late = (days["LATEST_ACTUAL_DELIVERY_DATE"] - days["REVISED_AGREED_DELIVERY_DATE"]).astype(float)
+        on_time = late <= 0
+        out["ORDERED_QUANTITY"] = ordered
+        out["SHIPPED_QUANTITY"] = shipped
+        out["NUMBER_OF_SHIPMENTS"] = rng.geometric(0.7, rows)
+        out["IN_FULL_IFD"] = in_full
+        out["STATUS_NAME"] = _labels(["Partially Delivered", "Shipment Delivered"], in_full)
+        out["AVERAGE_DAYS_LATE"] = late
+        out["ON_TIME_OTD"] = _labels(["N", "Y"], on_time)
+        out["BETWEEN_M14_AND_14"] = _labels(["N", "Y"], np.abs(late) <= 14)
+        out["BETWEEN_P30_AND_30"] = _labels(["N", "Y"], np.abs(late) <= 30)
+        otif = ["Not On Time Not In Full", "Not On Time In Full", "On Time Not In Full", "On Time In Full"]
+        for name, timely in (
+            ("OTIF_CATEGORIES", on_time),
+            ("OTIF_BETWEEN_M14_AND_14", np.abs(late) <= 14),
+            ("OTIF_BETWEEN_M30_AND_30", np.abs(late) <= 30),
+        ):
+            out[name] = _labels(otif, 2 * timely + in_full)
+        out["LINE_DELIVERY_STATUS"] = _labels(
+            ["Delivered - Early", "Delivered - On Time", "Delivered - Late"], np.digitize(late, [-14, 15])
+        )
+        out["AVERAGE_DAYS_LATE_BINNED"] = _labels(
+            ["<-14", "Between -14 and 0", "Between 1 and 7", "Between 8 and 30", ">30"], np.digitize(late, [-14, 1, 8, 31])
+        )
+        delayed = (late > 14) & (rng.random(rows) < 0.7)
+        out["REASON_CODE"] = _labels(self.reason_codes, self._choice(len(self.reason_codes), rows), ~delayed)
+        out["REASON_CODE_DURATION"] = np.where(delayed, late, np.nan)
+
+        for name in dates:
+            self._dates(name, days[name], missing.get(name), out)
+
+        # Anything the rules above don't cover is drawn from its samples
+        for name, column in self.columns.items():
+            if name not in out:
+                self._categorical([name], self._choice(max(len(_vocabulary(column)[0]), 1), rows), out)
+        return pa.table({name: out[name] for name in self.columns if name in out})
+
+    def _dates(self, name: str, days: np.ndarray, missing: Optional[np.ndarray], out: Dict[str, Any]) -> None:
+        """The date column in its sample format, and every column derived from it.
+
+        A chunk spans only a few thousand distinct days, so text is formatted
+        once per distinct value and referenced by index.
+        """
+        # Days are dense in a small range, so offsets from the first one index them
+        first = int(days.min())
+        distinct = np.arange(first, int(days.max()) + 1)
+        inverse = days - first
+        calendar = pd.DatetimeIndex((distinct + _EPOCH).astype("datetime64[ns]"))
+        year = calendar.year.to_numpy()
+        fiscal_year = year + (calendar.month.to_numpy() >= 10)
+        fiscal_quarter = (calendar.month.to_numpy() + 2) % 12 // 3 + 1
+
+        def gather(values: Any) -> pa.Array:
+            return _labels(values, inverse, missing)
+
+        if name in self.columns:
+            samples = [value for value in self.columns[name].sample_values if value != "None"]
+            if samples and _LONG_DATE.match(samples[0]):
+                # e.g. "Thursday  August 6  2020"
+                out[name] = gather([f"{d:%A}  {d:%B} {d.day}  {d.year}" for d in calendar])
+            else:
+                out[name] = gather(calendar.strftime("%m-%d-%Y").tolist())
+
+        for column, spec in self.columns.items():
+            match = _DERIVED.match(column)
+            if not match or match.group("date") != name:
+                continue
+            part = match.group("part")
+            if part in ("YEAR", "FISCAL_YEAR"):
+                values = year if part == "YEAR" else fiscal_year
+                # Declared NUMBER columns are integers; TEXT ones hold "2017.0"-style floats
+                out[column] = gather(values if spec.data_type == "NUMBER" else values.astype(float))
+            elif part == "YEAR_MONTH":
+                out[column] = gather(calendar.strftime("%Y-%m").tolist())
+            else:
+                separator = " " if spec.sample_values and " Q" in spec.sample_values[0] else "-"
+                out[column] = gather([f"{fy}{separator}Q{q}" for fy, q in zip(fiscal_year, fiscal_quarter)])
+
+
+def write_parquet(path: str, rows: int, chunk_rows: int = 1_000_000, seed: int = 0,
+                  start_year: int = 2016, end_year: int = 2024) -> None:
+    """Write ``rows`` synthetic HCD rows to ``path``, one row group per chunk."""
+    generator = Generator(seed=seed, start_year=start_year, end_year=end_year)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = None
+    try:
+        for offset in range(0, rows, chunk_rows):
+            table = generator.chunk(min(chunk_rows, rows - offset))
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic HCD data as Parquet.")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("out", help="Parquet file to write")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start-year", type=int, default=2016)
+    parser.add_argument("--end-year", type=int, default=2024)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    write_parquet(args.out, args.rows, args.chunk_rows, args.seed, args.start_year, args.end_year)
+    print(f"{args.rows:,} rows written to {args.out} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
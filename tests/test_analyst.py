@@ -0,0 +1,170 @@
+import pytest
+
+import analyst
+from analyst import (
+    REQUEST_ID_HEADER,
+    AnalystClient,
+    AnalystError,
+    ContentStream,
+    iter_sse_events,
+    read_response,
+    request_body,
+    response_key,
+    trim_history,
+)
+
+
+def question(text):
+    return {"role": "user", "content": [{"type": "text", "text": text}]}
+
+
+def answer(text, sql):
+    return {
+        "role": "analyst",
+        "content": [
+            {"type": "text", "text": text},
+            {"type": "sql", "statement": sql, "confidence": {"verified_query_used": None}},
+            {"type": "suggestions", "suggestions": ["More?"]},
+        ],
+        "request_id": "r",
+    }
+
+
+def test_trim_history_keeps_recent_turns_and_only_the_latest_sql():
+    messages = [question("q1"), answer("a1", "SELECT 1"), question("q2"), answer("a2", "SELECT 2"),
+                question("q3"), answer("a3", "SELECT 3"), question("q4")]
+    assert trim_history(messages, max_turns=2) == [
+        question("q2"),
+        {"role": "analyst", "content": [{"type": "text", "text": "a2"}]},
+        question("q3"),
+        {"role": "analyst", "content": [{"type": "text", "text": "a3"}, {"type": "sql", "statement": "SELECT 3"}]},
+        question("q4"),
+    ]
+
+
+def test_trim_history_starts_with_a_question():
+    messages = [question("q1"), answer("a1", "SELECT 1"), question("q2")]
+    assert trim_history(messages, max_turns=0) == [question("q2")]
+    assert trim_history(messages[1:], max_turns=5)[0] == question("q2")
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, data=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.data = data
+        self.text = "error"
+        self.closed = False
+
+    def json(self):
+        return self.data
+
+    def close(self):
+        self.closed = True
+
+
+def make_client(responses, monkeypatch, retries=3):
+    sleeps, tokens = [], []
+    monkeypatch.setattr(analyst.time, "sleep", sleeps.append)
+    client = AnalystClient("http://analyst.invalid", lambda refresh: tokens.append(refresh) or "t", retries=retries)
+    replies = iter(responses)
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: next(replies))
+    return client, sleeps, tokens
+
+
+def test_client_retries_transient_statuses_honouring_retry_after(monkeypatch):
+    client, sleeps, _ = make_client([FakeResponse(503), FakeResponse(429, {"Retry-After": "2"}), FakeResponse(200)],
+                                    monkeypatch)
+    assert client.post({}).status_code == 200
+    assert len(sleeps) == 2 and sleeps[1] == 2.0
+    assert 0 <= sleeps[0] <= client.backoff
+
+
+def test_client_gives_up_after_its_retries(monkeypatch):
+    client, sleeps, _ = make_client([FakeResponse(503)] * 3, monkeypatch, retries=2)
+    assert client.post({}).status_code == 503
+    assert len(sleeps) == 2
+
+
+def test_client_refreshes_an_expired_token_once(monkeypatch):
+    client, sleeps, tokens = make_client([FakeResponse(401), FakeResponse(401)], monkeypatch)
+    assert client.post({}).status_code == 401
+    assert tokens == [False, True]
+    assert sleeps == []
+
+
+def test_iter_sse_events_parses_events_and_multiline_data():
+    lines = [
+        b": keep-alive",
+        b"event: status",
+        b'data: {"status": "interpreting_question"}',
+        b"",
+        "event: message.content.delta",
+        'data: {"index": 0,',
+        'data:  "type": "text"}',
+        "",
+        'data: {"plain": true}',
+    ]
+    assert list(iter_sse_events(lines)) == [
+        ("status", {"status": "interpreting_question"}),
+        ("message.content.delta", {"index": 0, "type": "text"}),
+        ("message", {"plain": True}),
+    ]
+
+
+def test_iter_sse_events_skips_events_without_data():
+    assert list(iter_sse_events(["event: ping", "", ""])) == []
+
+
+def test_content_stream_reassembles_items():
+    events = [
+        ("status", {"status_message": "Generating SQL"}),
+        ("message.content.delta", {"index": 0, "type": "text", "text_delta": "This is "}),
+        ("message.content.delta", {"index": 0, "type": "text", "text_delta": "it."}),
+        ("message.content.delta", {"index": 1, "type": "sql", "statement_delta": "SELECT "}),
+        ("message.content.delta", {"index": 1, "type": "sql", "statement_delta": "1", "confidence": {"x": 1}}),
+        ("message.content.delta", {"index": 2, "type": "suggestions",
+                                   "suggestions_delta": {"index": 1, "suggestion_delta": "Why?"}}),
+        ("done", {}),
+    ]
+    stream = ContentStream(events)
+    kinds = [(kind, index) for kind, index, _ in stream]
+    assert kinds == [
+        ("status", None),
+        ("delta", 0), ("delta", 0), ("complete", 0),
+        ("delta", 1), ("delta", 1), ("complete", 1),
+        ("delta", 2), ("complete", 2),
+    ]
+    assert stream.content == [
+        {"type": "text", "text": "This is it."},
+        {"type": "sql", "statement": "SELECT 1", "confidence": {"x": 1}},
+        {"type": "suggestions", "suggestions": ["", "Why?"]},
+    ]
+
+
+def test_content_stream_raises_stream_errors():
+    events = [("error", {"code": "bad", "message": "no"})]
+    with pytest.raises(AnalystError) as error:
+        list(ContentStream(events, request_id="r1"))
+    assert error.value.request_id == "r1"
+
+
+SECRETS = {"SNOWFLAKE_DATABASE": "DB", "SNOWFLAKE_SCHEMA": "S", "SNOWFLAKE_STAGE": "STAGE", "SNOWFLAKE_FILE": "model.yaml"}
+
+
+def test_response_key_depends_on_the_conversation_and_model():
+    body = request_body([question("q1")], SECRETS)
+    assert body["semantic_model_file"] == "@DB.S.STAGE/model.yaml"
+    assert response_key(body, "m1") == response_key(request_body([question("q1")], SECRETS), "m1")
+    assert response_key(body, "m1") != response_key(body, "m2")
+    assert response_key(body, "m1") != response_key(request_body([question("q2")], SECRETS), "m1")
+
+
+def test_read_response_fixes_dates_and_keeps_the_request_id():
+    data = {"message": {"role": "analyst", "content": [{"type": "sql", "statement": "TO_DATE(D, 'MM-DD-YYYY')"}]}}
+    response = read_response(FakeResponse(200, {REQUEST_ID_HEADER: "r1"}, data))
+    assert response["request_id"] == "r1"
+    assert response["message"]["content"][0]["statement"] == "TO_DATE(D, 'YYYY-MM-DD')"
+    with pytest.raises(AnalystError) as error:
+        read_response(FakeResponse(400, {REQUEST_ID_HEADER: "r2"}))
+    assert error.value.request_id == "r2"
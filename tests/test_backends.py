@@ -0,0 +1,164 @@
+import itertools
+
+import pyarrow as pa
+import pytest
+
+from backends import SESSION_GONE_ERRNOS, SnowflakeBackend, SnowflakeConnectionPool
+
+ROWS = 25  # rows in every fake result, fetched in batches of 10
+_query_ids = itertools.count(1)
+
+
+class FakeCursor:
+    def __init__(self, statements: list) -> None:
+        self.statements = statements
+        self.sfqid = None
+        self.closed = False
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.closed = True
+
+    def execute(self, sql, params=None) -> None:
+        self.statements.append(sql)
+        self.sfqid = f"01b0-{next(_query_ids)}"
+
+    def fetch_arrow_batches(self):
+        for start in range(0, ROWS, 10):
+            yield pa.table({"N": list(range(start, min(start + 10, ROWS)))})
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.closed = False
+        self.session_id = 1
+        self.statements: list = []
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.statements)
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class SessionGone(Exception):
+    errno = next(iter(SESSION_GONE_ERRNOS))
+
+
+def make_pool(max_size: int = 2) -> SnowflakeConnectionPool:
+    return SnowflakeConnectionPool(FakeConnection, min_size=0, max_size=max_size, acquire_timeout=0.1)
+
+
+def test_connection_is_released_after_use():
+    pool = make_pool()
+    with pool.connection() as conn:
+        assert pool.metrics()["pool_in_use"] == 1
+    assert pool.metrics()["pool_idle"] == 1
+    with pool.connection() as again:
+        assert again is conn
+
+
+def test_closing_a_generator_early_releases_its_connection():
+    pool = make_pool()
+
+    def rows():
+        with pool.connection():
+            yield 1
+            yield 2
+
+    for _ in range(3):
+        gen = rows()
+        next(gen)
+        gen.close()
+    assert pool.metrics()["pool_in_use"] == 0
+
+
+def test_base_exception_releases_the_connection():
+    pool = make_pool(max_size=1)
+    with pytest.raises(KeyboardInterrupt):
+        with pool.connection():
+            raise KeyboardInterrupt
+    with pool.connection():
+        pass
+
+
+def test_error_keeps_a_healthy_connection_and_drops_a_dead_one():
+    pool = make_pool()
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("bad SQL")
+    assert pool.metrics()["pool_idle"] == 1
+
+    with pytest.raises(SessionGone):
+        with pool.connection():
+            raise SessionGone()
+    metrics = pool.metrics()
+    assert metrics["pool_size"] == 0 and metrics["closed"] == 1
+
+
+def test_acquire_times_out_when_every_connection_is_in_use():
+    pool = make_pool(max_size=1)
+    with pool.connection():
+        with pytest.raises(TimeoutError):
+            pool.acquire()
+
+
+def make_backend(max_size: int = 2):
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    pool = SnowflakeConnectionPool(connect, min_size=0, max_size=max_size, acquire_timeout=0.1)
+    return SnowflakeBackend(pool), connections
+
+
+def test_truncated_pages_return_their_connections():
+    backend, _ = make_backend(max_size=2)
+    for _ in range(3):
+        df = backend.fetch_page("SELECT N FROM T ORDER BY N", 0, 5)
+        assert len(df) == 6
+    assert backend.metrics()["pool_in_use"] == 0
+
+
+def test_execute_capped_stops_at_the_byte_budget():
+    backend, _ = make_backend()
+    df = backend.execute_capped("SELECT N FROM T", max_rows=100, max_bytes=1)
+    assert len(df) == 10
+    assert backend.metrics()["pool_in_use"] == 0
+
+
+def test_the_first_page_is_limited_on_the_server():
+    backend, connections = make_backend(max_size=1)
+    backend.fetch_page("SELECT N FROM T ORDER BY N;", 0, 5)
+    assert connections[0].statements == ["SELECT * FROM (\nSELECT N FROM T ORDER BY N\n) AS PAGE LIMIT 6 OFFSET 0"]
+
+
+def test_later_pages_scan_one_full_run():
+    backend, connections = make_backend(max_size=1)
+    backend.fetch_page("SELECT N FROM T ORDER BY N", 0, 5)
+    backend.fetch_page("SELECT N FROM T ORDER BY N", 5, 5)
+    backend.fetch_page("SELECT  N FROM T ORDER BY N;", 10, 5)
+    statements = connections[0].statements[1:]
+    assert statements[0] == "SELECT N FROM T ORDER BY N"
+    scanned = {statement.split("'")[1] for statement in statements[1:]}
+    assert len(scanned) == 1
+    assert statements[1] == f"SELECT * FROM TABLE(RESULT_SCAN('{scanned.pop()}')) LIMIT 6 OFFSET 5"
+    assert statements[2].endswith("LIMIT 6 OFFSET 10")
+    assert len(statements) == 3
+
+
+def test_cancelling_needs_no_free_pooled_connection():
+    backend, connections = make_backend(max_size=1)
+    with backend.pool.connection() as busy:
+        backend._cancel_session(busy.session_id)
+        backend._cancel_session(busy.session_id)
+    control = connections[1]
+    assert control.statements == ["SELECT SYSTEM$CANCEL_ALL_QUERIES(%(session)s)"] * 2
+    assert backend.metrics()["pool_size"] == 1 and len(connections) == 2
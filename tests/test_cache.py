@@ -0,0 +1,176 @@
+import os
+
+import pandas as pd
+
+import cache
+from cache import BoundedCache, DiskCache, normalize_sql, page_key, stable_hash
+
+
+def test_normalize_sql_collapses_layout_but_not_literals():
+    assert normalize_sql("SELECT  *\n\tFROM HCD ;\n") == "SELECT * FROM HCD"
+    assert normalize_sql("SELECT 'a  b' FROM \"My  Table\"") == "SELECT 'a  b' FROM \"My  Table\""
+    assert normalize_sql("SELECT 'it''s  here'  ;;") == "SELECT 'it''s  here'"
+
+
+def test_page_key_ignores_layout_but_not_the_page():
+    assert page_key("SELECT  *\nFROM HCD;", 0, 100, 10) == page_key("SELECT * FROM HCD", 0, 100, 10)
+    assert page_key("SELECT * FROM HCD", 0, 100, 10) != page_key("SELECT * FROM HCD", 100, 100, 10)
+
+
+def test_stable_hash_ignores_key_order():
+    assert stable_hash({"a": 1, "b": [1, 2]}) == stable_hash({"b": [1, 2], "a": 1})
+    assert stable_hash({"a": 1}) != stable_hash({"a": 2})
+
+
+def sized_cache(max_bytes: int, ttl=None) -> BoundedCache:
+    return BoundedCache(max_bytes, ttl=ttl, sizeof=len)
+
+
+def test_evicts_least_recently_used_past_the_byte_budget():
+    c = sized_cache(10)
+    c.put("a", "xxxx")
+    c.put("b", "xxxx")
+    assert c.get("a") == "xxxx"  # now "b" is least recently used
+    c.put("c", "xxxx")
+    assert c.get("b") is None
+    assert c.get("a") == "xxxx" and c.get("c") == "xxxx"
+    assert c.nbytes == 8
+    assert c.stats()["evictions"] == 1
+
+
+def test_values_larger_than_the_budget_are_not_stored():
+    c = sized_cache(4)
+    c.put("a", "xxxxx")
+    assert c.get("a") is None
+    assert c.nbytes == 0
+
+
+def test_replacing_a_key_keeps_the_byte_count_right():
+    c = sized_cache(10)
+    c.put("a", "xxxx")
+    c.put("a", "xx")
+    assert c.nbytes == 2
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    c = sized_cache(100, ttl=10)
+    c.put("a", "x")
+    c.put("b", "x", ttl=60)
+    now[0] += 11
+    assert c.get("a") is None
+    assert c.get("b") == "x"
+    assert c.stats()["expirations"] == 1
+    assert c.nbytes == 1
+
+
+def test_a_new_version_invalidates_everything():
+    c = sized_cache(100)
+    c.set_version("v1")
+    c.put("a", "x")
+    c.set_version("v1")
+    assert c.get("a") == "x"
+    c.set_version("v2")
+    assert c.get("a") is None
+    assert c.stats()["invalidations"] == 1
+
+
+def test_get_or_compute_reports_where_the_value_came_from():
+    c = sized_cache(100)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "value"
+
+    assert c.get_or_compute("k", compute) == ("value", "miss")
+    assert c.get_or_compute("k", compute) == ("value", "hit")
+    assert len(calls) == 1
+
+
+def test_frames_are_sized_by_their_memory_use():
+    df = pd.DataFrame({"a": range(1000)})
+    c = BoundedCache(max_bytes=cache.frame_nbytes(df) * 2)
+    c.put(1, df)
+    c.put(2, df)
+    c.put(3, df)
+    assert c.get(1) is None
+    assert c.get(3) is df
+
+
+def test_disk_cache_round_trips_frames_per_version(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=2**20)
+    disk.set_version("v1")
+    df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+    disk.put("k", df)
+    pd.testing.assert_frame_equal(disk.get("k"), df)
+    disk.set_version("v2")
+    assert disk.get("k") is None
+
+
+def test_disk_cache_entries_expire(tmp_path, monkeypatch):
+    disk = DiskCache(str(tmp_path), max_bytes=2**20, ttl=10, codec="json")
+    disk.put("k", {"a": 1})
+    assert disk.get("k") == {"a": 1}
+    later = cache.time.time() + 11
+    monkeypatch.setattr(cache.time, "time", lambda: later)
+    assert disk.get("k") is None
+
+
+def test_disk_cache_evicts_least_recently_read(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=2**20, codec="json")
+    disk.put("old", "x" * 100)
+    disk.put("new", "x" * 100)
+    os.utime(disk._path("old", ".json"), (1, 1))
+    disk.max_bytes = 150
+    disk.put("newest", "x" * 10)
+    assert disk.get("old") is None
+    assert disk.get("new") is not None and disk.get("newest") is not None
+    assert disk.stats()["evictions"] == 1
+
+
+def test_disk_tier_serves_a_fresh_memory_cache(tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"a": 1}
+
+    def two_tier() -> BoundedCache:
+        return BoundedCache(100, sizeof=cache.json_nbytes, disk=DiskCache(str(tmp_path), 2**20, codec="json"))
+
+    assert two_tier().get_or_compute("k", compute) == ({"a": 1}, "miss")
+    assert two_tier().get_or_compute("k", compute) == ({"a": 1}, "disk")
+    assert len(calls) == 1
+
+
+def test_values_the_disk_tier_cannot_write_are_still_returned(tmp_path):
+    two_tier = BoundedCache(2**20, disk=DiskCache(str(tmp_path), 2**20))
+    duplicated = pd.DataFrame([[1, 2]], columns=["N", "N"])
+    mixed = pd.DataFrame({"CODE": ["A", 1]})
+    assert two_tier.get_or_compute("duplicated", lambda: duplicated) == (duplicated, "miss")
+    assert two_tier.get_or_compute("mixed", lambda: mixed) == (mixed, "miss")
+    assert two_tier.stats()["disk"]["errors"] == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith((".arrow", ".tmp"))]
+
+
+def test_eviction_keeps_held_locks_and_removes_stale_ones(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=2**20, codec="json")
+    held, stale = disk._path("held", ".lock"), disk._path("stale", ".lock")
+    with disk._locked(held):
+        open(stale, "a").close()
+        os.utime(held, (1, 1))
+        os.utime(stale, (1, 1))
+        disk.put("k", {"a": 1})
+        assert os.path.exists(held)
+        assert not os.path.exists(stale)
+
+
+def test_acquiring_a_lock_refreshes_its_age(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=2**20, codec="json")
+    path = disk._path("k", ".lock")
+    open(path, "a").close()
+    os.utime(path, (1, 1))
+    with disk._locked(path):
+        assert cache.time.time() - os.stat(path).st_mtime < 3600
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from charting import OTHER_LABEL, additive_columns, downsample_line, is_temporal, lttb, top_n_other
+
+
+def test_lttb_keeps_endpoints_and_extremes():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[437] = 50.0
+    y[812] = -30.0
+    selected = lttb(x, y, 20)
+    assert len(selected) == 20
+    assert selected[0] == 0 and selected[-1] == 999
+    assert 437 in selected and 812 in selected
+    assert np.all(np.diff(selected) > 0)
+
+
+def test_lttb_returns_everything_when_there_is_nothing_to_drop():
+    x = np.arange(10, dtype=float)
+    assert list(lttb(x, x, 10)) == list(range(10))
+    assert list(lttb(x, x, 2)) == list(range(10))
+
+
+def test_downsample_line_sorts_by_x_and_bounds_the_points():
+    df = pd.DataFrame({"YEAR": np.arange(5000)[::-1], "A": np.sin(np.arange(5000) / 100), "B": np.arange(5000)})
+    out = downsample_line(df, ["A", "B"], x="YEAR", max_points=400)
+    assert len(out) <= 400
+    assert out["YEAR"].is_monotonic_increasing
+    assert {0, 4999} <= set(out["YEAR"])
+
+
+def test_downsample_line_leaves_small_frames_alone():
+    df = pd.DataFrame({"A": range(10)})
+    assert downsample_line(df, ["A"], max_points=100) is df
+
+
+def test_top_n_other_leaves_few_labels_untouched():
+    df = pd.DataFrame({"YEAR": [2020, 2021], "SHIPMENTS": [3, 4]}, index=pd.Index(["Kenya", "Kenya"], name="COUNTRY"))
+    out = top_n_other(df, ["YEAR", "SHIPMENTS"], n=5)
+    assert out.equals(df)
+    assert OTHER_LABEL not in out.index
+
+
+def test_top_n_other_folds_the_tail_and_only_sums_measures():
+    labels = [f"C{i}" for i in range(6)] * 2
+    df = pd.DataFrame(
+        {"YEAR": [2020] * 6 + [2021] * 6, "SHIPMENTS": [60, 50, 40, 30, 20, 10] * 2},
+        index=pd.Index(labels, name="COUNTRY"),
+    )
+    out = top_n_other(df, ["YEAR", "SHIPMENTS"], n=3)
+    assert list(out.columns) == ["SHIPMENTS"]
+    assert list(out.index) == ["C0", "C1", "C2", OTHER_LABEL]
+    assert list(out["SHIPMENTS"]) == [120, 100, 80, 120]
+
+
+def test_top_n_other_without_additive_columns_returns_the_frame():
+    df = pd.DataFrame({"AVERAGE_DAYS_LATE": range(10)}, index=[f"C{i}" for i in range(10)])
+    assert top_n_other(df, ["AVERAGE_DAYS_LATE"], n=3).equals(df)
+
+
+def test_additive_columns_drops_years_times_and_averages():
+    columns = ["SHIPMENTS", "DELIVERY_YEAR", "ORDER_CYCLE_TIME", "AVG_QTY", "ON_TIME_RATE", "QUANTITY"]
+    assert additive_columns(columns) == ["SHIPMENTS", "QUANTITY"]
+
+
+def test_timelines_are_not_folded():
+    days = pd.date_range("2024-01-01", periods=60, freq="D")
+    by_date = pd.DataFrame({"SHIPMENTS": range(60)}, index=days)
+    assert top_n_other(by_date, ["SHIPMENTS"], n=5).equals(by_date)
+    by_name = pd.DataFrame({"SHIPMENTS": range(60)}, index=pd.Index([str(day.date()) for day in days], name="DELIVERY_DATE"))
+    assert top_n_other(by_name, ["SHIPMENTS"], n=5).equals(by_name)
+
+
+def test_is_temporal_judges_by_dtype_or_name():
+    assert is_temporal(pd.DatetimeIndex(["2024-01-01"]))
+    assert is_temporal(pd.Index([2020, 2021], name="FISCAL_YEAR"))
+    assert not is_temporal(pd.Index(["Kenya"], name="COUNTRY"))
@@ -0,0 +1,114 @@
+import duckdb
+import pandas as pd
+import pytest
+
+from cube import CUBE_QUERY, ShipmentCube
+from queries import FilterState, compile_query
+
+ROWS = [
+    # COUNTRY, D365_HEALTH_ELEMENT, LATEST_ACTUAL_DELIVERY_DATE_YEAR
+    ("Kenya", "Malaria", 2020), ("Kenya", "Malaria", 2020), ("Kenya", "HIV", 2021),
+    ("Kenya", "Family Planning", 2022), ("Kenya", "Malaria", None), ("Kenya", None, 2023),
+    ("Ghana", "Malaria", 2022), ("Ghana", "Malaria", 2023), ("Ghana", "Tuberculosis", 2023),
+    ("Ghana", "Family Planning", None), ("Peru", "HIV", 2019), ("Peru", "Family Planning", 2024),
+]
+
+FILTERS = [
+    FilterState(),
+    FilterState(years=(2020, 2023)),
+    FilterState(years=(2021,)),
+    FilterState(health_element="Malaria"),
+    FilterState(country="Kenya"),
+    FilterState(years=(2022, 2023), country="Ghana"),
+    FilterState(country="Nowhere"),
+    FilterState(years=(1999,)),
+]
+
+EXCLUDED = "D365_HEALTH_ELEMENT NOT IN ('HIV', 'Population TO3', '311Mission', 'Tuberculosis')"
+
+
+@pytest.fixture(scope="module")
+def hcd():
+    con = duckdb.connect()
+    con.register("HCD", pd.DataFrame(ROWS, columns=["COUNTRY", "D365_HEALTH_ELEMENT", "LATEST_ACTUAL_DELIVERY_DATE_YEAR"]))
+    return con
+
+
+@pytest.fixture(scope="module")
+def cube(hcd):
+    sql, params = compile_query(CUBE_QUERY)
+    assert not params
+    return ShipmentCube(hcd.execute(sql).df())
+
+
+def where(filters: FilterState, years: bool = True) -> str:
+    """The WHERE conditions the dashboard's original queries built from the filter panel."""
+    conditions = ["1=1"]
+    if years and filters.years is not None:
+        conditions.append(f"LATEST_ACTUAL_DELIVERY_DATE_YEAR IN ({','.join(map(str, filters.years))})")
+    if filters.health_element is not None:
+        conditions.append(f"D365_HEALTH_ELEMENT = '{filters.health_element}'")
+    if filters.country is not None:
+        conditions.append(f"COUNTRY = '{filters.country}'")
+    return " AND ".join(conditions)
+
+
+def rows(df: pd.DataFrame) -> set:
+    return {tuple(None if pd.isna(value) else value for value in row) for row in df.itertuples(index=False)}
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_kpis_match_the_original_queries(hcd, cube, filters):
+    total, countries, min_year, max_year = hcd.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT COUNTRY), MIN(LATEST_ACTUAL_DELIVERY_DATE_YEAR), "
+        f"MAX(LATEST_ACTUAL_DELIVERY_DATE_YEAR) FROM HCD WHERE {where(filters)}"
+    ).fetchone()
+    assert cube.total_shipments(filters) == total
+    assert cube.countries_supported(filters) == countries
+    # No health element exclusion, and NULL years don't count
+    assert cube.year_range(filters) == (min_year, max_year)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_charts_match_the_original_queries(hcd, cube, filters):
+    expected = hcd.execute(
+        "SELECT D365_HEALTH_ELEMENT, COUNT(*) FROM HCD "
+        f"WHERE {EXCLUDED} AND {where(filters)} GROUP BY D365_HEALTH_ELEMENT"
+    ).df()
+    assert rows(cube.by_health_element(filters)) == rows(expected)
+
+    expected = hcd.execute(
+        "SELECT COUNTRY, COUNT(*), COUNT(DISTINCT D365_HEALTH_ELEMENT) FROM HCD "
+        f"WHERE {where(filters)} AND {EXCLUDED} GROUP BY COUNTRY"
+    ).df()
+    totals = cube.country_totals(filters)
+    assert rows(totals[["COUNTRY", "SHIPMENT_COUNT", "HEALTH_ELEMENTS_COUNT"]]) == rows(expected)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_period_charts_ignore_the_year_selection(hcd, cube, filters):
+    expected = hcd.execute(
+        "SELECT COUNTRY, COUNT(*) FROM HCD WHERE LATEST_ACTUAL_DELIVERY_DATE_YEAR >= 2022 "
+        f"AND {where(filters, years=False)} AND {EXCLUDED} GROUP BY COUNTRY"
+    ).df()
+    assert rows(cube.recent_country_totals(filters, since_year=2022, limit=10)) == rows(expected)
+
+    expected = hcd.execute(
+        "SELECT LATEST_ACTUAL_DELIVERY_DATE_YEAR, D365_HEALTH_ELEMENT, COUNT(*) FROM HCD "
+        f"WHERE {EXCLUDED} AND {where(filters, years=False)} "
+        "GROUP BY LATEST_ACTUAL_DELIVERY_DATE_YEAR, D365_HEALTH_ELEMENT"
+    ).df()
+    yearly = cube.yearly_health(filters)
+    assert rows(yearly) == rows(expected)
+    assert yearly["DELIVERY_YEAR"].dropna().is_monotonic_increasing
+
+
+def test_null_years_are_kept_in_the_yearly_chart(cube):
+    yearly = cube.yearly_health(FilterState(years=(2020,)))
+    assert yearly["DELIVERY_YEAR"].isna().any()
+
+
+def test_an_empty_selection_has_no_year_range(cube):
+    assert cube.year_range(FilterState(country="Nowhere")) == (None, None)
+    assert cube.total_shipments(FilterState(country="Nowhere")) == 0
+    assert cube.countries_supported(FilterState(years=(1999,))) == 0
@@ -0,0 +1,73 @@
+import duckdb
+import pandas as pd
+
+from delays import DelayCube, bucket_label, load_code_lookup
+from queries import DELAY_BUCKETS, DIMENSIONS, EXCLUDED_HEALTH_ELEMENTS, FilterState
+
+
+def test_bucket_labels_carry_no_unit():
+    assert [bucket_label(lower) for lower in DELAY_BUCKETS] == [
+        "under 1", "1-9", "10-99", "100-999", "1,000-9,999", "10,000-99,999", "100,000+",
+    ]
+
+
+def test_reason_durations_bucket_by_order_of_magnitude():
+    sql = f"SELECT {DIMENSIONS['DELAY_BUCKET']} FROM (VALUES ('-3'), ('0.5'), ('7'), ('27852.0'), ('1e6'), (NULL), ('n/a')) AS T(REASON_CODE_DURATION)"
+    assert [row[0] for row in duckdb.sql(sql).fetchall()] == [0, 0, 1, 10_000, 100_000, None, None]
+
+
+def test_load_code_lookup_cleans_the_export(tmp_path):
+    path = tmp_path / "code_lookup.csv"
+    path.write_text(
+        " code , Name ,Definition\n"
+        "CODE,NAME,DEFINITION\n"
+        "Code,Name,Definition\n"
+        " UD100 ,  Late vendor ,Vendor shipped late\n"
+        "AD010,USAID-authorized change,Authorized\n"
+        "UD100,Duplicate,Ignored\n"
+        ",Blank,No code\n"
+        "XX001,Unknown prefix,Other\n"
+    )
+    lookup = load_code_lookup(str(path))
+    assert list(lookup.columns) == ["NAME", "DEFINITION", "CATEGORY"]
+    assert list(lookup.index) == ["AD010", "UD100", "XX001"]
+    assert lookup.loc["UD100", "NAME"] == "Late vendor"
+    assert list(lookup["CATEGORY"]) == ["Acceptable", "Unacceptable", "Other"]
+
+
+LOOKUP = pd.DataFrame(
+    {"NAME": ["Authorized", "Late vendor"], "DEFINITION": ["", ""], "CATEGORY": ["Acceptable", "Unacceptable"]},
+    index=pd.Index(["AD010", "UD100"], name="CODE"),
+)
+
+DELAYS = pd.DataFrame({
+    "REASON_CODE": ["UD100", "UD100", "AD010", "ZZ999", "UD100"],
+    "COUNTRY": ["Kenya", "Zambia", "Kenya", "Kenya", "Kenya"],
+    "HEALTH_ELEMENT": ["HIV/AIDS", "HIV/AIDS", "HIV/AIDS", "HIV/AIDS", EXCLUDED_HEALTH_ELEMENTS[0]],
+    "DELIVERY_YEAR": [2020, 2021, 2020, 2021, 2020],
+    "DELAY_BUCKET": [10, 10, 0, 1000, 10],
+    "SHIPMENT_COUNT": [4, 3, 2, 1, 50],
+    "REASON_DURATION_TOTAL": [40.0, 60.0, None, 1500.0, 500.0],
+    "REASON_DURATION_COUNT": [4, 3, 0, 1, 50],
+})
+
+
+def test_delay_cube_counts_reasons_of_charted_elements():
+    reasons = DelayCube(DELAYS, LOOKUP).by_reason(FilterState())
+    assert list(reasons["REASON_CODE"]) == ["UD100", "AD010", "ZZ999"]
+    assert list(reasons["SHIPMENT_COUNT"]) == [7, 2, 1]
+    assert list(reasons["REASON_NAME"]) == ["Late vendor", "Authorized", "ZZ999"]
+    assert list(reasons["CATEGORY"]) == ["Unacceptable", "Acceptable", "Other"]
+    assert reasons["MEAN_REASON_DURATION"][0] == 100 / 7
+    assert pd.isna(reasons["MEAN_REASON_DURATION"][1])
+
+
+def test_delay_cube_buckets_durations_under_the_filters():
+    cube = DelayCube(DELAYS, LOOKUP)
+    everything = cube.duration_distribution(FilterState())
+    assert list(everything["DELAY_BUCKET"]) == [0, 10, 1000]
+    assert list(everything["SHIPMENT_COUNT"]) == [2, 7, 1]
+    assert list(everything["DURATION"]) == ["under 1", "10-99", "1,000-9,999"]
+    kenya_2020 = cube.duration_distribution(FilterState(years=(2020,), country="Kenya"))
+    assert list(kenya_2020["SHIPMENT_COUNT"]) == [2, 4]
+    assert list(cube.duration_distribution(FilterState(), codes=["UD100"])["SHIPMENT_COUNT"]) == [7]
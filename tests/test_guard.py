@@ -0,0 +1,83 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from backends import QueryBackend, bound
+from guard import GuardError, GuardLimits, check_cost, guarded_page, run_guarded
+
+
+class FakeBackend(QueryBackend):
+    name = "fake"
+
+    def __init__(self, estimate=None, block=False) -> None:
+        self.estimate = estimate or {"bytes": None, "rows": None}
+        self.block = block
+        self.explained = []
+        self.pages = []
+        self.cancelled = threading.Event()
+
+    def explain(self, sql):
+        self.explained.append(sql)
+        return self.estimate
+
+    def fetch_page(self, sql, offset, limit, max_bytes=None, handle=None):
+        self.pages.append(offset)
+        with bound(handle, self.cancelled.set):
+            if self.block:
+                self.cancelled.wait(5)
+            return pd.DataFrame({"N": range(offset, offset + limit + 1)})
+
+
+def test_check_cost_enforces_each_budget():
+    limits = GuardLimits(max_scan_bytes=2**20, max_scan_rows=1000)
+    check_cost({"bytes": 2**20, "rows": 1000}, limits)
+    check_cost({}, limits)
+    with pytest.raises(GuardError) as e:
+        check_cost({"bytes": 2**20 + 1}, limits)
+    assert e.value.guard == "cost"
+    with pytest.raises(GuardError):
+        check_cost({"rows": 1001}, limits)
+    check_cost({"bytes": 2**40, "rows": 10**9}, GuardLimits())
+
+
+def test_run_guarded_times_out_and_cancels():
+    backend = FakeBackend(block=True)
+    with pytest.raises(GuardError) as e:
+        run_guarded(lambda handle: backend.fetch_page("SELECT 1", 0, 5, handle=handle), timeout=0.05, poll_interval=0.01)
+    assert e.value.guard == "timeout"
+    assert backend.cancelled.wait(1)
+
+
+def test_an_interrupted_wait_cancels_and_propagates():
+    backend = FakeBackend(block=True)
+
+    def heartbeat(elapsed):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run_guarded(lambda handle: backend.fetch_page("SELECT 1", 0, 5, handle=handle), heartbeat=heartbeat, poll_interval=0.01)
+    assert backend.cancelled.wait(1)
+
+
+def test_run_guarded_returns_the_result_and_reraises_errors():
+    assert run_guarded(lambda handle: 42, poll_interval=0.01) == 42
+    with pytest.raises(ZeroDivisionError):
+        run_guarded(lambda handle: 1 / 0, poll_interval=0.01)
+
+
+def test_guarded_page_explains_only_the_first_page():
+    backend = FakeBackend(estimate={"bytes": 100, "rows": 10})
+    estimates = []
+    guarded_page(backend, "SELECT N FROM T", 0, 5, 2**20, GuardLimits(), on_estimate=estimates.append)
+    guarded_page(backend, "SELECT N FROM T", 5, 5, 2**20, GuardLimits(), on_estimate=estimates.append)
+    assert backend.explained == ["SELECT N FROM T"]
+    assert estimates == [{"bytes": 100, "rows": 10}]
+    assert backend.pages == [0, 5]
+
+
+def test_guarded_page_does_not_run_an_over_budget_statement():
+    backend = FakeBackend(estimate={"bytes": 2**30, "rows": None})
+    with pytest.raises(GuardError):
+        guarded_page(backend, "SELECT N FROM T", 0, 5, 2**20, GuardLimits(max_scan_bytes=2**20))
+    assert backend.pages == []
@@ -0,0 +1,66 @@
+import pytest
+
+from queries import EXCLUDED_HEALTH_ELEMENTS, FilterState, Query, compile_query
+
+
+def test_from_selection_canonicalizes_widget_values():
+    assert FilterState.from_selection([2021, "2020", 2021], "All", "All") == FilterState(years=(2020, 2021))
+    assert FilterState.from_selection([], None, "Kenya") == FilterState(country="Kenya")
+
+
+def test_equal_filter_states_compile_to_identical_sql():
+    query = Query(dimensions=("COUNTRY",), measures=("SHIPMENT_COUNT",))
+    a = Query(**{**query.__dict__, "filters": FilterState.from_selection([2021, 2020], "Malaria", None)})
+    b = Query(**{**query.__dict__, "filters": FilterState.from_selection([2020, 2021, 2020], "Malaria", "All")})
+    assert compile_query(a) == compile_query(b)
+
+
+def test_filters_become_sorted_predicates_with_binds():
+    query = Query(
+        dimensions=("COUNTRY",),
+        measures=("SHIPMENT_COUNT",),
+        filters=FilterState(years=(2020, 2021), country="Kenya"),
+        non_null=("COUNTRY",),
+        order_by=("SHIPMENT_COUNT DESC",),
+        limit=10,
+    )
+    sql, params = compile_query(query)
+    assert sql == (
+        "SELECT COUNTRY, COUNT(*) AS SHIPMENT_COUNT\n"
+        "FROM HCD\n"
+        "WHERE COUNTRY = %(country)s AND COUNTRY IS NOT NULL"
+        " AND LATEST_ACTUAL_DELIVERY_DATE_YEAR IN (%(delivery_year_0)s, %(delivery_year_1)s)\n"
+        "GROUP BY COUNTRY\n"
+        "ORDER BY SHIPMENT_COUNT DESC\n"
+        "LIMIT 10"
+    )
+    assert params == {"country": "Kenya", "delivery_year_0": 2020, "delivery_year_1": 2021}
+
+
+def test_excluded_health_elements_are_bound():
+    sql, params = compile_query(Query(measures=("SHIPMENT_COUNT",), exclude_health_elements=True))
+    assert "D365_HEALTH_ELEMENT NOT IN (" in sql
+    assert sorted(params.values()) == sorted(set(EXCLUDED_HEALTH_ELEMENTS))
+
+
+def test_rollup_mode_uses_logical_columns_and_reaggregates():
+    query = Query(
+        dimensions=("DELIVERY_YEAR",),
+        measures=("SHIPMENT_COUNT",),
+        filters=FilterState(health_element="Malaria"),
+    )
+    sql, params = compile_query(query, table="ROLLUP_1", rollup=True)
+    assert sql == (
+        "SELECT DELIVERY_YEAR, SUM(SHIPMENT_COUNT) AS SHIPMENT_COUNT\n"
+        "FROM ROLLUP_1\n"
+        "WHERE HEALTH_ELEMENT = %(health_element)s\n"
+        "GROUP BY DELIVERY_YEAR"
+    )
+    assert params == {"health_element": "Malaria"}
+    assert query.required_dimensions() == {"DELIVERY_YEAR", "HEALTH_ELEMENT"}
+
+
+@pytest.mark.parametrize("order_by", ["COUNTRY", "SHIPMENT_COUNT; DROP TABLE HCD", "SHIPMENT_COUNT SIDEWAYS"])
+def test_order_by_must_name_an_output(order_by):
+    with pytest.raises(ValueError):
+        compile_query(Query(dimensions=("DELIVERY_YEAR",), measures=("SHIPMENT_COUNT",), order_by=(order_by,)))
@@ -0,0 +1,45 @@
+from refresh import Refresher
+
+
+class Source:
+    def __init__(self):
+        self.version = "v1"
+        self.builds = []
+        self.fail = False
+
+    def probe(self):
+        return self.version
+
+    def build(self, version):
+        if self.fail:
+            raise RuntimeError("warehouse unavailable")
+        self.builds.append(version)
+        return f"aggregates@{version}"
+
+
+def test_swaps_only_when_the_version_changes():
+    source = Source()
+    refresher = Refresher(source.probe, source.build, interval=3600)
+    first = refresher.get()
+    assert first.value == "aggregates@v1"
+    assert refresher.check() is False
+    assert refresher.get() is first
+    source.version = "v2"
+    assert refresher.check() is True
+    assert refresher.get().data_version == "v2"
+    assert refresher.get().value == "aggregates@v2"
+    assert source.builds == ["v1", "v2"]
+
+
+def test_a_failed_build_keeps_the_old_snapshot():
+    source = Source()
+    refresher = Refresher(source.probe, source.build, interval=3600)
+    first = refresher.get()
+    source.version, source.fail = "v2", True
+    assert refresher.check() is False
+    assert refresher.get() is first
+    assert isinstance(refresher.last_error, RuntimeError)
+    source.fail = False
+    assert refresher.check() is True
+    assert refresher.get().value == "aggregates@v2"
+    assert refresher.last_error is None
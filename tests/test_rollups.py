@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from backends import DuckDBBackend
+from catalog import CATALOG_QUERIES
+from cube import CUBE_QUERY
+from delays import DELAY_QUERY
+from queries import FilterState, Query, compile_query
+from rollups import build_rollups, route
+from synthetic import write_parquet
+
+FILTERS = [
+    FilterState(),
+    FilterState(years=(2018, 2020)),
+    FilterState(health_element="HIV/AIDS"),
+    FilterState(country="Kenya"),
+    FilterState(years=(2019, 2020), health_element="Family Planning and Reproduction", country="Zambia"),
+]
+
+QUERIES = [CUBE_QUERY, DELAY_QUERY, *CATALOG_QUERIES.values()]
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("hcd") / "hcd.parquet")
+    write_parquet(path, 5_000, start_year=2016, end_year=2021)
+    backend = DuckDBBackend(path)
+    return backend, build_rollups(backend)
+
+
+def canonical(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.astype(object).where(df.notna(), None)
+    return df.sort_values(list(df.columns), key=lambda column: column.astype(str)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("query", QUERIES, ids=lambda query: "_".join(query.dimensions))
+def test_routed_queries_match_raw_hcd(snapshot, query, filters):
+    backend, rollups = snapshot
+    query = Query(**{**query.__dict__, "filters": filters})
+    sql, params = route(query, rollups)
+    assert "HCD_ROLLUP_" in sql
+    raw = backend.execute(*compile_query(query))
+    assert not raw.empty
+    routed = backend.execute(sql, params)
+    pd.testing.assert_frame_equal(canonical(routed), canonical(raw), check_dtype=False)
+
+
+def test_the_smallest_qualifying_rollup_wins(snapshot):
+    sql, _ = route(Query(dimensions=("COUNTRY",), measures=("SHIPMENT_COUNT",)), snapshot[1])
+    assert "FROM HCD_ROLLUP_COUNTRY\n" in sql
+
+
+def test_queries_no_rollup_keeps_go_to_raw_hcd(snapshot):
+    query = Query(dimensions=("COUNTRY",), measures=("SHIPMENT_COUNT",), non_null=("REASON_CODE",), filters=FilterState(years=(2020,)))
+    # Only the largest rollup keeps REASON_CODE
+    sql, _ = route(query, snapshot[1][1:])
+    assert "FROM HCD\n" in sql
@@ -0,0 +1,49 @@
+import decimal
+
+import pandas as pd
+import pyarrow as pa
+
+from semantic import concat_frames, frame_from_arrow
+
+
+def test_numeric_text_columns_become_numbers():
+    df = frame_from_arrow(pa.table({"REASON_CODE_DURATION": ["27852.0", "7", None]}))
+    assert pd.api.types.is_float_dtype(df["REASON_CODE_DURATION"])
+    assert df["REASON_CODE_DURATION"].iloc[0] == 27852.0
+
+
+def test_unparseable_numeric_text_is_left_alone():
+    df = frame_from_arrow(pa.table({"REASON_CODE_DURATION": ["12", "n/a"]}))
+    assert list(df["REASON_CODE_DURATION"]) == ["12", "n/a"]
+
+
+def test_date_text_columns_are_parsed():
+    for values in (["03-03-2017", "12-20-2019"], ["2017-03-03", "2019-12-20"]):
+        df = frame_from_arrow(pa.table({"LATEST_ACTUAL_DELIVERY_DATE": values}))
+        assert pd.api.types.is_datetime64_any_dtype(df["LATEST_ACTUAL_DELIVERY_DATE"])
+        assert df["LATEST_ACTUAL_DELIVERY_DATE"].iloc[1] == pd.Timestamp(2019, 12, 20)
+
+
+def test_repetitive_text_is_dictionary_encoded():
+    df = frame_from_arrow(pa.table({"COUNTRY": ["Kenya", "Ghana"] * 10, "ROPOLINE": [f"R{i}" for i in range(20)]}))
+    assert isinstance(df["COUNTRY"].dtype, pd.CategoricalDtype)
+    # Too many distinct values to pay off, and not a declared category
+    assert not isinstance(df["ROPOLINE"].dtype, pd.CategoricalDtype)
+
+
+def test_integers_and_decimals_are_downcast():
+    df = frame_from_arrow(pa.table({
+        "SHIPPED_QUANTITY": pa.array([1, 200], pa.int64()),
+        "LINE_COUNT": pa.array([decimal.Decimal(3), decimal.Decimal(40_000)], pa.decimal128(38, 0)),
+        "UNIT_PRICE": pa.array([decimal.Decimal("1.25")], pa.decimal128(10, 2)).take([0, 0]),
+    }))
+    assert df["SHIPPED_QUANTITY"].dtype == "int16"
+    assert df["LINE_COUNT"].dtype == "int32"
+    assert df["UNIT_PRICE"].dtype == "float64"
+
+
+def test_concat_frames_keeps_categories_across_pages():
+    pages = [frame_from_arrow(pa.table({"COUNTRY": [name] * 4})) for name in ("Kenya", "Ghana")]
+    df = concat_frames(pages)
+    assert isinstance(df["COUNTRY"].dtype, pd.CategoricalDtype)
+    assert set(df["COUNTRY"].cat.categories) == {"Kenya", "Ghana"}
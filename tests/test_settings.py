@@ -0,0 +1,16 @@
+from settings import load_secrets, parse_secrets
+
+
+def test_secret_overrides_decode_numbers_and_booleans():
+    assert parse_secrets(["QUERY_BACKEND=duckdb", "QUERY_WORKERS=8", "ANALYST_STREAMING=true", "DIR=a=b"]) == {
+        "QUERY_BACKEND": "duckdb",
+        "QUERY_WORKERS": 8,
+        "ANALYST_STREAMING": True,
+        "DIR": "a=b",
+    }
+
+
+def test_load_secrets_reads_toml(tmp_path):
+    path = tmp_path / "secrets.toml"
+    path.write_text('QUERY_BACKEND = "duckdb"\nQUERY_WORKERS = 4\n')
+    assert load_secrets(str(path)) == {"QUERY_BACKEND": "duckdb", "QUERY_WORKERS": 4}
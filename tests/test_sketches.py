@@ -0,0 +1,72 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+from queries import FilterState
+from sketches import RELATIVE_ACCURACY, DurationSketches, Sketch, bucket_sql, bucket_values, sketch_query
+
+QS = (0.0, 0.1, 0.5, 0.9, 0.99, 1.0)
+
+
+def random_durations(size: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    magnitudes = rng.lognormal(mean=4, sigma=1.5, size=size) + 1
+    return np.where(rng.random(size) < 0.2, -magnitudes, magnitudes)
+
+
+def bucket_keys(values: np.ndarray) -> np.ndarray:
+    relation = duckdb.from_df(pd.DataFrame({"V": values}))
+    return relation.query("durations", f"SELECT {bucket_sql('V')} FROM durations").df().iloc[:, 0].to_numpy()
+
+
+def sketch_of(values: np.ndarray) -> Sketch:
+    keys, counts = np.unique(bucket_keys(values).astype(np.int64), return_counts=True)
+    return Sketch(keys, counts)
+
+
+def assert_close(estimates: np.ndarray, actual: np.ndarray) -> None:
+    assert np.all(np.abs(estimates - actual) <= RELATIVE_ACCURACY * np.abs(actual) + 1e-9)
+
+
+def test_bucket_values_are_within_the_accuracy_of_their_members():
+    values = random_durations(10_000)
+    assert_close(bucket_values(bucket_keys(values)), values)
+
+
+def test_durations_under_one_either_way_share_the_zero_bucket():
+    assert list(bucket_keys(np.array([-0.5, 0.0, 0.99, np.nan]))[:3]) == [0, 0, 0]
+    assert bucket_values(np.array([0]))[0] == 0.0
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_quantiles_match_exact_quantiles(seed):
+    values = random_durations(5_000, seed)
+    # Sketch ranks pick an observed value, like method="lower"
+    assert_close(sketch_of(values).quantiles(QS), np.quantile(values, QS, method="lower"))
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert np.isnan(Sketch(np.array([], dtype=np.int64), np.array([], dtype=np.int64)).quantiles([0.5])).all()
+
+
+def test_merged_cells_give_the_quantiles_of_the_combined_data():
+    values = random_durations(6_000)
+    hcd = pd.DataFrame({
+        "COUNTRY": np.repeat(["Kenya", "Ghana", "Peru"], 2_000),
+        "D365_HEALTH_ELEMENT": "Malaria",
+        "LATEST_ACTUAL_DELIVERY_DATE_YEAR": np.tile([2020, 2021], 3_000),
+        "ORDER_CYCLE_TIME": values,
+    })
+    query = sketch_query(["ORDER_CYCLE_TIME"], table="hcd")
+    cells = DurationSketches(duckdb.from_df(hcd).query("hcd", query).df())
+    assert len(cells.data.groupby(["COUNTRY", "DELIVERY_YEAR"], observed=True)) == 6
+
+    merged = cells.percentiles(FilterState(), qs=QS).iloc[0]
+    assert merged["COUNT"] == len(values)
+    assert_close(merged[[f"P{q * 100:g}" for q in QS]].to_numpy(float), np.quantile(values, QS, method="lower"))
+
+    kenya = cells.sketches(FilterState(country="Kenya", years=(2021,)))["ORDER_CYCLE_TIME"]
+    selected = values[(hcd["COUNTRY"] == "Kenya").to_numpy() & (hcd["LATEST_ACTUAL_DELIVERY_DATE_YEAR"] == 2021).to_numpy()]
+    assert kenya.count == len(selected)
+    assert_close(kenya.quantiles(QS), np.quantile(selected, QS, method="lower"))